@@ -0,0 +1,206 @@
+import asyncio
+from ChatClient import *
+
+##############################################################################################################
+
+class CRCClientProtocol(asyncio.BufferedProtocol):
+    """ CRCClientProtocol is the connection between an AsyncCRCClient and its server. The transport reads
+    straight into the client's FrameDecoder buffer and the received bytes are passed to the client's
+    handle_messages(), exactly as CRCClient does. pause_writing() and resume_writing() tell the client when
+    the transport's buffer is full, so the async send methods can wait for it to drain.
+    """
+    def __init__(self, client):
+        self.client = client
+
+    def connection_made(self, transport):
+        self.client.transport = transport
+
+    def get_buffer(self, sizehint):
+        return self.client.frame_decoder.get_buffer()
+
+    def buffer_updated(self, nbytes):
+        self.client.handle_messages(self.client.frame_decoder.buffer_updated(nbytes))
+
+    def pause_writing(self):
+        self.client.write_resumed = self.client.loop.create_future()
+
+    def resume_writing(self):
+        if self.client.write_resumed and not self.client.write_resumed.done():
+            self.client.write_resumed.set_result(None)
+        self.client.write_resumed = None
+
+    def connection_lost(self, exc):
+        self.resume_writing()
+        self.client.connection_lost()
+
+##############################################################################################################
+
+class AsyncCRCClient(CRCClient):
+    """ AsyncCRCClient is a CRCClient for asyncio programs. Instead of run(), await connect() to connect and
+    register, and then use the async versions of message_other_client() and quit(). Chat and status messages
+    received from the server can be read with:
+
+        async for message in client.messages():
+            ...
+
+    The message handlers, logs and connected_user_ids work exactly as they do for CRCClient. Messages are 
+    kept until they are read. Once MAX_INCOMING of them are waiting, the client stops reading from the server
+    until messages() has caught up to half that many, so a client that never reads them stops receiving.
+
+    Writes are pipelined. Every message sent during one pass of the event loop is joined and handed to the
+    transport in a single write once the pass ends, so a burst of thousands of messages takes a handful of
+    system calls rather than one each. The async send methods only wait when the transport's buffer is full.
+    """
+
+    # Pending messages are written out early once this many bytes are waiting
+    MAX_PENDING_BYTES = 65536
+    # Reading from the server is paused once this many received messages are waiting for messages()
+    MAX_INCOMING = 1024
+
+    def __init__(self, options, run_on_localhost=False):
+        super().__init__(options, run_on_localhost)
+        self.loop = None
+        self.transport = None
+        self.pending = []                       # Messages waiting for the end of this pass of the event loop
+        self.pending_bytes = 0
+        self.flush_scheduled = False
+        self.write_resumed = None               # Set while the transport's buffer is full
+        self.incoming = None                    # Chat and status messages not yet read through messages()
+        self.reading_paused = False             # Set while incoming holds MAX_INCOMING messages
+        self.closed = None                      # Resolved once the connection to the server is lost
+
+    async def connect(self):
+        self.loop = asyncio.get_running_loop()
+        self.incoming = asyncio.Queue()
+        self.closed = self.loop.create_future()
+        self.print_info("Launching client %s..." % (self.client_name))
+        await self.loop.create_connection(lambda: CRCClientProtocol(self), self.serveraddr, int(self.serverport))
+
+        if self.presence_ids is not None:
+            self.subscribe(self.presence_ids)
+        self.send_message_to_server(ClientRegistrationMessage.bytes(self.id, 0, self.client_name, self.info))
+        await self.drain()
+
+    # Connects and then waits until the connection is closed, on an event loop of its own. This lets an
+    # AsyncCRCClient be run from a thread like a CRCClient.
+    def run(self):
+        async def run_until_closed():
+            await self.connect()
+            await self.wait_closed()
+        asyncio.run(run_until_closed())
+
+    # Closes the connection to the server. Safe to call from any thread
+    def stop(self):
+        self.request_terminate = True
+        if self.loop and self.transport:
+            try:
+                self.loop.call_soon_threadsafe(self.transport.close)
+            except RuntimeError:
+                # The loop has already finished
+                pass
+        self.close_message_logs()
+
+    # The client runs on an asyncio event loop, which stop() hands the close to, so it is never woken up
+    def new_wakeup_channel(self):
+        return None
+
+    async def wait_closed(self):
+        await asyncio.shield(self.closed)
+
+    def connection_lost(self):
+        self.print_info("Server has disconnected!")
+        self.request_terminate = True
+        self.pending.clear()
+        self.incoming.put_nowait(None)
+        if not self.closed.done():
+            self.closed.set_result(None)
+
+    # Yields every chat and status message received from the server, until the connection is closed
+    async def messages(self):
+        while True:
+            message = await self.incoming.get()
+            if self.reading_paused and self.incoming.qsize() <= self.MAX_INCOMING // 2:
+                self.reading_paused = False
+                self.transport.resume_reading()
+            if message is None:
+                # Let any other reader see the end of the connection too
+                self.incoming.put_nowait(None)
+                return
+            yield message
+
+
+    ######################################################################
+    # This block of functions pipelines messages to the server
+
+    # Queues a message to be written at the end of this pass of the event loop. Must be called from the
+    # thread running the loop.
+    def send_message_to_server(self, message):
+        self.print_info("Sending message to " + str(message))
+        if self.transport is None or self.transport.is_closing():
+            return
+        self.pending.append(message)
+        self.pending_bytes += len(message)
+        if self.pending_bytes >= self.MAX_PENDING_BYTES:
+            self.flush()
+        elif not self.flush_scheduled:
+            self.flush_scheduled = True
+            self.loop.call_soon(self.flush)
+
+    # Hands every pending message to the transport in one write
+    def flush(self):
+        self.flush_scheduled = False
+        if self.pending and not self.transport.is_closing():
+            self.transport.write(b''.join(self.pending))
+        self.pending.clear()
+        self.pending_bytes = 0
+
+    # Writes out the pending messages and waits if the transport's buffer is full
+    async def drain(self):
+        self.flush()
+        if self.write_resumed is not None:
+            await self.write_resumed
+
+    # Waits only if the transport's buffer is full, so that a burst of sends is written out together
+    async def wait_for_room(self):
+        if self.write_resumed is not None:
+            await self.write_resumed
+
+
+    ######################################################################
+    # Message handlers. Chat and status messages are also made available through messages()
+
+    # The None that marks the end of the connection is put on incoming directly, since it must never be held up
+    def deliver(self, message):
+        self.incoming.put_nowait(message)
+        if self.incoming.qsize() >= self.MAX_INCOMING and not self.reading_paused:
+            self.reading_paused = True
+            self.transport.pause_reading()
+
+    def handle_status_message(self, message):
+        super().handle_status_message(message)
+        self.deliver(message)
+
+    def handle_client_chat_message(self, message):
+        super().handle_client_chat_message(message)
+        self.deliver(message)
+
+    def handle_channel_chat_message(self, message):
+        super().handle_channel_chat_message(message)
+        self.deliver(message)
+
+
+    ######################################################################
+    # Async versions of the CRCClient send methods
+
+    async def message_other_client(self, destination_id, chat_message):
+        super().message_other_client(destination_id, chat_message)
+        await self.wait_for_room()
+
+    async def message_channel(self, channel_id, chat_message):
+        super().message_channel(channel_id, chat_message)
+        await self.wait_for_room()
+
+    # Sends the quit message and waits until it has been handed to the transport
+    async def quit(self, quit_message=''):
+        super().quit(quit_message)
+        await self.drain()
@@ -0,0 +1,231 @@
+import asyncio
+import selectors
+import threading
+from ChatServer import *
+
+##############################################################################################################
+
+class AsyncioConnectionRegistry():
+    """ AsyncioConnectionRegistry stands in for the selector when a CRCServer runs on the asyncio engine. asyncio
+    owns the sockets and decides when they are read from and written to, so nothing here ever calls select().
+    What the registry does provide is the same bookkeeping a selector offers (register(), unregister(), modify(),
+    get_key() and get_map(), plus the _fd_to_key dictionary that the test harness inspects), keyed by the 
+    CRCServerProtocol object that represents each connection. This lets the message handlers, 
+    update_connection_data() and queue_message() work on either engine without any changes. Removing 
+    EVENT_READ from a connection's events with modify() pauses reading from its transport, and adding it back 
+    resumes it, which is how the server's backpressure is applied on this engine.
+    """
+    def __init__(self):
+        self._fd_to_key = {}
+
+    def register(self, fileobj, events, data=None):
+        key = selectors.SelectorKey(fileobj, fileobj.fileno(), events, data)
+        self._fd_to_key[key.fd] = key
+        return key
+
+    def unregister(self, fileobj):
+        return self._fd_to_key.pop(fileobj.fileno())
+
+    def modify(self, fileobj, events, data=None):
+        key = self._fd_to_key[fileobj.fileno()]
+        if (key.events ^ events) & selectors.EVENT_READ:
+            fileobj.set_reading(events & selectors.EVENT_READ)
+        key = key._replace(events=events, data=data)
+        self._fd_to_key[key.fd] = key
+        return key
+
+    def get_key(self, fileobj):
+        try:
+            return self._fd_to_key[fileobj.fileno()]
+        except KeyError:
+            raise KeyError("{!r} is not registered".format(fileobj)) from None
+
+    def get_map(self):
+        return self._fd_to_key
+
+    def select(self, timeout=None):
+        raise RuntimeError("The asyncio engine does not use select()")
+
+    def close(self):
+        self._fd_to_key.clear()
+
+##############################################################################################################
+
+class CRCServerProtocol(asyncio.BufferedProtocol):
+    """ CRCServerProtocol represents one TCP connection (to a server or a client) when the asyncio engine is
+    used. It is the io_device.fileobj passed to the message handlers. The transport reads straight into the
+    connection's FrameDecoder buffer, and the received bytes are passed to CRCServer.handle_messages() exactly
+    as the selector engine does. send() lets a WriteQueue flush into the connection's transport, which takes
+    care of buffering anything the socket cannot accept yet. The transport's buffer limits are the server's
+    write watermarks, so pause_writing() and resume_writing() tell the server when the connection becomes
+    congested and when it has drained (see CRCServer.is_congested()).
+    """
+    def __init__(self, engine):
+        self.engine = engine
+        self.transport = None
+        self.fd = None
+        self.writing_paused = False
+
+    def fileno(self):
+        return self.fd
+
+    def getpeername(self):
+        return self.transport.get_extra_info('peername')
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.fd = transport.get_extra_info('socket').fileno()
+        server = self.engine.server
+        transport.set_write_buffer_limits(high=server.write_high_watermark, low=server.write_low_watermark)
+        server.sel.register(self, selectors.EVENT_READ, BaseConnectionData())
+
+    def get_buffer(self, sizehint):
+        return self.engine.server.get_io_device(self).data.frame_decoder.get_buffer()
+
+    def buffer_updated(self, nbytes):
+        io_device = self.engine.server.get_io_device(self)
+        self.engine.server.handle_messages(io_device, io_device.data.frame_decoder.buffer_updated(nbytes))
+
+    # The connection is cleaned up exactly as close_io_device() does on the selector engine, which also 
+    # unregisters it. Closing a transport that has already been lost does nothing. A connection that the server
+    # closed itself has already been cleaned up. Connections closed while the server shuts down are only 
+    # unregistered, as cleanup() does, so that purge_on_disconnect leaves the server's state as it was.
+    def connection_lost(self, exc):
+        server = self.engine.server
+        try:
+            io_device = server.get_io_device(self)
+        except KeyError:
+            return
+        if server.request_terminate:
+            server.sel.unregister(self)
+            return
+        server.close_io_device(io_device)
+
+    # Called by the transport once its buffer grows past the server's write_high_watermark
+    def pause_writing(self):
+        self.writing_paused = True
+
+    # Called by the transport once its buffer drains to the server's write_low_watermark. Every connection
+    # that stopped being read from because this one was congested is resumed
+    def resume_writing(self):
+        self.writing_paused = False
+        self.engine.server.resume_paused_sources(self)
+
+    # Pauses or resumes reading from the transport. Used by AsyncioConnectionRegistry.modify()
+    def set_reading(self, reading):
+        if reading:
+            self.transport.resume_reading()
+        else:
+            self.transport.pause_reading()
+
+    # Called by WriteQueue.flush(). The transport accepts everything and buffers whatever the socket cannot
+    # send yet. Queued frames may be reused after they are flushed, so the transport is given its own copy.
+    def send(self, data):
+        self.transport.write(bytes(data))
+        return len(data)
+
+    def close(self):
+        self.transport.close()
+
+##############################################################################################################
+
+class AsyncioServerEngine():
+    """ AsyncioServerEngine runs a CRCServer on an asyncio event loop instead of the selector loop in
+    CRCServer.check_IO_devices_for_messages(). It replaces setup_server_socket(), connect_to_server(),
+    check_IO_devices_for_messages(), accept_new_connection(), handle_io_device_events() and cleanup(). Every
+    message handler and send helper, hosts_db, adjacent_server_ids and the rest of the server's state are used
+    exactly as they are on the selector engine.
+
+    The engine is chosen when the server is constructed, either with CRCServer(options, engine="asyncio") or
+    with the --engine asyncio option.
+    """
+    def __init__(self, server):
+        self.server = server
+        self.loop = None
+        self.stopped = None
+        self.tasks = set()          # Background connection attempts, kept so they are not garbage collected
+
+    def run(self):
+        server = self.server
+        server.print_info("Launching server %s..." % server.server_name)
+        server.loop_thread = threading.current_thread()
+
+        # The selector created in __init__ is never used by this engine
+        server.sel.close()
+        server.sel = AsyncioConnectionRegistry()
+
+        self.loop = asyncio.new_event_loop()
+        self.stopped = asyncio.Event()
+        try:
+            self.loop.run_until_complete(self.serve())
+        finally:
+            self.loop.close()
+            server.wakeup_channel.close()
+            server.close_message_logs()
+
+    async def serve(self):
+        server = self.server
+        host = '127.0.0.1' if server.run_on_localhost else ''
+
+        server.print_info("Configuring the server socket...")
+        listener = await self.loop.create_server(lambda: CRCServerProtocol(self), host, server.port,
+                                                 reuse_address=True, reuse_port=server.reuse_port or None)
+
+        if server.connect_to_host and server.connect_to_port:
+            server.print_info("Connecting to remote server %s:%i..." % (server.connect_to_host, server.connect_to_port))
+            _, protocol = await self.loop.create_connection(lambda: CRCServerProtocol(self),
+                                                            server.connect_to_host_addr, server.connect_to_port)
+            server.queue_message(protocol, ServerRegistrationMessage.bytes(server.id, 0, server.server_name, server.server_info))
+            if server.client_id_range:
+                server.queue_message(protocol, server.id_range_announcements())
+
+        server.print_info("Listening for new connections on port " + str(server.port))
+        if not server.request_terminate:
+            await self.stopped.wait()
+
+        server.print_info("Cleaning up the server")
+        listener.close()
+        for key in list(server.sel.get_map().values()):
+            key.fileobj.close()
+        await listener.wait_closed()
+
+        # Transports send whatever they still have buffered before closing. Wait (briefly) for every one of 
+        # them to finish and run its connection_lost() callback, which closes the socket
+        for i in range(100):
+            if not server.sel.get_map():
+                break
+            await asyncio.sleep(0.01)
+
+    # Safe to call from any thread
+    def stop(self):
+        try:
+            self.loop.call_soon_threadsafe(self.stopped.set)
+        except (AttributeError, RuntimeError):
+            # The loop has not started yet or has already finished. run() checks request_terminate itself
+            pass
+
+    # Safe to call from any thread
+    def call_in_loop(self, callback, *args):
+        self.loop.call_soon_threadsafe(callback, *args)
+
+    # Runs callback(*args) on the loop after delay seconds
+    def call_later(self, delay, callback, *args):
+        self.loop.call_later(delay, callback, *args)
+
+    # Connects to host:port in the background. Once connected, the connection's data object is replaced with 
+    # connection_data and on_connected() is called with the connection's CRCServerProtocol. If the connection
+    # cannot be made, on_failed() is called instead
+    def open_connection(self, host, port, connection_data, on_connected, on_failed):
+        async def connect():
+            try:
+                _, protocol = await self.loop.create_connection(lambda: CRCServerProtocol(self), host, port)
+            except OSError as e:
+                self.server.print_info("Could not connect to %s:%d: %s" % (host, port, e))
+                on_failed()
+                return
+            self.server.update_connection_data(self.server.get_io_device(protocol), connection_data)
+            on_connected(protocol)
+
+        task = self.loop.create_task(connect())
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
@@ -0,0 +1,135 @@
+import timeit
+from optparse import OptionParser
+from struct import pack, unpack
+from ChatMessageParser import *
+
+# Run from the repository root with: python -m Benchmarks.MessageCodecBenchmark
+
+
+######################################################################
+# The original codecs, which built a new struct format string with "!{0}s".format(...) on every call. They are
+# kept here only so the benchmark can report before and after numbers for each message type.
+class LegacyCodecs(object):
+
+    @staticmethod
+    def encode_server_registration(source_id, last_hop_id, server_name, server_info):
+        return pack("!BIIBH{0}s{1}s".format(len(server_name), len(server_info)), 0x00, source_id, last_hop_id, len(server_name), len(server_info), server_name.encode(), server_info.encode())
+
+    @staticmethod
+    def decode_server_registration(bytes):
+        msg = unpack("!xIIBH", bytes[:12])
+        server_name = unpack("!{0}s".format(msg[2]), bytes[12:12+msg[2]])[0].decode()
+        server_info = unpack("!{0}s".format(msg[3]), bytes[12+msg[2]:12+msg[2]+msg[3]])[0].decode()
+        return msg[0], msg[1], server_name, server_info, bytes[:12+msg[2]+msg[3]]
+
+    @staticmethod
+    def encode_client_registration(source_id, last_hop_id, client_name, client_info):
+        return pack("!BIIBH{0}s{1}s".format(len(client_name), len(client_info)), 0x80, source_id, last_hop_id, len(client_name), len(client_info), client_name.encode(), client_info.encode())
+
+    @staticmethod
+    def decode_client_registration(bytes):
+        return LegacyCodecs.decode_server_registration(bytes)
+
+    @staticmethod
+    def encode_status_update(source_id, destination_id, message_code, content):
+        return pack("!BIIHI{0}s".format(len(content)), 0x01, source_id, destination_id, message_code, len(content), content.encode())
+
+    @staticmethod
+    def decode_status_update(bytes):
+        msg = unpack("!xIIHI", bytes[:15])
+        content = unpack("!{0}s".format(msg[3]), bytes[15:15+msg[3]])[0].decode()
+        return msg[0], msg[1], msg[2], content, bytes[:15+msg[3]]
+
+    @staticmethod
+    def encode_client_chat(source_id, destination_id, content):
+        return pack("!BIII{0}s".format(len(content)), 0x81, source_id, destination_id, len(content), content.encode())
+
+    @staticmethod
+    def decode_client_chat(bytes):
+        msg = unpack("!xIII", bytes[:13])
+        content = unpack("!{0}s".format(msg[2]), bytes[13:13+msg[2]])[0].decode()
+        return msg[0], msg[1], content, bytes[:13+msg[2]]
+
+    @staticmethod
+    def encode_server_quit(source_id, replacement_server_id, content):
+        return pack("!BIII{0}s".format(len(content)), 0x02, source_id, replacement_server_id, len(content), content.encode())
+
+    @staticmethod
+    def decode_server_quit(bytes):
+        return LegacyCodecs.decode_client_chat(bytes)
+
+    @staticmethod
+    def encode_client_quit(source_id, content):
+        return pack("!BII{0}s".format(len(content)), 0x82, source_id, len(content), content.encode())
+
+    @staticmethod
+    def decode_client_quit(bytes):
+        msg = unpack("!xII", bytes[:9])
+        content = unpack("!{0}s".format(msg[1]), bytes[9:9+msg[1]])[0].decode()
+        return msg[0], content, bytes[:9+msg[1]]
+
+
+######################################################################
+# Each entry is: (name, arguments, legacy encoder, legacy decoder, current encoder, current decoder)
+BENCHMARKS = [
+    ("ServerRegistrationMessage", (12345, 45678, "rivendale", "Elrond's House"),
+        LegacyCodecs.encode_server_registration, LegacyCodecs.decode_server_registration,
+        ServerRegistrationMessage.bytes, ServerRegistrationMessage),
+    ("ClientRegistrationMessage", (101, 1, "frodobaggins", "Test info"),
+        LegacyCodecs.encode_client_registration, LegacyCodecs.decode_client_registration,
+        ClientRegistrationMessage.bytes, ClientRegistrationMessage),
+    ("StatusUpdateMessage", (1, 101, 0x00, "Welcome to the Clemson Relay Chat network frodobaggins"),
+        LegacyCodecs.encode_status_update, LegacyCodecs.decode_status_update,
+        StatusUpdateMessage.bytes, StatusUpdateMessage),
+    ("ClientChatMessage", (108, 103, "Testing 1 2 3 4 5 6 7"),
+        LegacyCodecs.encode_client_chat, LegacyCodecs.decode_client_chat,
+        ClientChatMessage.bytes, ClientChatMessage),
+    ("ServerQuitMessage", (4, 2, "Shutting down for maintenance"),
+        LegacyCodecs.encode_server_quit, LegacyCodecs.decode_server_quit,
+        ServerQuitMessage.bytes, ServerQuitMessage),
+    ("ClientQuitMessage", (101, "Goodbye"),
+        LegacyCodecs.encode_client_quit, LegacyCodecs.decode_client_quit,
+        ClientQuitMessage.bytes, ClientQuitMessage),
+]
+
+
+def messages_per_second(function, argument_list, iterations):
+    seconds = min(timeit.repeat(lambda: function(*argument_list), number=iterations, repeat=3))
+    return iterations / seconds
+
+
+# Returns a decoder that also reads the content of message types whose content is only decoded when it is
+# first read, so that it does the same work as the legacy decoder
+def full_decoder(message_class):
+    if issubclass(message_class, ContentMessage):
+        return lambda frame: message_class(frame).content
+    return message_class
+
+
+# The decode row reads every field of the message. A server that only relays a message to its next hop never
+# reads the content, so the relay row, shown for the message types that have content, parses the header alone.
+# The legacy decoder has no such shortcut and decodes everything in both rows.
+def run_benchmarks(iterations):
+    print("%-28s %-7s %14s %14s %8s" % ("Message", "Op", "Before (msg/s)", "After (msg/s)", "Speedup"))
+    for name, args, legacy_encode, legacy_decode, encode, decode in BENCHMARKS:
+        frame = encode(*args)
+        rows = [
+            ("encode", legacy_encode, encode, args),
+            ("decode", legacy_decode, full_decoder(decode), (frame,)),
+        ]
+        if issubclass(decode, ContentMessage):
+            rows.append(("relay", legacy_decode, decode, (frame,)))
+        for op, legacy_function, function, argument_list in rows:
+            before = messages_per_second(legacy_function, argument_list, iterations)
+            after = messages_per_second(function, argument_list, iterations)
+            print("%-28s %-7s %14.0f %14.0f %7.2fx" % (name, op, before, after, after / before))
+
+if __name__ == "__main__":
+    op = OptionParser(description="Measures encode and decode throughput for every CRC message type")
+    op.add_option(
+        "--iterations",
+        metavar="X", type="int", default=100000,
+        help="The number of messages to encode and decode per measurement")
+    options, args = op.parse_args()
+
+    run_benchmarks(options.iterations)
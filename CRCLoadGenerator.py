@@ -0,0 +1,280 @@
+import re, time, json, random
+from bisect import bisect_right
+from optparse import OptionParser
+from ChatClient import *
+from ChatServer import CRCServer
+from Testers.CRCFunctionalityTest import CRCFunctionalityTest
+
+# Generates chat load against a CRC network from thousands of simulated clients in one process. Every client is
+# driven by a single ClientEventLoop, so the number of clients is limited by file descriptors rather than
+# threads. Run from the repository root with, e.g.:
+#   python CRCLoadGenerator.py --config TestCases/2_3_ElevenServers.cfg --launch_servers --clients 2000 --rate 5000
+
+
+######################################################################
+# A CRCClient that reports what it receives to the load generator instead of logging every message
+class LoadClient(CRCClient):
+    def __init__(self, options, generator, event_loop):
+        super().__init__(options, True, event_loop)
+        self.generator = generator
+        self.server_index = options.server_index    # The index of the server this client connects to
+
+    def print_info(self, msg):
+        pass
+
+    def handle_status_message(self, message):
+        if message.status_code == 0x00:
+            self.generator.client_registered(self)
+        else:
+            self.generator.status_errors += 1
+
+    def handle_client_chat_message(self, message):
+        self.generator.message_delivered(message)
+
+
+######################################################################
+class CRCLoadGenerator(object):
+
+    def __init__(self, options, CRCServerImpl=CRCServer):
+        self.options = options
+        self.rng = random.Random(options.seed)
+        self.tester = CRCFunctionalityTest(CRCServerImpl, CRCClient, False)
+        if not options.verbose:
+            self.tester.CRCServerModule = type("Quiet" + CRCServerImpl.__name__, (CRCServerImpl,), {"print_info": lambda self, msg: None})
+
+        with open(options.config, 'r') as fp:
+            self.server_commands = [command.split(" ", 1)[1] for command in json.load(fp)['commands'] if command.startswith("LAUNCHSERVER ")]
+        self.server_ports = [self.tester.server_op.parse_args(self.split_args(args))[0].port for args in self.server_commands]
+        if not self.server_ports:
+            raise Exception("The config does not launch any servers")
+
+        self.event_loop = ClientEventLoop()
+        self.clients = []
+        self.clients_by_server = [[] for port in self.server_ports]
+        self.destination_weights = None     # Cumulative weights of self.clients for the zipf distribution
+
+        # Only ever updated on the event loop's thread
+        self.registered = 0
+        self.status_errors = 0
+        self.sent = 0
+        self.delivered = 0
+        self.latencies = []
+        self.first_delivery = None
+        self.last_delivery = None
+
+    # https://stackoverflow.com/questions/16710076/python-split-a-string-respect-and-preserve-quotes
+    @staticmethod
+    def split_args(args):
+        return re.findall(r'(?:[^\s,"]|"(?:\\.|[^"])*")+', args)
+
+    def run(self):
+        raise_file_limit()
+        if self.options.launch_servers:
+            for args in self.server_commands:
+                self.tester.launch_server(args)
+                time.sleep(0.25)
+
+        self.event_loop.start()
+        try:
+            self.connect_clients()
+            if self.wait_for_registration():
+                self.generate_load()
+        finally:
+            self.event_loop.stop()
+            self.event_loop.join()
+            for x in self.tester.threads.values():
+                x['app'].stop()
+            for x in self.tester.threads.values():
+                x['thread'].join()
+        self.print_report()
+
+    def connect_clients(self):
+        options = self.options
+        start = time.perf_counter()
+        for i in range(options.clients):
+            server_index = i % len(self.server_ports)
+            client_options = types.SimpleNamespace(
+                id=options.first_id + i, serverhost="localhost", serverport=self.server_ports[server_index],
+                username="load%d" % i, info="Load generator client", log_file=None, server_index=server_index,
+                subscribe=None if options.full_presence else [])
+            client = LoadClient(client_options, self, self.event_loop)
+            client.run()
+            self.clients.append(client)
+            self.clients_by_server[server_index].append(client)
+        print("Connected %d clients to %d servers in %.2fs" % (len(self.clients), len(self.server_ports), time.perf_counter() - start))
+
+        if options.distribution == "zipf":
+            # The most popular destinations are spread across the servers rather than all on the first one
+            order = list(self.clients)
+            self.rng.shuffle(order)
+            self.clients = order
+            total = 0.0
+            self.destination_weights = []
+            for rank in range(1, len(order) + 1):
+                total += 1.0 / rank ** options.zipf_exponent
+                self.destination_weights.append(total)
+
+    def wait_for_registration(self):
+        start = time.perf_counter()
+        deadline = start + self.options.timeout
+        while self.registered < len(self.clients) and time.perf_counter() < deadline:
+            time.sleep(0.05)
+        print("Registered %d of %d clients in %.2fs" % (self.registered, len(self.clients), time.perf_counter() - start))
+        return self.registered == len(self.clients)
+
+    # Sends chat messages at the configured rate for the configured duration, then waits for the messages that
+    # are still in flight
+    def generate_load(self):
+        options = self.options
+        self.start_time = time.perf_counter()
+        self.end_time = self.start_time + options.duration
+        while time.perf_counter() < self.end_time:
+            self.event_loop.call_in_loop(self.send_due_messages)
+            time.sleep(options.tick)
+        self.event_loop.call_in_loop(self.send_due_messages)
+
+        # self.sent is only updated on the event loop's thread, so wait for the last batch to be counted
+        sent = threading.Event()
+        self.event_loop.call_in_loop(sent.set)
+        sent.wait()
+
+        deadline = time.perf_counter() + options.drain
+        while self.delivered + self.status_errors < self.sent and time.perf_counter() < deadline:
+            time.sleep(0.05)
+
+    # Called on the event loop's thread. Sends however many messages are due by now
+    def send_due_messages(self):
+        now = min(time.perf_counter(), self.end_time)
+        due = int((now - self.start_time) * self.options.rate) - self.sent
+        padding = "x" * max(0, self.options.message_size - 24)
+        for i in range(due):
+            source = self.rng.choice(self.clients)
+            destination = self.pick_destination(source)
+            source.message_other_client(destination.id, "%.9f %s" % (time.perf_counter(), padding))
+        self.sent += max(0, due)
+
+    def pick_destination(self, source):
+        distribution = self.options.distribution
+        if distribution == "local":
+            candidates = self.clients_by_server[source.server_index]
+        elif distribution == "zipf":
+            index = bisect_right(self.destination_weights, self.rng.random() * self.destination_weights[-1])
+            destination = self.clients[min(index, len(self.clients) - 1)]
+            return destination if destination is not source else self.pick_destination_uniformly(self.clients, source)
+        else:
+            candidates = self.clients
+        return self.pick_destination_uniformly(candidates, source)
+
+    def pick_destination_uniformly(self, candidates, source):
+        if len(candidates) < 2:
+            return self.rng.choice(self.clients)
+        while True:
+            destination = self.rng.choice(candidates)
+            if destination is not source:
+                return destination
+
+    def client_registered(self, client):
+        self.registered += 1
+
+    def message_delivered(self, message):
+        now = time.perf_counter()
+        sent_at = float(message.content.split(" ", 1)[0])
+        self.latencies.append(now - sent_at)
+        self.delivered += 1
+        if self.first_delivery is None:
+            self.first_delivery = now
+        self.last_delivery = now
+
+    def print_report(self):
+        print("\n##############################################")
+        print("Clients:       %d (%d registered)" % (len(self.clients), self.registered))
+        print("Sent:          %d" % self.sent)
+        print("Delivered:     %d" % self.delivered)
+        print("Errors:        %d status errors, %d lost" % (self.status_errors, self.sent - self.delivered - self.status_errors))
+        if self.delivered > 1 and self.last_delivery > self.first_delivery:
+            print("Throughput:    %.0f messages/s" % ((self.delivered - 1) / (self.last_delivery - self.first_delivery)))
+        if self.latencies:
+            latencies = sorted(self.latencies)
+            def percentile(p):
+                return latencies[min(len(latencies) - 1, int(p / 100.0 * len(latencies)))] * 1000
+            print("Latency (ms):  p50 %.2f  p90 %.2f  p99 %.2f  max %.2f" % (percentile(50), percentile(90), percentile(99), latencies[-1] * 1000))
+
+
+# Every client uses a file descriptor, so allow as many as the system will
+def raise_file_limit():
+    try:
+        import resource
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if soft != hard:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    except (ImportError, ValueError, OSError):
+        pass
+
+
+if __name__ == "__main__":
+    op = OptionParser(description="Generates chat load against a CRC network from thousands of simulated clients")
+    op.add_option(
+        "--config",
+        metavar="X",
+        help="A TestCases config whose LAUNCHSERVER commands describe the servers to connect to")
+    op.add_option(
+        "--launch_servers",
+        action="store_true",
+        help="Launch the servers in this process, as the test manager does, instead of connecting to running ones")
+    op.add_option(
+        "--clients",
+        metavar="X", type="int", default=1000,
+        help="The number of clients, spread evenly across the servers")
+    op.add_option(
+        "--first_id",
+        metavar="X", type="int", default=100000,
+        help="The ID of the first client. The others use the IDs that follow it")
+    op.add_option(
+        "--rate",
+        metavar="X", type="float", default=1000,
+        help="The number of chat messages sent per second, across all clients")
+    op.add_option(
+        "--duration",
+        metavar="X", type="float", default=10,
+        help="The number of seconds to send messages for")
+    op.add_option(
+        "--distribution",
+        metavar="X", type="choice", choices=["uniform", "zipf", "local"], default="uniform",
+        help="How destinations are chosen: uniform, zipf (a few popular clients) or local (same server)")
+    op.add_option(
+        "--zipf_exponent",
+        metavar="X", type="float", default=1.0,
+        help="The exponent of the zipf distribution")
+    op.add_option(
+        "--message_size",
+        metavar="X", type="int", default=64,
+        help="The length of each chat message")
+    op.add_option(
+        "--full_presence",
+        action="store_true",
+        help="Have every client told about every other client, instead of subscribing to no one")
+    op.add_option(
+        "--tick",
+        metavar="X", type="float", default=0.01,
+        help="How often, in seconds, the messages that are due are sent")
+    op.add_option(
+        "--timeout",
+        metavar="X", type="float", default=60,
+        help="How long to wait for every client to register")
+    op.add_option(
+        "--drain",
+        metavar="X", type="float", default=5,
+        help="How long to wait for messages still in flight once sending stops")
+    op.add_option(
+        "--seed",
+        metavar="X", type="int",
+        help="Seed for choosing sources and destinations")
+    op.add_option(
+        "--verbose",
+        action="store_true",
+        help="Let launched servers print every message they handle")
+    options, args = op.parse_args()
+    if not options.config:
+        op.error("--config is required")
+
+    CRCLoadGenerator(options).run()
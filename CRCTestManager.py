@@ -1,4 +1,6 @@
 import threading, os, re, time, sys, json, traceback
+import multiprocessing
+from multiprocessing.connection import wait
 from optparse import OptionParser
 from ChatClient import CRCClient
 from ChatServer import CRCServer
@@ -38,8 +40,10 @@ class CRCTestManager(object):
 
     ######################################################################
     # Initialization
-    def __init__(self, CRCServerImpl = None, CRCMessageParserImpl = None, catch_exceptions = False):
+    def __init__(self, CRCServerImpl = None, CRCMessageParserImpl = None, catch_exceptions = False, server_engine = None, client_event_loop = False):
         self.catch_exceptions = catch_exceptions
+        self.server_engine = server_engine      # Used by servers whose LAUNCHSERVER command has no --engine option
+        self.client_event_loop = client_event_loop  # Drive every client from one ClientEventLoop per test
         if CRCServerImpl:
             self.CRCServerImpl = CRCServerImpl
         else:
@@ -57,7 +61,6 @@ class CRCTestManager(object):
         if not os.path.exists(os.path.join(__location__, 'Logs')):
             os.makedirs(os.path.join(__location__, 'Logs'))   
 
-        score = 0
         results = []
         for test in sorted(tests.keys()):
             # Open the test file
@@ -79,6 +82,108 @@ class CRCTestManager(object):
                     time.sleep(1)
                     sys.stdout = sys.__stdout__
 
+        return self.report_results(tests, results)
+
+    # Runs the tests in up to workers separate processes at a time, instead of one after another. Every test
+    # gets its own block of ports_per_test ports starting at port_base, and the ports in its commands are
+    # remapped into that block, so tests that use the same ports can run side by side. The log files of the
+    # servers and clients in each test are prefixed with the test's name. Returns the same score and results
+    # as run_tests(). Only supported on platforms where the fork start method is available.
+    def run_tests_in_parallel(self, tests, workers=None, port_base=20000, ports_per_test=100):
+        __location__ = os.path.realpath(os.path.join(os.getcwd(), os.path.dirname(__file__)))
+        if not os.path.exists(os.path.join(__location__, 'Logs')):
+            os.makedirs(os.path.join(__location__, 'Logs'))   
+
+        context = multiprocessing.get_context("fork")
+        workers = workers or os.cpu_count()
+        pending = list(enumerate(sorted(tests.keys())))
+        running = {}        # Maps each worker's process sentinel to (test, process, result pipe)
+        finished = {}
+
+        while pending or running:
+            # Start a worker for each waiting test, until enough are running
+            while pending and len(running) < workers:
+                index, test = pending.pop(0)
+                reader, writer = context.Pipe(duplex=False)
+                process = context.Process(target=self.run_test_in_worker, args=(test, port_base + index * ports_per_test, ports_per_test, writer), name=test)
+                process.start()
+                writer.close()
+                running[process.sentinel] = (test, process, reader)
+                print("Started test " + test)
+
+            # Results are read as soon as they are sent, so a worker never blocks on a full pipe
+            ready = wait([reader for test, process, reader in running.values()] + list(running.keys()))
+            for sentinel, (test, process, reader) in list(running.items()):
+                if reader in ready or sentinel in ready:
+                    if reader.poll():
+                        finished[test] = reader.recv()
+                    elif sentinel not in ready:
+                        continue
+                    # A test that failed with an exception may have left servers running in its worker
+                    process.join(5)
+                    if process.is_alive():
+                        process.terminate()
+                        process.join()
+                    reader.close()
+                    del running[sentinel]
+                    if test not in finished:
+                        finished[test] = {
+                            'test':test,
+                            'passed':False,
+                            'errors':"The test's worker process exited with code %s\n" % process.exitcode,
+                            'exception':None
+                        }
+                    print("%s passed: %r" % (test, finished[test]['passed']))
+
+        return self.report_results(tests, [finished[test] for test in sorted(tests.keys())])
+
+    # Runs one test in a worker process started by run_tests_in_parallel() and sends its result to the parent
+    def run_test_in_worker(self, test, first_port, port_count, result_pipe):
+        __location__ = os.path.realpath(os.path.join(os.getcwd(), os.path.dirname(__file__)))
+        result = {'test':test, 'passed':False, 'errors':"", 'exception':None}
+        try:
+            with open(os.path.join(__location__, 'TestCases', '%s.cfg' % test), 'r') as fp:
+                test_config = self.remap_test_config(json.load(fp), test, first_port, port_count)
+            # Only this test writes to its log, so output doesn't also go to the shared terminal
+            with open(os.path.join(__location__, 'Logs', '%s.log' % test), 'w') as logfile:
+                sys.stdout = logfile
+                print("\n##############################################")
+                print("Beginning test " + test + "\n")
+                try:
+                    result['passed'], result['errors'], exception = self.run_test(test_config)
+                except Exception as e:
+                    exception = e
+                if exception:
+                    # Tracebacks can't be sent to the parent, so the exception carries its formatted traceback
+                    result['exception'] = Exception("".join(traceback.format_exception(type(exception), exception, exception.__traceback__)))
+                print("\nTest passed:" + str(result['passed']))
+                sys.stdout = sys.__stdout__
+        finally:
+            result_pipe.send(result)
+            result_pipe.close()
+
+    # Returns a copy of a test config whose ports are remapped into [first_port, first_port + port_count) and
+    # whose log files are prefixed with the name of the test
+    def remap_test_config(self, test_config, test, first_port, port_count):
+        ports = {}
+        def remap_port(match):
+            port = int(match.group(2))
+            if port not in ports:
+                if len(ports) == port_count:
+                    raise Exception("Test %s uses more than %d ports" % (test, port_count))
+                ports[port] = first_port + len(ports)
+            return "%s %d" % (match.group(1), ports[port])
+
+        commands = []
+        for command in test_config['commands']:
+            command = re.sub(r'(--port|--connect_to_port|--serverport|-P) (\d+)', remap_port, command)
+            command = re.sub(r'(--log-file) (\S+)', lambda match: "%s %s.%s" % (match.group(1), test, match.group(2)), command)
+            commands.append(command)
+        return dict(test_config, commands=commands)
+
+    # Adds up the score of the tests that passed and prints a summary of every test's result
+    def report_results(self, tests, results):
+        score = 0
         print("\n##############################################")
         for result in results:
             if result['passed']:
@@ -87,16 +192,17 @@ class CRCTestManager(object):
             if result['errors']:
                 print("%s" % (result['errors']))
             if result['exception']:
-                print(traceback.format_exc())
+                exception = result['exception']
+                print("".join(traceback.format_exception(type(exception), exception, exception.__traceback__)))
         
         return score, results
 
     def run_test(self, test):
         tester = None
         if test["type"] == "network_connectivity":
-            tester = NetworkConnectivityTest(self.CRCServerImpl, CRCClient, self.catch_exceptions)
+            tester = NetworkConnectivityTest(self.CRCServerImpl, CRCClient, self.catch_exceptions, self.server_engine, self.client_event_loop)
         elif test["type"] == "CRC_functionality":
-            tester = CRCFunctionalityTest(self.CRCServerImpl, CRCClient, self.catch_exceptions)
+            tester = CRCFunctionalityTest(self.CRCServerImpl, CRCClient, self.catch_exceptions, self.server_engine, self.client_event_loop)
         else:
             return None
         return tester.run_test(test)
@@ -158,8 +264,30 @@ if __name__ == "__main__":
         # to pass these tests: handle_client_quit_message().
         #'6_1_ClientQuit_OneServer':3,
         #'6_2_ClientQuit_ThreeServers':3,
-        #'6_3_ClientQuit_ElevenServers':3
+        #'6_3_ClientQuit_ElevenServers':3,
+
+
+        # This batch of tests evaluates how your code handles servers leaving the network. 
+        # In addition to the methods required for previous tests, you also need to complete the following method
+        # to pass these tests: handle_server_quit_message().
+        #'7_1_ServerLost_PurgeOnDisconnect':3,
+        #'7_2_ServerQuit_MidTree':3,
+        #'7_3_ServerQuit_Root':3,
+        #'7_4_ServerQuit_TwoInARow':3,
+
+
+        # This batch of tests evaluates the optional protocol extensions described in CRC_PROTOCOL.md. Each test
+        # needs the methods required for the first six batches and the handler for its own message types: 
+        # handle_host_snapshot_message() for 8_1, handle_client_id_range_message() for 8_2,
+        # handle_id_lease_request_message() and handle_id_lease_grant_message() for 8_3,
+        # handle_presence_subscribe_message() and handle_roster_query_message() for 8_4, and 
+        # handle_channel_membership_message() and handle_channel_chat_message() for 8_5.
+        #'8_1_HostSnapshot_LateJoin':2,
+        #'8_2_ClientIdRanges':2,
+        #'8_3_IdLeases':2,
+        #'8_4_Presence_Roster':2,
+        #'8_5_Channels':2,
     }
 
     CRC_connection_score = test_manager.run_tests(CRC_connection_tests)
-    print(f"Points earned: {CRC_connection_score[0]} out of 75.")
\ No newline at end of file
+    print(f"Points earned: {CRC_connection_score[0]} out of 97.")
\ No newline at end of file
@@ -5,12 +5,19 @@ import selectors
 import logging
 import types
 from ChatMessageParser import *
+from ChatIO import *
 
 
 class CRCClient(object):
     
-    def __init__(self, options, run_on_localhost=False):
+    # When event_loop (a ClientEventLoop) is given, the client is driven by that loop together with any other
+    # clients added to it, instead of by a thread of its own
+    def __init__(self, options, run_on_localhost=False, event_loop=None):
         self.request_terminate = False
+        self.event_loop = event_loop
+        # Only a client listening on a thread of its own needs to be woken up by stop()
+        self.wakeup_channel = None if event_loop else self.new_wakeup_channel()
+        self.write_queue = WriteQueue()         # Messages waiting to be sent when driven by an event loop
 
         self.serveraddr = options.serverhost
         self.serverport = options.serverport
@@ -22,9 +29,19 @@ class CRCClient(object):
         self.client_name = options.username
         self.info = options.info
 
+        # The client IDs to subscribe to presence for, or None to be told about every client on the network
+        self.presence_ids = getattr(options, 'subscribe', None)
+        if isinstance(self.presence_ids, str):
+            self.presence_ids = [int(id) for id in self.presence_ids.split(",") if id]
+
         self.connected_user_ids = {}
-        self.status_updates_log = []
-        self.chat_messages_log = []
+        # At most options.max_log_entries messages are kept in memory. Older messages are spilled to files in
+        # options.log_spill_dir, if one is given, and are otherwise dropped
+        self.status_updates_log = self.new_message_log(options, "status_updates_log")
+        self.chat_messages_log = self.new_message_log(options, "chat_messages_log")
+
+        # Holds on to any partial message received from the server until the rest of it arrives
+        self.frame_decoder = FrameDecoder()
 
 
         # This dictionary contains mappings from commands to command handlers.
@@ -32,9 +49,11 @@ class CRCClient(object):
         self.message_handlers = {
             # Message handlers
             0x01:self.handle_status_message,
+            0x03:self.handle_host_snapshot_message,
             0x80:self.handle_client_registration_message,
             0x81:self.handle_client_chat_message,
             0x82:self.handle_client_quit_message,
+            0x86:self.handle_channel_chat_message,
         }
 
 
@@ -48,11 +67,18 @@ class CRCClient(object):
     def run(self):
         self.print_info("Launching client %s..." % (self.client_name))
         self.connect_to_server()
+        if self.event_loop:
+            self.event_loop.add_client(self)
+
+        # A subscription sent before registering means the server never sends the registration of every client
+        if self.presence_ids is not None:
+            self.subscribe(self.presence_ids)
 
         # Send the registration message to the server
         self.send_message_to_server(ClientRegistrationMessage.bytes(self.id, 0, self.client_name, self.info))
 
-        self.start_listening_to_server()
+        if not self.event_loop:
+            self.start_listening_to_server()
         
 
 
@@ -68,20 +94,41 @@ class CRCClient(object):
         x.start()
 
 
+    # Waits on both the server socket and the wakeup channel so that stop() takes effect immediately instead of
+    # waiting for the server to send something
     def listen_for_server_input(self):
+        sel = selectors.DefaultSelector()
+        sel.register(self.sock, selectors.EVENT_READ)
+        sel.register(self.wakeup_channel.reader, selectors.EVENT_READ)
+
         while not self.request_terminate:
-            rcvd = self.sock.recv(2048)
-            if rcvd:
-                self.handle_messages(rcvd)
-            else:
-                self.print_info("Server has disconnected!")
-                self.request_terminate = True
+            for key, mask in sel.select():
+                if key.fileobj is self.wakeup_channel.reader:
+                    self.wakeup_channel.drain()
+                    continue
+
+                rcvd = self.frame_decoder.recv_into(self.sock)
+                if rcvd:
+                    self.handle_messages(rcvd)
+                else:
+                    self.print_info("Server has disconnected!")
+                    self.request_terminate = True
+
+        sel.close()
+        self.wakeup_channel.close()
+
+    # Asks the client to stop listening to the server. Safe to call from any thread
+    def stop(self):
+        self.request_terminate = True
+        if self.event_loop:
+            self.event_loop.remove_client(self)
+        else:
+            self.wakeup_channel.notify()
+        self.close_message_logs()
 
     # This is a function stub that will be completed in a future assignment
     def handle_messages(self, recv_data):
-        messages = MessageParser.parse_messages(recv_data)
-
-        for message in messages:
+        for message in self.frame_decoder.feed(recv_data):
              # If we recognize the command, then process it using the assigned message handler
             if message.message_type in self.message_handlers:
                 self.print_info("Received message from Host ID #%s \"%s\"" % (message.source_id, message.bytes))
@@ -92,9 +139,14 @@ class CRCClient(object):
 
     ######################################################################
     # This block of functions ...
+    # sock.send() may only send part of a message, so the whole message is sent with sendall(), or queued on 
+    # the event loop that drives this client
     def send_message_to_server(self, message):
         self.print_info("Sending message to " + str(message))
-        self.sock.send(message)
+        if self.event_loop:
+            self.event_loop.send(self, message)
+        else:
+            self.sock.sendall(message)
 
     ######################################################################
     # The remaining functions are command handlers. Each command handler is documented
@@ -104,6 +156,9 @@ class CRCClient(object):
         self.connected_user_ids[message.source_id] = message
 
     def handle_status_message(self, message):
+        # A client that registered with an ID of 0 is told which ID the server assigned it
+        if message.status_code == 0x04 and self.id == 0:
+            self.id = message.destination_id
         self.status_updates_log.append(message.content)
 
     def handle_client_chat_message(self, message):
@@ -112,6 +167,16 @@ class CRCClient(object):
     def handle_client_quit_message(self, message):
         del self.connected_user_ids[message.source_id]
 
+    def handle_channel_chat_message(self, message):
+        self.chat_messages_log.append(message.content)
+
+    # A page of the roster, sent in reply to query_roster()
+    def handle_host_snapshot_message(self, message):
+        for host_type, host_id, name, info in message.hosts():
+            if host_type == 0x80:
+                registration = ClientRegistrationMessage.bytes(host_id, message.source_id, name, info)
+                self.connected_user_ids[host_id] = ClientRegistrationMessage(registration)
+
 
     ######################################################################
     # Quit message    
@@ -120,6 +185,30 @@ class CRCClient(object):
         self.send_message_to_server(msg)
 
 
+    ######################################################################
+    # Presence messages
+    def subscribe(self, host_ids):
+        self.send_message_to_server(PresenceSubscribeMessage.bytes(self.id, 0x00, host_ids))
+
+    def unsubscribe(self, host_ids):
+        self.send_message_to_server(PresenceSubscribeMessage.bytes(self.id, 0x01, host_ids))
+
+    def query_roster(self, after_id=0, limit=100):
+        self.send_message_to_server(RosterQueryMessage.bytes(self.id, after_id, limit))
+
+
+    ######################################################################
+    # Channel messages
+    def join_channel(self, channel_id):
+        self.send_message_to_server(ChannelMembershipMessage.bytes(self.id, channel_id, 0x00))
+
+    def leave_channel(self, channel_id):
+        self.send_message_to_server(ChannelMembershipMessage.bytes(self.id, channel_id, 0x01))
+
+    def message_channel(self, channel_id, chat_message):
+        self.send_message_to_server(ChannelChatMessage.bytes(self.id, channel_id, chat_message))
+
+
     ######################################################################
     # Quit message    
     def quit(self, quit_message=''):
@@ -127,6 +216,26 @@ class CRCClient(object):
         self.send_message_to_server(msg)
     
 
+    ######################################################################
+    # This block of functions creates the client's wakeup channel and message logs
+
+    # Returns the channel stop() uses to wake up the thread listening to the server
+    def new_wakeup_channel(self):
+        return WakeupChannel()
+
+    # Creates a log that keeps at most options.max_log_entries entries in memory. Older entries are spilled to
+    # a file in options.log_spill_dir, if one is given, and are otherwise dropped
+    def new_message_log(self, options, name):
+        spill_dir = getattr(options, 'log_spill_dir', None)
+        spill_path = os.path.join(spill_dir, "%s.%s" % (self.client_name, name)) if spill_dir else None
+        return BoundedMessageLog(getattr(options, 'max_log_entries', None), spill_path)
+
+    # Closes the spill files of the client's message logs. The logs can still be read
+    def close_message_logs(self):
+        self.status_updates_log.close()
+        self.chat_messages_log.close()
+
+
     ######################################################################
     # This block of functions enables logging of info, debug, and error messages
     # Do not edit these functions. init_logging() is already called by the template code
@@ -162,4 +271,121 @@ class CRCClient(object):
     def print_info(self, msg):
         print("[%s] \t%s" % (self.client_name,msg))
         if self.logger:
-            self.logger.info(msg)
\ No newline at end of file
+            self.logger.info(msg)
+
+
+class ClientEventLoop(object):
+    """ ClientEventLoop drives any number of CRCClients from a single selector loop on one thread. Without it
+    every client runs a thread of its own, which limits how many clients one process can simulate. Each 
+    client's socket is non-blocking. Messages are received into the client's frame_decoder and passed to its
+    message_handlers as usual, and messages sent with send_message_to_server() are queued on the client's
+    write_queue and sent as the socket accepts them, so they are always sent in full.
+
+    Create the loop, start() it, and pass it to each CRCClient as event_loop before calling the client's 
+    run(). Every method is safe to call from any thread.
+    """
+    def __init__(self):
+        self.sel = selectors.DefaultSelector()
+        self.wakeup_channel = WakeupChannel()
+        self.sel.register(self.wakeup_channel.reader, selectors.EVENT_READ)
+        self.pending_callbacks = deque()        # Work handed to the loop by other threads
+        self.request_terminate = False
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run)
+        self.thread.start()
+
+    def run(self):
+        self.thread = threading.current_thread()
+        while not self.request_terminate:
+            for key, mask in self.sel.select():
+                if key.fileobj is self.wakeup_channel.reader:
+                    self.wakeup_channel.drain()
+                    while self.pending_callbacks:
+                        callback, args = self.pending_callbacks.popleft()
+                        callback(*args)
+                    continue
+
+                # A callback earlier in this batch may have removed the client and closed its socket
+                client = key.data
+                if mask & selectors.EVENT_READ and self.is_registered(client):
+                    self.read(client)
+                if mask & selectors.EVENT_WRITE and self.is_registered(client):
+                    self.flush(client)
+
+        self.sel.close()
+        self.wakeup_channel.close()
+
+    # Stops the loop. The clients' sockets are left open, as they are when a client's own thread stops
+    def stop(self):
+        self.request_terminate = True
+        self.wakeup_channel.notify()
+
+    def join(self):
+        if self.thread:
+            self.thread.join()
+
+    def in_loop_thread(self):
+        return self.thread is threading.current_thread()
+
+    def call_in_loop(self, callback, *args):
+        self.pending_callbacks.append((callback, args))
+        self.wakeup_channel.notify()
+
+    def add_client(self, client):
+        if not self.in_loop_thread():
+            self.call_in_loop(self.add_client, client)
+            return
+        client.sock.setblocking(False)
+        self.sel.register(client.sock, selectors.EVENT_READ, client)
+
+    # A removed client's socket is closed, and the selector cannot look up a closed socket
+    def is_registered(self, client):
+        return client.sock.fileno() != -1 and client.sock in self.sel.get_map()
+
+    # Stops driving the client and closes its socket
+    def remove_client(self, client):
+        if not self.in_loop_thread():
+            self.call_in_loop(self.remove_client, client)
+            return
+        if self.is_registered(client):
+            self.sel.unregister(client.sock)
+            client.sock.close()
+
+    # Queues a message for the client's server, and sends as much of it as the socket accepts right away
+    def send(self, client, message):
+        if not self.in_loop_thread():
+            self.call_in_loop(self.send, client, message)
+            return
+        if not self.is_registered(client):
+            client.print_info("Dropping a message for a client that is no longer connected")
+            return
+        was_empty = not client.write_queue
+        client.write_queue.append(message)
+        if was_empty:
+            self.flush(client)
+
+    def flush(self, client):
+        try:
+            client.write_queue.flush(client.sock)
+        except ConnectionError:
+            # The server is gone. The next READ event reports the disconnect
+            return
+        events = selectors.EVENT_READ | (selectors.EVENT_WRITE if client.write_queue else 0)
+        if self.sel.get_key(client.sock).events != events:
+            self.sel.modify(client.sock, events, client)
+
+    def read(self, client):
+        try:
+            rcvd = client.frame_decoder.recv_into(client.sock)
+        except (BlockingIOError, InterruptedError):
+            return
+        except ConnectionError:
+            rcvd = None
+        if rcvd:
+            client.handle_messages(rcvd)
+        else:
+            client.print_info("Server has disconnected!")
+            client.request_terminate = True
+            self.remove_client(client)
@@ -0,0 +1,217 @@
+import os, json
+from collections import deque
+from itertools import islice
+from socket import socketpair
+
+# Socket I/O helpers shared by the CRC server and client
+
+# The largest number of buffers a single sendmsg() call may be given
+try:
+    IOV_MAX = os.sysconf("SC_IOV_MAX")
+except (AttributeError, ValueError, OSError):
+    IOV_MAX = 1024
+
+
+# #### Write Queue ####
+# A per-connection queue of outgoing frames. Appending a message never copies the bytes that are already
+# queued. flush() hands as many queued frames as possible to the kernel in a single sendmsg() (writev) call.
+# If the kernel only accepts part of the data, the sent frames are dropped and the offset into the first
+# unsent frame is remembered, so the remainder goes out on the next flush without copying it.
+class WriteQueue:
+    def __init__(self):
+        self.frames = deque()
+        self.offset = 0             # The number of bytes of self.frames[0] that have already been sent
+        self.queued_bytes = 0       # The number of bytes waiting to be sent
+
+    def __len__(self):
+        return self.queued_bytes
+
+    def __bool__(self):
+        return self.queued_bytes > 0
+
+    def append(self, frame):
+        if frame:
+            self.frames.append(frame)
+            self.queued_bytes += len(frame)
+
+    def clear(self):
+        self.frames.clear()
+        self.offset = 0
+        self.queued_bytes = 0
+
+    # Returns every unsent byte as a single bytes object
+    def getvalue(self):
+        if not self.frames:
+            return b''
+        return b''.join(self.frames)[self.offset:]
+
+    # Sends as much of the queue as the socket will accept without blocking and returns the number of bytes
+    # that were sent
+    def flush(self, sock):
+        if not self.frames:
+            return 0
+
+        try:
+            if hasattr(sock, "sendmsg"):
+                buffers = [memoryview(self.frames[0])[self.offset:]]
+                for i in range(1, min(len(self.frames), IOV_MAX)):
+                    buffers.append(self.frames[i])
+                sent = sock.sendmsg(buffers)
+            else:
+                sent = sock.send(memoryview(self.frames[0])[self.offset:])
+        except (BlockingIOError, InterruptedError):
+            return 0
+
+        self.consume(sent)
+        return sent
+
+    # Drops the first sent bytes from the queue
+    def consume(self, sent):
+        self.queued_bytes -= sent
+        sent += self.offset
+        while self.frames and sent >= len(self.frames[0]):
+            sent -= len(self.frames.popleft())
+        self.offset = sent
+
+
+# #### Wakeup Channel ####
+# A connected pair of sockets used to wake up a thread that is blocked in select(). The read end is registered
+# with the selector like any other socket. Any thread can call notify() to make that select() call return
+# immediately, which means the main loop can block in select() indefinitely instead of polling with a short
+# timeout to notice shutdown requests or work handed to it by other threads.
+class WakeupChannel:
+    def __init__(self):
+        self.reader, self.writer = socketpair()
+        self.reader.setblocking(False)
+        self.writer.setblocking(False)
+
+    def fileno(self):
+        return self.reader.fileno()
+
+    def notify(self):
+        try:
+            self.writer.send(b'\x00')
+        except (BlockingIOError, InterruptedError):
+            # The channel is already full of wakeups that have not been read yet, so one is already pending
+            pass
+        except OSError:
+            # The channel has been closed
+            pass
+
+    # Reads and discards every pending wakeup
+    def drain(self):
+        try:
+            while self.reader.recv(4096):
+                pass
+        except (BlockingIOError, InterruptedError):
+            pass
+
+    def close(self):
+        self.reader.close()
+        self.writer.close()
+
+
+# #### Bounded Message Log ####
+# A list-like log of the messages a client or server has received that keeps at most max_entries of the newest
+# entries in memory. When spill_path is given, older entries are appended to that file, one JSON string per
+# line, instead of being thrown away. len(), iteration, indexing, slicing and comparison with a list then cover
+# every entry ever appended, so the log can be used wherever a list of messages was. Without a spill file the
+# log is a ring buffer of the newest entries. Spilled entries are read back from the file only when they are
+# asked for, and the byte offset of every SPILL_INDEX_STRIDE-th one is remembered so that indexing into the file
+# only reads a few lines. With no max_entries the log is unbounded and behaves like a plain list.
+class BoundedMessageLog:
+    SPILL_INDEX_STRIDE = 1024
+
+    def __init__(self, max_entries=None, spill_path=None):
+        if max_entries is not None and max_entries < 1:
+            raise Exception("A bounded message log must keep at least one entry in memory")
+        self.max_entries = max_entries
+        self.spill_path = spill_path
+        self.entries = deque()
+        self.spilled = 0                # The number of entries written to the spill file
+        self.dropped = 0                # The number of entries thrown away because there is no spill file
+        self.spill_index = []           # The byte offset of every SPILL_INDEX_STRIDE-th spilled entry
+        self.spill_file = None
+
+    def __len__(self):
+        return self.spilled + len(self.entries)
+
+    def __bool__(self):
+        return len(self) > 0
+
+    def append(self, entry):
+        self.entries.append(entry)
+        if self.max_entries is not None and len(self.entries) > self.max_entries:
+            self.evict(self.entries.popleft())
+
+    def extend(self, entries):
+        for entry in entries:
+            self.append(entry)
+
+    def clear(self):
+        self.entries.clear()
+        self.close()
+        if self.spilled and os.path.exists(self.spill_path):
+            os.remove(self.spill_path)
+        self.spilled = 0
+        self.dropped = 0
+        self.spill_index = []
+
+    # Closes the spill file. The log can still be read, and is reopened for appending if more entries spill
+    def close(self):
+        if self.spill_file:
+            self.spill_file.close()
+            self.spill_file = None
+
+    # Writes the oldest in-memory entry to the end of the spill file
+    def evict(self, entry):
+        if not self.spill_path:
+            self.dropped += 1
+            return
+        if self.spill_file is None:
+            # The file is truncated when first opened, so a log never reads entries left by an earlier run
+            self.spill_file = open(self.spill_path, 'ab+' if self.spilled else 'wb+')
+        if self.spilled % self.SPILL_INDEX_STRIDE == 0:
+            self.spill_file.seek(0, os.SEEK_END)
+            self.spill_index.append(self.spill_file.tell())
+        self.spill_file.write(json.dumps(entry).encode() + b'\n')
+        self.spilled += 1
+
+    # Yields the spilled entries from the start'th onwards. They are read through a file of their own, so this
+    # works after close() as well
+    def read_spilled(self, start=0):
+        if start >= self.spilled:
+            return
+        if self.spill_file:
+            self.spill_file.flush()
+        with open(self.spill_path, 'rb') as fp:
+            fp.seek(self.spill_index[start // self.SPILL_INDEX_STRIDE])
+            lines = islice(fp, start % self.SPILL_INDEX_STRIDE, self.spilled - start // self.SPILL_INDEX_STRIDE * self.SPILL_INDEX_STRIDE)
+            for line in lines:
+                yield json.loads(line)
+
+    def __iter__(self):
+        yield from self.read_spilled()
+        yield from list(self.entries)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("message log index out of range")
+        if index >= self.spilled:
+            return self.entries[index - self.spilled]
+        return next(self.read_spilled(index))
+
+    def __contains__(self, entry):
+        return any(e == entry for e in self)
+
+    def __eq__(self, other):
+        if isinstance(other, (list, BoundedMessageLog)):
+            return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+        return NotImplemented
+
+    def __repr__(self):
+        return repr(list(self))
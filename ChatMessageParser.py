@@ -1,51 +1,189 @@
 from os import replace
 from abc import ABC
 from enum import Enum
-from struct import pack, unpack
+from struct import Struct
 
 # Message codes
 # 0x00 - Server Registration Message
 # 0x01 - Status Message
 # 0x02 - Server Quit Message
+# 0x03 - Host Snapshot Message
+# 0x04 - Client ID Range Message
+# 0x05 - ID Lease Request Message
+# 0x06 - ID Lease Grant Message
 # 0x80 - User Registration message
 # 0x81 - User Message
 # 0x82 - User Quit Message
+# 0x83 - Presence Subscribe Message
+# 0x84 - Roster Query Message
+# 0x85 - Channel Membership Message
+# 0x86 - Channel Chat Message
 class MessageParser:
     
     @staticmethod
     def parse_messages(bytes):
-        data = bytes
-        messages = []
-        while(len(data) > 0):           
-            msg = None
-            code = data[0]
-            if code == 0x00:
-                msg = ServerRegistrationMessage(data)
-            elif code == 0x80:
-                msg = ClientRegistrationMessage(data)
-            elif code == 0x01:
-                msg =  StatusUpdateMessage(data)
-            elif code == 0x81:
-                msg =  ClientChatMessage(data)
-            elif code == 0x01:
-                msg =  ServerQuitMessage(data)
-            elif code == 0x82:
-                msg =  ClientQuitMessage(data)
-            
-            if msg:
-                messages.append(msg)
-                data = data[msg.variable_message_length:]
-            else:
-                raise Exception("Unrecognized message type!!")
-        
+        decoder = FrameDecoder()
+        messages = list(decoder.feed(bytes))
+        if decoder.pending_bytes:
+            raise Exception("Incomplete message!!")
         return messages
 
+    @staticmethod
+    def message_class(code):
+        if code in MESSAGE_CLASSES:
+            return MESSAGE_CLASSES[code]
+        raise Exception("Unrecognized message type!!")
+
+    # Returns the total length of the message starting at offset in buffer, or None if not enough of the
+    # message's fixed header has arrived yet to know how long it is
+    @staticmethod
+    def frame_length(buffer, offset=0):
+        message_class = MessageParser.message_class(buffer[offset])
+        return message_class.frame_length(buffer, offset)
+
+
+# #### Frame Decoder ####
+# Every connection owns one FrameDecoder. Bytes read from the connection's socket are kept in a preallocated
+# bytearray and complete messages are yielded one at a time. A message that was split across two reads stays
+# in the buffer until the rest of it arrives. Frame boundaries are found through a memoryview, and consumed
+# bytes are only moved when the buffer runs out of room, rather than once per message or once per read.
+#
+# recv_into() reads straight into the free space at the end of the buffer and returns a memoryview of the
+# bytes it received. When that view is passed back to feed(), the bytes are already in place and are not
+# copied. The view is only valid until the next call to recv_into(). The amount read at a time adapts to the
+# connection: it doubles whenever a read fills all of the free space, and halves after a run of small reads.
+class FrameDecoder:
+    MIN_RECV_SIZE = 2048
+    INITIAL_RECV_SIZE = 16384
+    MAX_RECV_SIZE = 1048576
+    SMALL_READS_BEFORE_SHRINKING = 16
+
+    def __init__(self):
+        # Allocated by the first read. Every host in a server's hosts_db owns a FrameDecoder, but only the 
+        # adjacent ones are ever read from
+        self.buffer = bytearray()
+        self.start = 0                  # The offset of the first byte that has not been consumed yet
+        self.end = 0                    # The offset just past the last byte received
+        self.recv_size = self.INITIAL_RECV_SIZE
+        self.small_reads = 0            # The number of small reads in a row
+        self.received = None            # The view returned by the last call to recv_into()
+
+    @property
+    def pending_bytes(self):
+        return self.end - self.start
+
+    # Reads whatever sock has available into the buffer and returns it as a memoryview. An empty view means
+    # the peer has closed the connection.
+    def recv_into(self, sock):
+        view = self.get_buffer()
+        return self.buffer_updated(sock.recv_into(view))
+
+    # Returns a writable memoryview of the free space at the end of the buffer, with room for at least
+    # self.recv_size bytes. Pass the number of bytes written into it to buffer_updated().
+    def get_buffer(self):
+        pending = self.end - self.start
+        if len(self.buffer) - self.end < self.recv_size or len(self.buffer) > 4 * max(self.recv_size, pending):
+            if pending + self.recv_size <= len(self.buffer) <= 4 * max(self.recv_size, pending):
+                # Move the partial message to the front. This does not resize the buffer, so views returned by
+                # earlier reads do not prevent it
+                self.buffer[:pending] = self.buffer[self.start:self.end]
+            else:
+                # Grow or shrink the buffer. A new bytearray is used for the same reason
+                buffer = bytearray(pending + self.recv_size)
+                buffer[:pending] = self.buffer[self.start:self.end]
+                self.buffer = buffer
+            self.start, self.end = 0, pending
+
+        self.received = memoryview(self.buffer)[self.end:]
+        return self.received
+
+    # Records that nbytes were written into the view returned by get_buffer(), adjusts the size of future reads
+    # and returns a memoryview of the received bytes
+    def buffer_updated(self, nbytes):
+        if nbytes >= len(self.received):
+            self.recv_size = min(self.recv_size * 2, self.MAX_RECV_SIZE)
+            self.small_reads = 0
+        elif nbytes < self.recv_size // 4:
+            self.small_reads += 1
+            if self.small_reads >= self.SMALL_READS_BEFORE_SHRINKING:
+                self.recv_size = max(self.recv_size // 2, self.MIN_RECV_SIZE)
+                self.small_reads = 0
+        else:
+            self.small_reads = 0
+
+        self.received = self.received[:nbytes]
+        return self.received
+
+    def feed(self, data):
+        if data is self.received and data is not None:
+            # These bytes were read by recv_into() and are already in place
+            self.end += len(data)
+        else:
+            self.append(data)
+        self.received = None
+
+        offset = self.start
+        try:
+            with memoryview(self.buffer)[:self.end] as view:
+                while offset < len(view):
+                    length = MessageParser.frame_length(view, offset)
+                    if length is None or offset + length > len(view):
+                        break
+                    message = MessageParser.message_class(view[offset])(view, offset)
+                    offset += length
+                    yield message
+        finally:
+            # Everything before offset has been consumed. Any partial message is kept for the next read
+            self.start = offset
+            if self.start == self.end:
+                self.start = self.end = 0
+
+    # Copies data that was not read through recv_into() onto the end of the buffer
+    def append(self, data):
+        if len(self.buffer) - self.end < len(data):
+            pending = self.end - self.start
+            buffer = bytearray(pending + max(len(data), self.recv_size))
+            buffer[:pending] = self.buffer[self.start:self.end]
+            self.buffer = buffer
+            self.start, self.end = 0, pending
+        self.buffer[self.end:self.end + len(data)] = data
+        self.end += len(data)
+
+    def reset(self):
+        self.start = self.end = 0
+        self.received = None
+
 
 # Abstract class for messages
 class Message(ABC):
     pass
 
 
+# Abstract class for messages that end in a variable length content string. Only the fixed header is decoded
+# when the message is parsed. The content is decoded from self.bytes the first time it is read, so a server that
+# is only relaying the message to its next hop can forward self.bytes without ever decoding the content.
+class ContentMessage(Message):
+    CONTENT_OFFSET = 0
+
+    @property
+    def content(self):
+        if self._content is None:
+            self._content = str(self.bytes[self.CONTENT_OFFSET:], 'utf-8')
+        return self._content
+
+
+# Abstract class for registration messages. A host's registration is the same on every hop apart from its
+# LastHopID, so a server can keep an encoded registration and patch that one field instead of re-encoding it.
+class RegistrationMessage(Message):
+    LAST_HOP_OFFSET = 5
+
+    # Returns an encoded registration message with its LastHopID replaced
+    @staticmethod
+    def with_last_hop(registration, last_hop_id):
+        offset = RegistrationMessage.LAST_HOP_OFFSET
+        return registration[:offset] + last_hop_id.to_bytes(4, 'big') + registration[offset + 4:]
+
+
 # #### Server Registration Message ####
 # MessageType (byte = 0x00)
 # SourceID (int)
@@ -54,22 +192,36 @@ class Message(ABC):
 # ServerInfoLength (half)
 # ServerNameString (variable length, UTF-8 encoding)
 # ServerInfoString (variable length, UTF-8 encoding)
-class ServerRegistrationMessage(Message):
-    def __init__(self, bytes):
+class ServerRegistrationMessage(RegistrationMessage):
+    HEADER = Struct("!BIIBH")
+
+    @staticmethod
+    def frame_length(buffer, offset=0):
+        if len(buffer) - offset < 12:
+            return None
+        _, _, _, name_length, info_length = ServerRegistrationMessage.HEADER.unpack_from(buffer, offset)
+        return 12 + name_length + info_length
+
+    def __init__(self, buffer, offset=0):
+        msg = self.HEADER.unpack_from(buffer, offset)
         self.message_type = 0x00
-        msg = unpack("!xIIBH", bytes[:12])
-        self.source_id = msg[0]
-        self.last_hop_id = msg[1]
-        self.server_name_length = msg[2]
-        self.server_info_length = msg[3]
-        self.server_name = unpack("!{0}s".format(self.server_name_length), bytes[12:12+self.server_name_length])[0].decode()
-        self.server_info = unpack("!{0}s".format(self.server_info_length), bytes[12+self.server_name_length:12+self.server_name_length+self.server_info_length])[0].decode()
-        self.variable_message_length = 12 + self.server_name_length + self.server_info_length
-        self.bytes = bytes[:self.variable_message_length]
+        self.source_id = msg[1]
+        self.last_hop_id = msg[2]
+        self.server_name_length = msg[3]
+        self.server_info_length = msg[4]
+        name_start = offset + 12
+        info_start = name_start + self.server_name_length
+        end = info_start + self.server_info_length
+        self.server_name = str(buffer[name_start:info_start], 'utf-8')
+        self.server_info = str(buffer[info_start:end], 'utf-8')
+        self.variable_message_length = end - offset
+        self.bytes = bytes(buffer[offset:end])
         
     @staticmethod
     def bytes(source_id, last_hop_id, server_name, server_info):
-        return pack("!BIIBH{0}s{1}s".format(len(server_name), len(server_info)), 0x00, source_id, last_hop_id, len(server_name), len(server_info), server_name.encode(), server_info.encode())
+        name = server_name.encode()
+        info = server_info.encode()
+        return ServerRegistrationMessage.HEADER.pack(0x00, source_id, last_hop_id, len(name), len(info)) + name + info
 
 
 # #### User Registrtion Message ####
@@ -80,22 +232,36 @@ class ServerRegistrationMessage(Message):
 # UserInfoLength (half)
 # UserNameString (variable length, UTF-8 encoding)
 # UserInfoString (variable length, UTF-8 encoding)
-class ClientRegistrationMessage(Message):
-    def __init__(self, bytes):
+class ClientRegistrationMessage(RegistrationMessage):
+    HEADER = Struct("!BIIBH")
+
+    @staticmethod
+    def frame_length(buffer, offset=0):
+        if len(buffer) - offset < 12:
+            return None
+        _, _, _, name_length, info_length = ClientRegistrationMessage.HEADER.unpack_from(buffer, offset)
+        return 12 + name_length + info_length
+
+    def __init__(self, buffer, offset=0):
+        msg = self.HEADER.unpack_from(buffer, offset)
         self.message_type = 0x80
-        msg = unpack("!xIIBH", bytes[:12])
-        self.source_id = msg[0]
-        self.last_hop_id = msg[1]
-        self.client_name_length = msg[2]
-        self.client_info_length = msg[3]
-        self.client_name = unpack("!{0}s".format(self.client_name_length), bytes[12:12+self.client_name_length])[0].decode()
-        self.client_info = unpack("!{0}s".format(self.client_info_length), bytes[12+self.client_name_length:12+self.client_name_length+self.client_info_length])[0].decode()
-        self.variable_message_length = 12 + self.client_name_length + self.client_info_length
-        self.bytes = bytes[:self.variable_message_length]
+        self.source_id = msg[1]
+        self.last_hop_id = msg[2]
+        self.client_name_length = msg[3]
+        self.client_info_length = msg[4]
+        name_start = offset + 12
+        info_start = name_start + self.client_name_length
+        end = info_start + self.client_info_length
+        self.client_name = str(buffer[name_start:info_start], 'utf-8')
+        self.client_info = str(buffer[info_start:end], 'utf-8')
+        self.variable_message_length = end - offset
+        self.bytes = bytes(buffer[offset:end])
 
     @staticmethod
     def bytes(source_id, last_hop_id, client_name, client_info):
-        return pack("!BIIBH{0}s{1}s".format(len(client_name), len(client_info)), 0x80, source_id, last_hop_id, len(client_name), len(client_info), client_name.encode(), client_info.encode())
+        name = client_name.encode()
+        info = client_info.encode()
+        return ClientRegistrationMessage.HEADER.pack(0x80, source_id, last_hop_id, len(name), len(info)) + name + info
 
 
 # #### Status Update Message ####
@@ -105,21 +271,32 @@ class ClientRegistrationMessage(Message):
 # MessageCode (half)
 # MessageLength (int)
 # MessageString (variable length, UTF-8 encoding)
-class StatusUpdateMessage(Message):
-    def __init__(self, bytes):
+class StatusUpdateMessage(ContentMessage):
+    CONTENT_OFFSET = 15
+    HEADER = Struct("!BIIHI")
+
+    @staticmethod
+    def frame_length(buffer, offset=0):
+        if len(buffer) - offset < 15:
+            return None
+        return 15 + StatusUpdateMessage.HEADER.unpack_from(buffer, offset)[4]
+
+    def __init__(self, buffer, offset=0):
+        msg = self.HEADER.unpack_from(buffer, offset)
         self.message_type = 0x01
-        msg = unpack("!xIIHI", bytes[:15])
-        self.source_id = msg[0]
-        self.destination_id = msg[1]
-        self.status_code = msg[2]
-        self.content_length = msg[3]
-        self.content = unpack("!{0}s".format(self.content_length), bytes[15:15+self.content_length])[0].decode()
-        self.variable_message_length = 15 + self.content_length
-        self.bytes = bytes[:self.variable_message_length]
+        self.source_id = msg[1]
+        self.destination_id = msg[2]
+        self.status_code = msg[3]
+        self.content_length = msg[4]
+        end = offset + 15 + self.content_length
+        self._content = None
+        self.variable_message_length = end - offset
+        self.bytes = bytes(buffer[offset:end])
 
     @staticmethod
     def bytes(source_id, destination_id, message_code, content):
-        return pack("!BIIHI{0}s".format(len(content)), 0x01, source_id, destination_id, message_code, len(content), content.encode())
+        content = content.encode()
+        return StatusUpdateMessage.HEADER.pack(0x01, source_id, destination_id, message_code, len(content)) + content
 
 
 # #### User Chat Message ####
@@ -128,20 +305,31 @@ class StatusUpdateMessage(Message):
 # DestinationID (int)
 # MessageLength (int)
 # MessageString (variable length, UTF-8 encoding)
-class ClientChatMessage(Message):
-    def __init__(self, bytes):
+class ClientChatMessage(ContentMessage):
+    CONTENT_OFFSET = 13
+    HEADER = Struct("!BIII")
+
+    @staticmethod
+    def frame_length(buffer, offset=0):
+        if len(buffer) - offset < 13:
+            return None
+        return 13 + ClientChatMessage.HEADER.unpack_from(buffer, offset)[3]
+
+    def __init__(self, buffer, offset=0):
+        msg = self.HEADER.unpack_from(buffer, offset)
         self.message_type = 0x81
-        msg = unpack("!xIII", bytes[:13])
-        self.source_id = msg[0]
-        self.destination_id = msg[1]
-        self.content_length = msg[2]
-        self.content = unpack("!{0}s".format(self.content_length), bytes[13:13+self.content_length])[0].decode()
-        self.variable_message_length = 13 + self.content_length
-        self.bytes = bytes[:self.variable_message_length]
+        self.source_id = msg[1]
+        self.destination_id = msg[2]
+        self.content_length = msg[3]
+        end = offset + 13 + self.content_length
+        self._content = None
+        self.variable_message_length = end - offset
+        self.bytes = bytes(buffer[offset:end])
 
     @staticmethod
     def bytes(source_id, destination_id, content):
-        return pack("!BIII{0}s".format(len(content)), 0x81, source_id, destination_id, len(content), content.encode())
+        content = content.encode()
+        return ClientChatMessage.HEADER.pack(0x81, source_id, destination_id, len(content)) + content
 
 
 # #### Server Shutdown Message (Extra Credit) ####
@@ -150,20 +338,195 @@ class ClientChatMessage(Message):
 # ReplacementServerID (int)
 # MessageLength (int)
 # MessageString (variable length, UTF-8 encoding)
-class ServerQuitMessage(Message):
-    def __init__(self, bytes):
+class ServerQuitMessage(ContentMessage):
+    CONTENT_OFFSET = 13
+    HEADER = Struct("!BIII")
+
+    @staticmethod
+    def frame_length(buffer, offset=0):
+        if len(buffer) - offset < 13:
+            return None
+        return 13 + ServerQuitMessage.HEADER.unpack_from(buffer, offset)[3]
+
+    def __init__(self, buffer, offset=0):
+        msg = self.HEADER.unpack_from(buffer, offset)
         self.message_type = 0x02
-        msg = unpack("!xIII", bytes[:13])
-        self.source_id = msg[0]
-        self.replacement_id = msg[1]
-        self.content_length = msg[2]
-        self.content = unpack("!{0}s".format(self.content_length), bytes[13:13+self.content_length])[0].decode()
-        self.variable_message_length = 13 + self.content_length
-        self.bytes = bytes[:self.variable_message_length]
+        self.source_id = msg[1]
+        self.replacement_id = msg[2]
+        self.content_length = msg[3]
+        end = offset + 13 + self.content_length
+        self._content = None
+        self.variable_message_length = end - offset
+        self.bytes = bytes(buffer[offset:end])
 
     @staticmethod
     def bytes(source_id, replacement_server_id, content):
-        return pack("!BIII{0}s".format(len(content)), 0x81, source_id, replacement_server_id, len(content), content.encode())
+        content = content.encode()
+        return ServerQuitMessage.HEADER.pack(0x02, source_id, replacement_server_id, len(content)) + content
+
+
+# #### Host Snapshot Message ####
+# MessageType (byte = 0x03)
+# SourceID (int)
+# HostCount (int)
+# RecordsLength (int)
+# Records (variable length), HostCount records of:
+#     HostType (byte = 0x00 for a server, 0x80 for a client)
+#     HostID (int)
+#     NameLength (byte)
+#     InfoLength (half)
+#     NameString (variable length, UTF-8 encoding)
+#     InfoString (variable length, UTF-8 encoding)
+# Carries every host a server knows about in one frame, so a brand new adjacent server can be told about the 
+# whole network at once instead of with one registration message per host. SourceID is the adjacent server 
+# that sent the snapshot, so a server passing a snapshot on sends forwarded_bytes() with its own ID instead.
+class HostSnapshotMessage(Message):
+    HEADER = Struct("!BIII")
+    RECORD = Struct("!BIBH")
+
+    @staticmethod
+    def frame_length(buffer, offset=0):
+        if len(buffer) - offset < 13:
+            return None
+        return 13 + HostSnapshotMessage.HEADER.unpack_from(buffer, offset)[3]
+
+    def __init__(self, buffer, offset=0):
+        msg = self.HEADER.unpack_from(buffer, offset)
+        self.message_type = 0x03
+        self.source_id = msg[1]
+        self.host_count = msg[2]
+        self.records_length = msg[3]
+        end = offset + 13 + self.records_length
+        self.variable_message_length = end - offset
+        self.bytes = bytes(buffer[offset:end])
+
+    # Yields (host_type, host_id, name, info) for every host in the snapshot. The records are only decoded 
+    # when they are read, in a single pass over the message.
+    def hosts(self):
+        unpack_record = self.RECORD.unpack_from
+        data = self.bytes
+        offset = 13
+        for i in range(self.host_count):
+            host_type, host_id, name_length, info_length = unpack_record(data, offset)
+            name_start = offset + 8
+            info_start = name_start + name_length
+            offset = info_start + info_length
+            yield host_type, host_id, str(data[name_start:info_start], 'utf-8'), str(data[info_start:offset], 'utf-8')
+
+    # Returns this message with its SourceID replaced, without re-encoding the records
+    def forwarded_bytes(self, source_id):
+        return self.bytes[:1] + source_id.to_bytes(4, 'big') + self.bytes[5:]
+
+    # hosts is an iterable of (host_type, host_id, name, info) tuples
+    @staticmethod
+    def bytes(source_id, hosts):
+        return HostSnapshotMessage.from_records(source_id, [HostSnapshotMessage.record(*host) for host in hosts])
+
+    # Builds a snapshot from records that have already been encoded with record()
+    @staticmethod
+    def from_records(source_id, records):
+        records_length = sum(map(len, records))
+        return b''.join([HostSnapshotMessage.HEADER.pack(0x03, source_id, len(records), records_length)] + records)
+
+    # Encodes the record describing one host. A record holds the same fields as the host's registration 
+    # message apart from LastHopID, so registration_record() can cut one out of an encoded registration instead.
+    @staticmethod
+    def record(host_type, host_id, name, info):
+        name = name.encode()
+        info = info.encode()
+        return HostSnapshotMessage.RECORD.pack(host_type, host_id, len(name), len(info)) + name + info
+
+    @staticmethod
+    def registration_record(registration):
+        return registration[:5] + registration[9:]
+
+
+# #### Client ID Range Message ####
+# MessageType (byte = 0x04)
+# SourceID (int) - The server that owns the range
+# LowID (int) - The first client ID in the range
+# HighID (int) - The last client ID in the range
+# Announces that every client whose ID falls in [LowID, HighID] is reached through the source server.
+class ClientIdRangeMessage(Message):
+    HEADER = Struct("!BIII")
+
+    @staticmethod
+    def frame_length(buffer, offset=0):
+        if len(buffer) - offset < 13:
+            return None
+        return 13
+
+    def __init__(self, buffer, offset=0):
+        msg = self.HEADER.unpack_from(buffer, offset)
+        self.message_type = 0x04
+        self.source_id = msg[1]
+        self.low_id = msg[2]
+        self.high_id = msg[3]
+        self.variable_message_length = 13
+        self.bytes = bytes(buffer[offset:offset + 13])
+
+    @staticmethod
+    def bytes(source_id, low_id, high_id):
+        return ClientIdRangeMessage.HEADER.pack(0x04, source_id, low_id, high_id)
+
+
+# #### ID Lease Request Message ####
+# MessageType (byte = 0x05)
+# SourceID (int) - The server asking for IDs
+# IdCount (int) - The number of IDs it would like
+# Sent by a server to its parent when it is running out of IDs to hand to hosts that connect without one.
+class IdLeaseRequestMessage(Message):
+    HEADER = Struct("!BII")
+
+    @staticmethod
+    def frame_length(buffer, offset=0):
+        if len(buffer) - offset < 9:
+            return None
+        return 9
+
+    def __init__(self, buffer, offset=0):
+        msg = self.HEADER.unpack_from(buffer, offset)
+        self.message_type = 0x05
+        self.source_id = msg[1]
+        self.id_count = msg[2]
+        self.variable_message_length = 9
+        self.bytes = bytes(buffer[offset:offset + 9])
+
+    @staticmethod
+    def bytes(source_id, id_count):
+        return IdLeaseRequestMessage.HEADER.pack(0x05, source_id, id_count)
+
+
+# #### ID Lease Grant Message ####
+# MessageType (byte = 0x06)
+# SourceID (int) - The server handing out the IDs
+# DestinationID (int) - The server that asked for them
+# LowID (int) - The first ID in the block
+# HighID (int) - The last ID in the block
+# Sent by a server to an adjacent server in reply to an ID Lease Request. The block may hold fewer IDs than 
+# were asked for.
+class IdLeaseGrantMessage(Message):
+    HEADER = Struct("!BIIII")
+
+    @staticmethod
+    def frame_length(buffer, offset=0):
+        if len(buffer) - offset < 17:
+            return None
+        return 17
+
+    def __init__(self, buffer, offset=0):
+        msg = self.HEADER.unpack_from(buffer, offset)
+        self.message_type = 0x06
+        self.source_id = msg[1]
+        self.destination_id = msg[2]
+        self.low_id = msg[3]
+        self.high_id = msg[4]
+        self.variable_message_length = 17
+        self.bytes = bytes(buffer[offset:offset + 17])
+
+    @staticmethod
+    def bytes(source_id, destination_id, low_id, high_id):
+        return IdLeaseGrantMessage.HEADER.pack(0x06, source_id, destination_id, low_id, high_id)
 
 
 # #### User Quit Message ####
@@ -171,16 +534,176 @@ class ServerQuitMessage(Message):
 # SourceID (int)
 # MessageLength (int)
 # MessageString (variable length, UTF-8 encoding)
-class ClientQuitMessage(Message):
-    def __init__(self, bytes):
+class ClientQuitMessage(ContentMessage):
+    CONTENT_OFFSET = 9
+    HEADER = Struct("!BII")
+
+    @staticmethod
+    def frame_length(buffer, offset=0):
+        if len(buffer) - offset < 9:
+            return None
+        return 9 + ClientQuitMessage.HEADER.unpack_from(buffer, offset)[2]
+
+    def __init__(self, buffer, offset=0):
+        msg = self.HEADER.unpack_from(buffer, offset)
         self.message_type = 0x82
-        msg = unpack("!xII", bytes[:9])
-        self.source_id = msg[0]
-        self.content_length = msg[1]
-        self.content = unpack("!{0}s".format(self.content_length), bytes[9:9+self.content_length])[0].decode()
-        self.variable_message_length = 9 + self.content_length
-        self.bytes = bytes[:self.variable_message_length]
+        self.source_id = msg[1]
+        self.content_length = msg[2]
+        end = offset + 9 + self.content_length
+        self._content = None
+        self.variable_message_length = end - offset
+        self.bytes = bytes(buffer[offset:end])
 
     @staticmethod
     def bytes(source_id, content):
-        return pack("!BII{0}s".format(len(content)), 0x82, source_id, len(content), content.encode())
\ No newline at end of file
+        content = content.encode()
+        return ClientQuitMessage.HEADER.pack(0x82, source_id, len(content)) + content
+
+
+# #### Presence Subscribe Message ####
+# MessageType (byte = 0x83)
+# SourceID (int)
+# Action (byte = 0x00 to subscribe, 0x01 to unsubscribe)
+# HostCount (int)
+# HostIDs (HostCount ints)
+# Sent by a client that only wants the registration and quit messages of the clients it names, rather than 
+# those of every client on the network. A server sends one towards the server whose ID range holds a client
+# when one of its own links subscribes to that client.
+class PresenceSubscribeMessage(Message):
+    HEADER = Struct("!BIBI")
+
+    @staticmethod
+    def frame_length(buffer, offset=0):
+        if len(buffer) - offset < 10:
+            return None
+        return 10 + 4 * PresenceSubscribeMessage.HEADER.unpack_from(buffer, offset)[3]
+
+    def __init__(self, buffer, offset=0):
+        msg = self.HEADER.unpack_from(buffer, offset)
+        self.message_type = 0x83
+        self.source_id = msg[1]
+        self.action = msg[2]
+        self.host_count = msg[3]
+        end = offset + 10 + 4 * self.host_count
+        self.host_ids = list(Struct("!%dI" % self.host_count).unpack_from(buffer, offset + 10))
+        self.variable_message_length = end - offset
+        self.bytes = bytes(buffer[offset:end])
+
+    @staticmethod
+    def bytes(source_id, action, host_ids):
+        host_ids = list(host_ids)
+        return PresenceSubscribeMessage.HEADER.pack(0x83, source_id, action, len(host_ids)) + \
+            Struct("!%dI" % len(host_ids)).pack(*host_ids)
+
+
+# #### Roster Query Message ####
+# MessageType (byte = 0x84)
+# SourceID (int)
+# AfterID (int) - Only clients with a larger ID are returned
+# Limit (int) - The most clients to return
+# Asks the server for one page of the clients it knows about, in order of ID. The server replies with a 
+# HostSnapshotMessage holding up to Limit clients. A page with fewer than Limit clients is the last one, and
+# the next page starts after the largest ID in this one.
+class RosterQueryMessage(Message):
+    HEADER = Struct("!BIII")
+
+    @staticmethod
+    def frame_length(buffer, offset=0):
+        if len(buffer) - offset < 13:
+            return None
+        return 13
+
+    def __init__(self, buffer, offset=0):
+        msg = self.HEADER.unpack_from(buffer, offset)
+        self.message_type = 0x84
+        self.source_id = msg[1]
+        self.after_id = msg[2]
+        self.limit = msg[3]
+        self.variable_message_length = 13
+        self.bytes = bytes(buffer[offset:offset + 13])
+
+    @staticmethod
+    def bytes(source_id, after_id, limit):
+        return RosterQueryMessage.HEADER.pack(0x84, source_id, after_id, limit)
+
+
+# #### Channel Membership Message ####
+# MessageType (byte = 0x85)
+# SourceID (int)
+# ChannelID (int)
+# Action (byte = 0x00 to join, 0x01 to leave)
+# Sent by a client joining or leaving a channel. A server sends one to an adjacent server when it gains its 
+# first, or loses its last, member of the channel that is not behind that server.
+class ChannelMembershipMessage(Message):
+    HEADER = Struct("!BIIB")
+
+    @staticmethod
+    def frame_length(buffer, offset=0):
+        if len(buffer) - offset < 10:
+            return None
+        return 10
+
+    def __init__(self, buffer, offset=0):
+        msg = self.HEADER.unpack_from(buffer, offset)
+        self.message_type = 0x85
+        self.source_id = msg[1]
+        self.channel_id = msg[2]
+        self.action = msg[3]
+        self.variable_message_length = 10
+        self.bytes = bytes(buffer[offset:offset + 10])
+
+    @staticmethod
+    def bytes(source_id, channel_id, action):
+        return ChannelMembershipMessage.HEADER.pack(0x85, source_id, channel_id, action)
+
+
+# #### Channel Chat Message ####
+# MessageType (byte = 0x86)
+# SourceID (int)
+# ChannelID (int)
+# MessageLength (int)
+# MessageString (variable length, UTF-8 encoding)
+class ChannelChatMessage(ContentMessage):
+    CONTENT_OFFSET = 13
+    HEADER = Struct("!BIII")
+
+    @staticmethod
+    def frame_length(buffer, offset=0):
+        if len(buffer) - offset < 13:
+            return None
+        return 13 + ChannelChatMessage.HEADER.unpack_from(buffer, offset)[3]
+
+    def __init__(self, buffer, offset=0):
+        msg = self.HEADER.unpack_from(buffer, offset)
+        self.message_type = 0x86
+        self.source_id = msg[1]
+        self.channel_id = msg[2]
+        self.content_length = msg[3]
+        end = offset + 13 + self.content_length
+        self._content = None
+        self.variable_message_length = end - offset
+        self.bytes = bytes(buffer[offset:end])
+
+    @staticmethod
+    def bytes(source_id, channel_id, content):
+        content = content.encode()
+        return ChannelChatMessage.HEADER.pack(0x86, source_id, channel_id, len(content)) + content
+
+
+# Maps each message code to the class used to decode it
+MESSAGE_CLASSES = {
+    0x00:ServerRegistrationMessage,
+    0x01:StatusUpdateMessage,
+    0x02:ServerQuitMessage,
+    0x03:HostSnapshotMessage,
+    0x04:ClientIdRangeMessage,
+    0x05:IdLeaseRequestMessage,
+    0x06:IdLeaseGrantMessage,
+    0x80:ClientRegistrationMessage,
+    0x81:ClientChatMessage,
+    0x82:ClientQuitMessage,
+    0x83:PresenceSubscribeMessage,
+    0x84:RosterQueryMessage,
+    0x85:ChannelMembershipMessage,
+    0x86:ChannelChatMessage,
+}
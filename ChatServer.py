@@ -1,8 +1,13 @@
 from ChatMessageParser import *
+from ChatIO import *
 from socket import *
 import os
 import selectors
 import logging
+import threading
+import time
+from bisect import bisect_right
+from heapq import nsmallest
 
 ##############################################################################################################
 
@@ -12,18 +17,75 @@ class BaseConnectionData():
     one representing data associated with a connected server and one representing data associated with a 
     connected client.         
     
-    The fundamental responsibility of classes derived from ConnectionData is to store a write buffer 
-    associated with a particular socket. This server will append messages to be sent to this write buffer and 
+    The fundamental responsibility of classes derived from ConnectionData is to store a write queue 
+    associated with a particular socket. This server will append messages to be sent to this write queue and 
     will then send the messages at a later point when it is possible to do so (i.e. the next time select() is 
     called by the main loop). This functionality is defined in this base class. Other functionality will be 
     defined in derived subclasses.
+
+    The write queue keeps each queued message as its own frame rather than concatenating them into one bytes
+    object. Calling self.write_queue.flush(sock) sends as many of the queued frames as the socket will accept 
+    in a single system call and keeps track of anything that could not be sent yet, since send() is not 
+    guaranteed to write everything it is given.
+
+    Each connection also owns a FrameDecoder. TCP does not preserve message boundaries, so a single call to 
+    recv() may return several messages, or only part of one. The frame decoder holds on to any partial message
+    until the rest of it arrives on a later read. Its recv_into() method reads from the socket straight into a
+    receive buffer that is reused for every read and that grows or shrinks with the amount of data arriving.
     """    
     def __init__(self):
-        self.write_buffer = b''
+        self.write_queue = WriteQueue()
+        self.frame_decoder = FrameDecoder()
+        self.registration = None        # (last_hop_id, frame) for this host's cached registration message
+        self.record = None              # This host's cached HostSnapshotMessage record
+
+    # Returns this host's registration message with last_hop_id as its LastHopID. The message is encoded the 
+    # first time it is needed and kept until the host's name or info changes. A server always passes its own 
+    # ID, so replaying a host's registration to a new neighbour normally just returns the cached bytes.
+    def registration_frame(self, last_hop_id):
+        if self.registration is None:
+            self.registration = (last_hop_id, self.encode_registration(last_hop_id))
+        elif self.registration[0] != last_hop_id:
+            self.registration = (last_hop_id, RegistrationMessage.with_last_hop(self.registration[1], last_hop_id))
+        return self.registration[1]
+
+    # Returns the record describing this host in a HostSnapshotMessage, cached like registration_frame()
+    def snapshot_record(self):
+        if self.record is None:
+            last_hop_id = self.registration[0] if self.registration else 0
+            self.record = HostSnapshotMessage.registration_record(self.registration_frame(last_hop_id))
+        return self.record
+
+    # Called when a field that appears in the registration message changes
+    def invalidate_registration(self):
+        self.registration = None
+        self.record = None
+
+    # The unsent contents of the write queue as a single bytes object. Assigning to write_buffer replaces the 
+    # contents of the write queue. Prefer CRCServer.queue_message() and CRCServer.flush_io_device() in new code.
+    @property
+    def write_buffer(self):
+        return self.write_queue.getvalue()
+
+    @write_buffer.setter
+    def write_buffer(self, value):
+        self.write_queue.clear()
+        self.write_queue.append(value)
+
+# A property for a field of ServerConnectionData or ClientConnectionData that appears in the host's 
+# registration message. Assigning to it throws away the cached registration.
+def registration_field(name):
+    attribute = "_" + name
+
+    def set_field(self, value):
+        setattr(self, attribute, value)
+        self.invalidate_registration()
+
+    return property(lambda self: getattr(self, attribute), set_field)
 
 class ServerConnectionData(BaseConnectionData):
     """ ServerConnectionData encapsulates data associated with a connection to another server. It derives from 
-    BaseConnectionData which means it contains a write buffer, in addition to additional properties defined 
+    BaseConnectionData which means it contains a write queue, in addition to additional properties defined 
     in this class that are specific to connections with other servers.
     """    
     def __init__(self, id, server_name, server_info):
@@ -33,9 +95,16 @@ class ServerConnectionData(BaseConnectionData):
         self.server_info = server_info     # Stores a human-readable description of the server
         self.first_link_id = None          # The ID of the first host on the path to this server
 
+    id = registration_field("id")
+    server_name = registration_field("server_name")
+    server_info = registration_field("server_info")
+
+    def encode_registration(self, last_hop_id):
+        return ServerRegistrationMessage.bytes(self.id, last_hop_id, self.server_name, self.server_info)
+
 class ClientConnectionData(BaseConnectionData):    
     """ ClientConnectionData encapsulates data associated with a connection to a client application. It 
-    derives from BaseConnectionData which means it contains a write buffer, in addition to additional 
+    derives from BaseConnectionData which means it contains a write queue, in addition to additional 
     properties defined in this class that are specific to connections with client applications.
     """
     def __init__(self, id, client_name, client_info):
@@ -45,10 +114,87 @@ class ClientConnectionData(BaseConnectionData):
         self.client_info = client_info      # Stores a human-readable description of the client
         self.first_link_id = None           # The ID of the first host on the path to this client
 
+    id = registration_field("id")
+    client_name = registration_field("client_name")
+    client_info = registration_field("client_info")
+
+    def encode_registration(self, last_hop_id):
+        return ClientRegistrationMessage.bytes(self.id, last_hop_id, self.client_name, self.client_info)
+
+class HostIdList():
+    """ HostIdList stores the IDs of the servers or clients that are adjacent to this server. It can be used 
+    just like a list of IDs: append(), remove(), the in operator, len(), iteration, indexing and comparison 
+    with a list all work. Unlike a list, it is backed by a dictionary, so checking whether an ID is present and
+    removing an ID take the same amount of time no matter how many IDs are stored. Each ID is stored once.
+    """
+    def __init__(self, ids=()):
+        self.ids = dict.fromkeys(ids)
+
+    def append(self, id):
+        self.ids[id] = None
+
+    def remove(self, id):
+        try:
+            del self.ids[id]
+        except KeyError:
+            raise ValueError("%r is not in the list" % (id,)) from None
+
+    def discard(self, id):
+        self.ids.pop(id, None)
+
+    def __contains__(self, id):
+        return id in self.ids
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __iter__(self):
+        return iter(self.ids)
+
+    def __getitem__(self, index):
+        return list(self.ids)[index]
+
+    def __eq__(self, other):
+        return list(self.ids) == list(other)
+
+    def __repr__(self):
+        return repr(list(self.ids))
+
+class MessageBatch():
+    """ MessageBatch collects the registration and quit messages queued for one connection during a batch 
+    tick (see CRCServer.batch_tick), so that they are sent as a single write instead of one write each.
+
+    If cancel_join_quit is set, a Client Quit message for a client whose registration is still waiting in the
+    batch removes that registration instead of being added. The client joined and left before the machine on 
+    the other end of the connection heard about it, so neither message needs to be sent.
+    """
+    MESSAGE_TYPES = (0x00, 0x80, 0x82)      # The message types that are batched
+
+    def __init__(self, cancel_join_quit=False):
+        self.frames = []
+        self.registrations = {}             # Maps each client registered in this batch to its index in frames
+        self.cancel_join_quit = cancel_join_quit
+        self.cancelled = 0                  # The number of registrations cancelled by a quit
+
+    def append(self, message):
+        # Only a message holding a single frame can be matched up with another one
+        if len(message) == MessageParser.frame_length(message):
+            source_id = int.from_bytes(message[1:5], 'big')
+            if message[0] == 0x80:
+                self.registrations[source_id] = len(self.frames)
+            elif message[0] == 0x82 and self.cancel_join_quit and source_id in self.registrations:
+                self.frames[self.registrations.pop(source_id)] = None
+                self.cancelled += 1
+                return
+        self.frames.append(message)
+
+    def getvalue(self):
+        return b''.join([frame for frame in self.frames if frame is not None])
+
 ##############################################################################################################
 
 class CRCServer(object):
-    def __init__(self, options, run_on_localhost=False):
+    def __init__(self, options, run_on_localhost=False, engine=None):
         """ Initializes important values for CRCServer objects. Noteworthy variables include:
         
         * self.hosts_db (dictionary): this dictionary should be used to store information about all other 
@@ -58,9 +204,22 @@ class CRCServer(object):
         * self.adjacent_server_ids (list): this list should store the IDs of all adjacent servers. You can use
             this list to find the appropriate ServerConnectionData objects stored in self.hosts_db when needed
         * self.adjacent_client_ids (list): this list should store the IDs of all adjacent clients. It serves
-            the same purpose as self.adjacent_server_ids except for client machines.
+            the same purpose as self.adjacent_server_ids except for client machines. Both are HostIdLists, 
+            which work like lists but can find and remove an ID without searching through every ID.
+        * self.routes (dictionary): maps the ID of every known host to the socket of the adjacent machine that 
+            messages for that host should be sent to. Keep it up to date with self.add_route() and 
+            self.remove_route(), and look hosts up in it with self.next_hop().
+        * self.reachable_hosts (dictionary): the reverse of self.routes. It maps each adjacent machine's socket 
+            to the set of host IDs reachable through it, so that self.purge_link() can forget every host behind
+            a lost connection without searching all of self.hosts_db.
+        * self.purge_on_disconnect (bool): whether close_io_device() calls self.purge_link() when a connection 
+            closes. It is off by default because the test cases shut servers down one at a time and then check
+            what each server still knows about the network.
+        * self.orphan_timeout (float): how many seconds a host adopted from a quitting server (see 
+            adopt_subtree()) may go without being relinked before it is forgotten, as if its link had been lost.
         * self.status_updates_log (list): the message of any status updates addressed to this server should be
-            placed in this list. This is purely for the purpose of grading.
+            placed in this list. This is purely for the purpose of grading. It is a BoundedMessageLog, which 
+            supports append(), len(), iteration and indexing like a list.
         * self.id (int): the ID of this server. It is initialized upon class instantiation.
         * self.server_name (string): the name of this server. It is initialized upon class instantiation.
         * self.server_info (string): a description of this server. It is initialized upon class instantiation.
@@ -74,7 +233,38 @@ class CRCServer(object):
             startup. If this is empty then this server is the first server to come online and does not need to
             connect to any other servers on startup.
         * self.request_terminate (bool): a flag used by the testing application to indicate whether your code
-            should continue running or shutdown. You should NOT change the value of this variable in your code
+            should continue running or shutdown. You should NOT change the value of this variable in your code.
+            The testing application sets it by calling self.stop(), which also wakes up your main loop.
+        * self.wakeup_channel (WakeupChannel): a socket that becomes readable whenever another thread needs the
+            main loop to wake up (e.g. to shut down). It is registered with your selector for you in run().
+        * self.write_high_watermark and self.write_low_watermark (int): once a connection's write queue holds 
+            at least write_high_watermark bytes, queue_message() stops reading from the connection whose 
+            message is being handled, since it is feeding the congested one. Reading resumes once the queue 
+            drains to write_low_watermark bytes or fewer.
+        * self.slow_client_policy (string): what queue_message() does with a chat message for an adjacent 
+            client whose write queue is above the high watermark. "block" queues it and applies the backpressure 
+            described above, "drop" discards it, and "disconnect" drops it and disconnects the client.
+        * self.batch_tick (float): when set, queue_message() holds back registration and quit messages for up 
+            to this many seconds and then sends everything held back for each connection as one write (see 
+            MessageBatch). A tick of 0 sends them at the end of each pass of the main loop. None (the default) 
+            sends every message right away. self.cancel_join_quit drops a client's registration and quit 
+            messages if both are held back in the same batch.
+        * self.client_id_range (tuple): the (low, high) range of client IDs this server owns, or None. When 
+            servers own client ID ranges, a client's registration is not flooded to the other servers. They 
+            reach the client through the server whose range holds its ID instead, with one routing entry per 
+            server rather than one per client (see self.id_ranges and self.next_hop()).
+        * self.id_block_size (int): a server or client may connect with an ID of 0 and be given one by the 
+            server it connects to. Servers lease blocks of this many IDs from their parent server, and the 
+            first server in the tree hands them out from self.id_pool. dispatch_message() assigns the IDs for
+            you, so the message handlers always see a registration with a real ID.
+        * self.presence_interest (dictionary): maps the socket of each link that subscribed to presence (with a
+            PresenceSubscribeMessage) to the set of client IDs it wants the registration and quit messages of. 
+            Clients that never subscribe are sent those messages for every client, as before. Use 
+            self.send_presence() to send them only where they are wanted.
+        * self.channel_links (dictionary): maps each channel ID to the set of sockets of the adjacent links 
+            with members of that channel, i.e. adjacent clients that joined it and adjacent servers with a 
+            member somewhere behind them. A channel message is sent once over each of them, except the one it 
+            arrived on (see self.send_to_channel()).
         
         TODO: Create your selector and store it in self.sel (see comment below).
                 
@@ -82,6 +272,10 @@ class CRCServer(object):
             options (Options): an object containing various properties used to configure the server
             run_on_localhost (bool): a boolean indiciating whether this server should connected to 
                 applications via localhost or an actual IP address
+            engine (string): the I/O engine that drives this server. "selectors" (the default) runs the 
+                selector loop you write in check_IO_devices_for_messages(). "asyncio" runs the same message 
+                handlers on an asyncio event loop instead (see AsyncChatServer.py). If this is None, the 
+                --engine option is used.
         Returns:
             None        
         """
@@ -100,14 +294,14 @@ class CRCServer(object):
         self.hosts_db = {}
 
         # This list should contain the ids of all servers that are directly connected to this server.
-        self.adjacent_server_ids = []
+        self.adjacent_server_ids = HostIdList()
 
         # This list should contain the ids of all clients that are directly connected to this server 
-        self.adjacent_user_ids = []
+        self.adjacent_user_ids = HostIdList()
         
         # Store the content of all status messages directed to this server in this list. This is purely 
         # for grading purposes
-        self.status_updates_log = []
+        self.status_updates_log = self.new_message_log(options, "status_updates_log")
 
 
         # Do not change the contents of any variables in __init__ below this line
@@ -125,6 +319,69 @@ class CRCServer(object):
 
         self.request_terminate = False                  # A flag used by the testing application to instruct
                                                         # your code to terminate at the end of a test.
+        self.run_on_localhost = run_on_localhost        # Whether to only accept connections over localhost
+        self.reuse_port = getattr(options, 'reuse_port', False) # Whether other processes may listen on self.port
+        self.engine = engine or getattr(options, 'engine', None) or 'selectors'
+        self.async_engine = None                        # The AsyncioServerEngine, when self.engine is "asyncio"
+        self.wakeup_channel = WakeupChannel()           # Wakes the main loop up when it is blocked in select()
+        self.pending_callbacks = deque()                # Work handed to the main loop by other threads
+        self.loop_thread = None                         # The thread running the main loop
+        self.routes = {}                                # Maps each known host ID to its next hop's socket
+        self.reachable_hosts = {}                       # Maps each next hop's socket to the IDs routed over it
+        self.purge_on_disconnect = self.option_or_default(options, 'purge_on_disconnect', False)
+        self.orphaned_hosts = set()                     # Hosts adopted from a quitting server that have not 
+                                                        # been relinked yet (see adopt_subtree())
+        self.orphan_timeout = self.option_or_default(options, 'orphan_timeout', 5.0)
+        self.orphan_deadlines = deque()                 # (deadline, host IDs) for each adoption, oldest first
+        self.quit_deadline = None                       # When quit_network() stops waiting for the write 
+                                                        # queues to drain
+
+        self.write_high_watermark = self.option_or_default(options, 'write_high_watermark', 1048576)
+        self.write_low_watermark = self.option_or_default(options, 'write_low_watermark', 262144)
+        self.slow_client_policy = self.option_or_default(options, 'slow_client_policy', 'block')
+        if self.slow_client_policy not in ('drop', 'block', 'disconnect'):
+            raise Exception("Unrecognized slow client policy: " + self.slow_client_policy)
+        self.current_io_device = None                   # The io_device whose message is being handled
+        self.paused_sources = {}                        # Maps a congested socket to the sockets paused for it
+        self.paused_reads = {}                          # Maps a paused socket to the number of sockets it is
+                                                        # paused for
+        self.paused_keys = {}                           # Maps each paused socket with nothing to send, which
+                                                        # the selector is not watching, to its data object
+        self.batch_tick = self.option_or_default(options, 'batch_tick', None)
+        self.cancel_join_quit = self.option_or_default(options, 'cancel_join_quit', False)
+        self.pending_batches = {}                       # Maps each socket to the MessageBatch held back for it
+        self.batch_deadline = None                      # When the pending batches are due to be sent
+        self.client_id_range = self.parse_id_range(self.option_or_default(options, 'client_id_range', None))
+        self.id_ranges = []                             # (low, high, server ID) for each known client ID 
+                                                        # range, sorted by low
+        self.id_range_starts = []                       # The low end of each range in self.id_ranges
+        if self.client_id_range:
+            if not self.id:
+                raise Exception("A server that owns a client ID range needs an ID")
+            self.id_ranges.append(self.client_id_range + (self.id,))
+            self.id_range_starts.append(self.client_id_range[0])
+        self.id_block_size = self.option_or_default(options, 'id_block_size', 256)
+        self.id_pool = self.parse_id_range(self.option_or_default(options, 'id_pool', (0x40000000, 0xEFFFFFFF)))
+        self.id_leases = deque()                        # [next ID, last ID] for each block of IDs leased
+        self.id_lease_requested = False                 # Whether a request to the parent is outstanding
+        self.lease_requests = deque()                   # (socket, server ID, count) for each request from an
+                                                        # adjacent server waiting for IDs
+        self.awaiting_ids = deque()                     # (socket, message) for each registration waiting for
+                                                        # an ID to be assigned
+        self.next_range_id = self.client_id_range[0] if self.client_id_range else None
+        self.parent_server_id = None                    # Set when this server is moved to a new parent
+        self.parent_server_address = None               # The "host:port" of that parent, from its quit message
+        self.pending_connections = {}                   # Maps each socket still connecting to a replacement 
+                                                        # to its (on_connected, on_failed) callbacks
+        self.presence_interest = {}                     # Maps each subscribed link's socket to the client IDs
+                                                        # it subscribed to
+        self.presence_subscribers = {}                  # Maps each client ID to the sockets subscribed to it
+        self.upstream_presence = set()                  # Client IDs this server has subscribed to in another
+                                                        # server's range
+        self.channel_links = {}                         # Maps each channel ID to the sockets with members
+        self.link_channels = {}                         # Maps each socket to the channels it has members of
+        self.channel_advertised = {}                    # Maps each channel ID to the sockets of the adjacent
+                                                        # servers told that this side has members of it
 
         # This dictionary contains mappings from commands to command handlers. It is used to call the 
         # appropriate message handler in self.handle_messages(). You do not need to do anything with this in 
@@ -133,9 +390,18 @@ class CRCServer(object):
             # Message handlers
             0x00:self.handle_server_registration_message,
             0x01:self.handle_status_message,
+            0x02:self.handle_server_quit_message,
+            0x03:self.handle_host_snapshot_message,
+            0x04:self.handle_client_id_range_message,
+            0x05:self.handle_id_lease_request_message,
+            0x06:self.handle_id_lease_grant_message,
             0x80:self.handle_client_registration_message,
             0x81:self.handle_client_chat_message,
             0x82:self.handle_client_quit_message,
+            0x83:self.handle_presence_subscribe_message,
+            0x84:self.handle_roster_query_message,
+            0x85:self.handle_channel_membership_message,
+            0x86:self.handle_channel_chat_message,
         }
 
         self.log_file = options.log_file                # The log file output will be written to
@@ -153,17 +419,35 @@ class CRCServer(object):
         Returns:
             None        
         """        
+        if self.engine == 'asyncio':
+            # Imported here because AsyncChatServer builds on the classes defined in this file
+            from AsyncChatServer import AsyncioServerEngine
+            self.async_engine = AsyncioServerEngine(self)
+            self.async_engine.run()
+            return
+
         self.print_info("Launching server %s..." % self.server_name)
+        self.loop_thread = threading.current_thread()
 
         # Set up the server socket that will listen for new connections
         self.setup_server_socket()
 
+        # Register the wakeup channel so that other threads can interrupt select()
+        self.sel.register(self.wakeup_channel.reader, selectors.EVENT_READ, self.wakeup_channel)
+
         # If we are supposed to connect to another server on startup, then do so now
         if self.connect_to_host and self.connect_to_port:
             self.connect_to_server()
         
         # Begin listening for connections on the server socket
         self.check_IO_devices_for_messages()
+        self.wakeup_channel.close()
+
+        # Paused sockets are not registered with the selector, so cleanup() does not see them
+        for sock in self.paused_keys:
+            sock.close()
+        self.paused_keys.clear()
+        self.close_message_logs()
         
 ##############################################################################################################
 
@@ -181,6 +465,9 @@ class CRCServer(object):
             connections) and all other sockets that are passing messages back and forth between hosts. You can
             use what is stored in the data parameter that you provide when registering your socket with the  
             selector to accomplish this.
+        NOTE: If self.reuse_port is True, set the SO_REUSEPORT socket option before binding the socket. This 
+            lets several processes listen on the same port, which ShardedCRCServer relies on to run one 
+            logical server as a group of worker processes.
         
         Args:
             None
@@ -200,10 +487,13 @@ class CRCServer(object):
         
         TODO: Create a TCP socket and connect it to the remote server that exists at the following address:
             (self.connect_to_host_addr, self.connect_to_port)
-        TODO: Register this socket with your selector. 
-        TODO: Send a ServerRegistrationMessage to the server you just connected to. All initial server 
-            registration messages MUST have their last_hop_id set to 0. Rebroadcasts of this message should 
-            contain put the ID of the server that repeated the message in the last_hop_id field as normal.
+        TODO: Register this socket with your selector for READ events. 
+        TODO: Send a ServerRegistrationMessage to the server you just connected to by passing it to 
+            self.queue_message(). All initial server registration messages MUST have their last_hop_id set to 
+            0. Rebroadcasts of this message should contain put the ID of the server that repeated the message 
+            in the last_hop_id field as normal.
+        TODO: If this server owns a range of client IDs (self.client_id_range), announce it by passing 
+            self.id_range_announcements() to self.queue_message() right after the registration message.
 
         NOTE: Even though you know this is a server, it's best to use a BaseConnectionData object for the data
             parameter to be consistent with how other connections are added. That will get modified when you 
@@ -231,6 +521,8 @@ class CRCServer(object):
             client, or a socket connected to an application whose type is not known yet).
         TODO: When processing READ events for this server's listening socket, call 
             self.accept_new_connection(io_device).
+        TODO: When processing READ events for the wakeup channel (i.e. io_device.data is self.wakeup_channel),
+            call self.handle_wakeup().
         TODO: When processing events associated with any other socket, call 
             self.handle_device_io_events(io_device, event_mask).
         TODO: Call self.cleanup() once the while loop terminates (i.e. the program needs to shut down)
@@ -238,8 +530,16 @@ class CRCServer(object):
         NOTE: All calls to select() MUST be inside the while loop. Select() is itself a blocking call and we 
             need to be able to terminate the server to test its functionality. The server may not be able to  
             shut down if calls to select() are made outside of the loop since those calls can block.
-        NOTE: Pass a short timeout value into your select() call (e.g. 0.1 seconds) to prevent your code from 
-            hanging when it is time to terminate it
+        TODO: Pass self.next_timeout() as the timeout of your select() call, and call self.run_timers() once
+            the events it returned have been processed. These send any registration and quit messages that 
+            queue_message() has been holding back (see self.batch_tick), forget adopted hosts that were never 
+            relinked, and stop a server that is leaving the network once its messages have been sent (see
+            self.quit_network()). next_timeout() returns None when none of these are pending, so select() only
+            wakes up early when there is work to do.
+
+        NOTE: You do not need any other timeout in your select() call. When it is time to terminate, 
+            self.stop() writes to the wakeup channel, which makes select() return right away so the while loop
+            can check self.request_terminate.
 
         Args:
             None
@@ -283,13 +583,19 @@ class CRCServer(object):
         socket has data that can be read.
         
         TODO: Accept the connection request and register it with your selector. All sockets registered here  
-            should be registered for both READ and WRITE events. 
+            should be registered for READ events only. 
+
+        NOTE: Do not register for WRITE events here. Sockets are almost always writable, so a socket registered 
+            for WRITE events would make select() return immediately on every pass through the main loop even 
+            when there is nothing to send. self.queue_message() turns on WRITE events for a socket only while it
+            has messages waiting to be sent, and self.flush_io_device() turns them back off once they have all 
+            been sent.
 
         NOTE: You don't know at this point whether new connection requests are comming from a new server or a  
             new client (you'll find that out when processing the registration message sent over the connected  
             socket). As such you don't know whether to use a ServerConncetionData or a ClientConnectionData  
             object when registering the socket with the selector. Instead, use a BaseConnectionData object so 
-            you have access to a write_buffer. We'll replace this with the appropriate object later when 
+            you have access to a write_queue. We'll replace this with the appropriate object later when 
             handling the registration message.
 
         Args:
@@ -304,21 +610,24 @@ class CRCServer(object):
    
     def handle_io_device_events(self, io_device, event_mask):
         """ This function is responsible for handling READ and WRITE events for a given IO device. Incomming  
-        messages will be read and passed to the appropriate message handler here and the write buffer  
+        messages will be read and passed to the appropriate message handler here and the write queue  
         associated with this socket will be sent over the socket here.
         
         TODO: Check to see if this is a READ event and/or a WRITE event (it's possible to be both). 
         
         TODO: If this is a read event, read the bytes and pass the read bytes to self.handle_messages() along 
-            with the io_device containing this socket and its associated data object. If no bytes are returned
-            by the call to read() then the machine on the other side of the socket has closed their side of 
-            the connection. You should unregister and close this socket if that happens.
+            with the io_device containing this socket and its associated data object. Read them by calling 
+            io_device.data.frame_decoder.recv_into(io_device.fileobj), which reads straight into the 
+            connection's receive buffer so that handle_messages() can parse them without copying them. If no 
+            bytes are returned by the read then the machine on the other side of the socket has closed their side of 
+            the connection. You should call self.close_io_device(io_device) if that happens, which unregisters
+            and closes the socket.
         
-        TODO: If this is a write event, check the write_buffer stored in the current io_device's associated 
-            data object. If the write_buffer contains any data go ahead and write it to the socket and clear 
-            the write buffer. You must check to see if the write_buffer contains any data as you don't want to
-            send any empty messages. Similarly, you must clear the write buffer after sending because you 
-            don't want to send any duplicate messages
+        TODO: If this is a write event, call self.flush_io_device(io_device). This sends the write_queue stored 
+            in the io_device's associated data object. flush() removes whatever was sent from the queue and 
+            remembers where it stopped if the socket could only accept part of the data, so nothing is sent 
+            twice and nothing is lost. Once the queue is empty, flush_io_device() stops the selector from 
+            reporting WRITE events for this socket.
 
         Args:
             io_device (...):
@@ -334,7 +643,8 @@ class CRCServer(object):
     def handle_messages(self, io_device, recv_data):
         """ This function is responsible for parsing the received bytes into separate messages and then 
         passing each of the received messages to the appropriate message handler. Message parsing is offloaded
-        to the MessageParser class. Messages are passed to the appropriate message handler using the 
+        to the FrameDecoder stored in the io_device's data object, which keeps any partially received message 
+        until the rest of it arrives. Messages are passed to the appropriate message handler using the 
         self.message_handlers dictionary which associates the appropriate message handler function with each
         valid message type value.
 
@@ -346,15 +656,34 @@ class CRCServer(object):
         Returns:
             None        
         """
-        messages = MessageParser.parse_messages(recv_data)
+        frame_decoder = io_device.data.frame_decoder
 
-        for message in messages:
-             # If we recognize the command, then process it using the assigned message handler
-            if message.message_type in self.message_handlers:
+        # Remembered so that queue_message() knows which connection to pause if a write queue fills up
+        self.current_io_device = io_device
+        try:
+            for message in frame_decoder.feed(recv_data):
                 self.print_info("Received msg from Host ID #%s \"%s\"" % (message.source_id, message.bytes))
+                self.dispatch_message(io_device, message)
+        finally:
+            self.current_io_device = None
+
+    # Passes a message to the appropriate message handler. Registrations for hosts that are being moved here 
+    # from a quitting server are relinks rather than new hosts, so they are handled by relink_host() instead.
+    # A host that registers with an ID of 0 is given an ID first (see assign_id()).
+    def dispatch_message(self, io_device, message):
+        if message.message_type in (0x00, 0x80) and message.source_id == 0 and message.last_hop_id == 0:
+            if self.assign_id(io_device, message):
                 self.message_handlers[message.message_type](io_device, message)
-            else:
-                raise Exception("Unrecognized command: " + message)
+        elif message.message_type == 0x01 and message.status_code == 0x04 and self.id == 0:
+            self.adopt_assigned_id(message)
+            self.message_handlers[0x01](io_device, message)
+        elif message.message_type in (0x00, 0x80) and message.source_id in self.orphaned_hosts and \
+                message.source_id in self.hosts_db:
+            self.relink_host(io_device, message)
+        elif message.message_type in self.message_handlers:
+            self.message_handlers[message.message_type](io_device, message)
+        else:
+            raise Exception("Unrecognized command: " + message)
 
 ##############################################################################################################
 
@@ -362,8 +691,14 @@ class CRCServer(object):
         """ This is a helper function meant to encapsulate the code needed to send a message to a specific 
         host machine, identified based on the machine's unique ID number.
 
-        TODO: Append the message to the appropriate write_buffer that will get this message (eventually) to 
-            its intended destination.
+        TODO: Pass the message to self.queue_message() along with the socket that will get this message 
+            (eventually) to its intended destination. queue_message() sends the message right away if nothing
+            else is waiting to be sent over that socket, and otherwise adds it to that socket's write_queue.
+
+        NOTE: self.next_hop(destination_id) returns that socket with a single dictionary lookup, as long as 
+            your registration handlers have recorded each host's route with self.add_route(). For a client 
+            that is not in self.hosts_db because another server owns its ID range, it returns the socket 
+            towards that server instead.
 
         Args:
             destination_id (int): the ID of the destination machine
@@ -371,7 +706,7 @@ class CRCServer(object):
         Returns:
             None        
         """
-        if destination_id in self.hosts_db:
+        if destination_id in self.hosts_db or self.range_owner(destination_id) not in (None, self.id):
             self.print_info("Sending message to Host ID #%s \"%s\"" % (destination_id, message))
             # TODO: Implement the above functionality
             pass
@@ -391,7 +726,7 @@ class CRCServer(object):
         servers. Alternatively, if it is not None you should not broadcast the message to any adjacent 
         servers with the ID value included in the parameter.
 
-        TODO: Append the message to the appropriate write_buffers needed to broadcast this message to all 
+        TODO: Queue the message on the sockets needed to broadcast this message to all 
             adjacent servers except for servers with IDs equal to the value in ignore_host_id.
 
         Args:
@@ -413,7 +748,7 @@ class CRCServer(object):
         can simply call both functions. The ignore_host_id parameter serves the same purpose as the parameter
         with the same name in the self.broadcast_message_to_servers() function.
 
-        TODO: Append the message to the appropriate write_buffers needed to broadcast this message to all 
+        TODO: Queue the message on the sockets needed to broadcast this message to all 
             adjacent clients except for machines with IDs equal to the value in ignore_host_id.
 
         Args:
@@ -435,8 +770,7 @@ class CRCServer(object):
         send a message across the io_device that was provided to the registration message handler when the 
         error occured.
 
-        TODO: Append the message to the appropriate write_buffer that will get this message (eventually) to 
-            its intended destination.
+        TODO: Pass the message to self.queue_message() along with the io_device's socket.
 
         Args:
             io_device (SelectorKey): An object containing a reference to the socket that the message should be
@@ -468,21 +802,30 @@ class CRCServer(object):
         You will need to determine if this new server is adjacent to the server processing this message. If 
         the new server is adjacent, add its ID to self.adjacent_server_ids and modify the assocated io_device 
         to replace the associated data object with your new ServerConnectionData object. You can do this by
-        calling: self.sel.modify(io_device.fileobj, 
-                                 selectors.EVENT_READ | selectors.EVENT_WRITE, 
-                                 my_new_server_connection_data_obj)
+        calling: self.update_connection_data(io_device, my_new_server_connection_data_obj)
+        This calls self.sel.modify() for you and also carries over any partially received message that is 
+        still waiting in the old data object's frame decoder.
 
         If this registration message came from a brand new adjacent server then it is the responsibility of 
         the server processing this message to inform the new server of all other connected servers and 
-        clients. You can accomplish this by creating ServerRegistationMessages and ClientRegistrationMessages 
-        for each of the existing servers and clients and sending them to the brand new adjacent machine. These
-        messages will then be processed by the new adjacent server's handle_server_registration_message() 
-        function. You can check if a host stored in self.hosts_db is a Server or a Client using python's 
-        isinstance() command (e.g. isinstance(self.hosts_db[0], ServerConnectionData) returns True or False 
-        depending on the type of the object stored in self.hosts_db[0])
+        clients. First send the new server a ServerRegistrationMessage for this server, so that it records 
+        this server as adjacent. Then send it every other host in a single HostSnapshotMessage, which you can 
+        create by calling: self.host_snapshot(ignore_host_id=message.source_id)
+        The snapshot will then be processed by the new adjacent server's handle_host_snapshot_message() 
+        function. On a large network this is far cheaper than sending one registration message per host.
+        Then send it self.id_range_announcements(ignore_server_id=message.source_id), which tells it about 
+        every client ID range this server knows of (it is empty if no server owns a range). Finally send it 
+        self.channel_announcements(io_device.fileobj), which tells it which channels have members on this 
+        side of the network (it is also empty if nobody has joined a channel).
+
+        Messages for the new server should be sent over the socket this registration message arrived on, 
+        whether or not the new server is adjacent. Record this by calling: 
+        self.add_route(message.source_id, io_device.fileobj)
 
         Finally, a message should be broadcast to the rest of the network informing it about this new server. 
-        This message should not be broadcast back to the new machine.
+        This message should not be broadcast back to the new machine. The new ServerConnectionData object can 
+        encode it for you: my_new_server_connection_data_obj.registration_frame(self.id) returns a 
+        ServerRegistrationMessage with this server as the last hop, and caches it for the next time it is sent.
 
         Args:
             io_device (SelectorKey): This object contains references to the socket (io_device.fileobj) and to 
@@ -513,23 +856,40 @@ class CRCServer(object):
         You will need to determine if this new client is adjacent to the server processing this message. If 
         the new client is adjacent, add its ID to self.adjacent_client_ids and modify the assocated io_device 
         to replace the associated data object with your new ClientConnectionData object. You can do this by
-        calling: self.sel.modify(io_device.fileobj, 
-                                 selectors.EVENT_READ | selectors.EVENT_WRITE, 
-                                 my_new_client_connection_data_obj)
+        calling: self.update_connection_data(io_device, my_new_client_connection_data_obj)
+        This calls self.sel.modify() for you and also carries over any partially received message that is 
+        still waiting in the old data object's frame decoder.
         You should also send a Welcome status update to the newly connected adjacent client. The message code 
         should be 0x00 and the message content should be "Welcome to the Clemson Relay Chat network [X]", 
         where [X] is the client's name. 
 
         If this registration message came from a brand new adjacent client then it is the responsibility of 
         the server processing this message to inform the new client of all other connected clients. You can 
-        accomplish this by creating ClientRegistrationMessages for each of the existing clients and sending 
-        them to the brand new adjacent machine. You can check if a host stored in self.hosts_db is a Server 
-        or a Client using python's isinstance() command 
+        accomplish this by sending the brand new adjacent machine a ClientRegistrationMessage for each of the 
+        existing clients. Every ClientConnectionData object keeps its registration message already encoded, so 
+        use self.hosts_db[X].registration_frame(self.id) rather than building a new one for every client. You 
+        can check if a host stored in self.hosts_db is a Server or a Client using python's isinstance() command 
         (e.g. isinstance(self.hosts_db[0], ServerConnectionData) returns True or False depending on the type 
-        of the object stored in self.hosts_db[0])
+        of the object stored in self.hosts_db[0]). A client may subscribe to presence before it registers, so 
+        skip the clients for which self.wants_presence(io_device.fileobj, X) returns False.
+
+        Record the route to the new client by calling: self.add_route(message.source_id, io_device.fileobj)
 
         Finally, a message should be broadcast to the rest of the network informing it about this new client. 
-        This message should not be broadcast back to the new machine.
+        This message should not be broadcast back to the new machine. As for servers, 
+        my_new_client_connection_data_obj.registration_frame(self.id) returns the message to broadcast. Send it
+        to the adjacent clients with self.send_presence({message.source_id: the_message}) rather than 
+        self.broadcast_message_to_adjacent_clients(), so that clients that subscribed to presence are only told
+        about the clients they subscribed to.
+
+        If this server owns a range of client IDs (self.client_id_range), a brand new adjacent client whose 
+        ID falls outside of it must not register here. Send it a StatusUpdateMessage with the message code 
+        0x03 and the message string "Client ID [X] is outside of this server's range" (with a destination_ID 
+        of 0) and return. Only broadcast a client's registration to the other servers if 
+        self.floods_client(message.source_id) returns True. It returns False for clients whose ID falls in a 
+        server's range, since the other servers reach those clients through that server without knowing 
+        about each one. Adjacent clients are still told about every new client, and self.send_presence() also 
+        passes the registration on to the servers that subscribed to the client.
 
         Args:
             io_device (SelectorKey): This object contains references to the socket (io_device.fileobj) and to 
@@ -549,8 +909,14 @@ class CRCServer(object):
         Upon receiving a stauts message, check is if the destination ID is your ID or if it is 0. If either of
         these are true, then the status message is addressed to you. Append the content of the message to 
         self.status_updates_log (this is just for grading purposes). Otherwise, if it is not addressed to you
-        and a machine with the desintation_id of the status message exists then forward it on to its intended 
-        destination. This should be a very short function.
+        and a machine with the desintation_id of the status message exists (it is in self.hosts_db, or 
+        self.next_hop() finds a route to it through another server's client ID range) then forward it on to 
+        its intended destination. This should be a very short function.
+
+        NOTE: When forwarding, pass message.bytes to self.send_message_to_host() rather than building a new 
+            StatusUpdateMessage. The received frame is already in the right format, and the message content is 
+            only decoded when message.content is read, so relaying the original bytes means this server never 
+            has to decode messages it is not the destination of.
 
         Args:
             io_device (SelectorKey): This object contains references to the socket (io_device.fileobj) and to 
@@ -567,11 +933,16 @@ class CRCServer(object):
     def handle_client_chat_message(self, io_device, message):
         """ This function handles client chat messages. 
 
-        Upon receiving a chat message, check to see if the intended destination_id exists. If so, forward the 
-        chat message on to the intended destination. If the intended destination_id does not exist then send
+        Upon receiving a chat message, check to see if the intended destination_id exists, i.e. it is in 
+        self.hosts_db or it is a client in another server's ID range (self.next_hop() returns a socket for 
+        it). If so, forward the chat message on to the intended destination. If the intended destination_id does not exist then send
         a StatusUpdateMessage back to the machine that sent you this chat message with an UnknownID message 
         code of 0x01 with the message content "Unknown ID [X]", where [X] is replaced with the Unknown ID. 
         This should be a short function.
+
+        NOTE: Forward message.bytes to the next hop as-is. Reading message.content (or rebuilding the message 
+            with ClientChatMessage.bytes()) forces the server to decode and re-encode a chat message it is only
+            relaying.
        
         Args:
             io_device (SelectorKey): This object contains references to the socket (io_device.fileobj) and to 
@@ -592,7 +963,12 @@ class CRCServer(object):
         broadcast the quit message to all over adjacent servers and clients that this client is quitting. Make 
         sure you don't send the message back to the client that is quitting. You should then delete the client
         and its ClientConnectionData from self.hosts_db and (if it is adjacent to this server) from the 
-        adjacent_user_ids list.
+        adjacent_user_ids list. Call self.remove_route() to forget the route to the client as well.
+
+        As with registrations, only broadcast the quit message to other servers if 
+        self.floods_client(message.source_id) returns True, and send it to the adjacent clients with 
+        self.send_presence({message.source_id: message.bytes}). Do so before calling self.remove_route(), since
+        self.send_presence() uses the route to avoid sending the message back towards the quitting client.
                
         Args:
             io_device (SelectorKey): This object contains references to the socket (io_device.fileobj) and to 
@@ -603,6 +979,214 @@ class CRCServer(object):
         """
         # TODO: Implement the above functionality
         pass
+
+##############################################################################################################
+
+    def handle_server_quit_message(self, io_device, message):
+        """ This function handles when a server leaves the network gracefully (see self.quit_network()). 
+        
+        A quitting server names one of its adjacent servers as its replacement (message.replacement_id) and 
+        puts the replacement's address in the message content as "host:port". Every other server adjacent to 
+        the quitting server reconnects to the replacement, so the quitting server's subtree stays connected to
+        the network. Only the servers next to the quitting server do any work. The hosts in the moved subtree 
+        keep their IDs and registrations, and nothing is re-registered with the rest of the network.
+
+        Upon receiving a server quit message, check to make sure a server with this ID exists. If so, 
+        broadcast the quit message to all other adjacent servers, except the one it arrived from, so that the 
+        whole network learns the server is gone. Then:
+            * If this server is the replacement, call self.adopt_subtree(message.source_id). The servers that 
+              reconnect to this one will relink the quitting server's subtree here.
+            * Otherwise, if the quitting server is adjacent to this one and it named a replacement (a 
+              replacement_id other than 0), call self.reparent(message). This connects to the replacement and 
+              moves every route that went through the quitting server onto the new connection.
+            * Otherwise, if the quitting server is adjacent and named no replacement, the hosts behind it can no
+              longer be reached. Call self.purge_link(self.next_hop(message.source_id)).
+        Finally, delete the quitting server from self.hosts_db, from the adjacent_server_ids list (if it is 
+        adjacent to this server) and call self.remove_route() for it.
+               
+        Args:
+            io_device (SelectorKey): This object contains references to the socket (io_device.fileobj) and to 
+                the data associated with the socket on registering with the selector (io_device.data).
+            message (ServerQuitMessage): The server quit message that needs to be processed
+        Returns:
+            None        
+        """
+        # TODO: Implement the above functionality
+        pass
+
+##############################################################################################################
+
+    def handle_client_id_range_message(self, io_device, message):
+        """ This function handles the announcement of the range of client IDs owned by a server.
+
+        Upon receiving a client ID range message, check to make sure the server that owns the range 
+        (message.source_id) exists in self.hosts_db. If so, record the range by calling 
+        self.add_id_range(message.source_id, message.low_id, message.high_id). If that returns True, 
+        broadcast the message to all other adjacent servers, except the one it arrived from. It returns False
+        for a range the server already knows about or one that overlaps another server's range, and those are 
+        not passed on.
+
+        Args:
+            io_device (SelectorKey): This object contains references to the socket (io_device.fileobj) and to 
+                the data associated with the socket on registering with the selector (io_device.data).
+            message (ClientIdRangeMessage): The client ID range message that needs to be processed
+        Returns:
+            None        
+        """
+        # TODO: Implement the above functionality
+        pass
+
+##############################################################################################################
+
+    def handle_id_lease_request_message(self, io_device, message):
+        """ This function handles a request for a block of IDs from an adjacent server (see 
+        self.id_block_size). Servers lease IDs from the server they connected to on startup, which leases them 
+        from its own parent in turn, up to the first server in the tree.
+
+        Upon receiving an ID lease request, check to make sure it came from an adjacent server (its source_id 
+        is in self.adjacent_server_ids). If so, call 
+        self.grant_id_lease(io_device.fileobj, message.source_id, message.id_count). This sends the IDs right 
+        away if this server has any to spare, and otherwise once its own parent has sent it more.
+
+        Args:
+            io_device (SelectorKey): This object contains references to the socket (io_device.fileobj) and to 
+                the data associated with the socket on registering with the selector (io_device.data).
+            message (IdLeaseRequestMessage): The ID lease request message that needs to be processed
+        Returns:
+            None        
+        """
+        # TODO: Implement the above functionality
+        pass
+
+##############################################################################################################
+
+    def handle_id_lease_grant_message(self, io_device, message):
+        """ This function handles a block of IDs sent by this server's parent in reply to an ID lease request.
+
+        Upon receiving an ID lease grant, check to make sure it is addressed to this server (its destination_id
+        is self.id) and came from an adjacent server. If so, call 
+        self.add_id_lease(message.low_id, message.high_id). This stores the block and uses it to assign IDs to
+        any hosts, and to answer any lease requests from adjacent servers, that were waiting for one.
+
+        Args:
+            io_device (SelectorKey): This object contains references to the socket (io_device.fileobj) and to 
+                the data associated with the socket on registering with the selector (io_device.data).
+            message (IdLeaseGrantMessage): The ID lease grant message that needs to be processed
+        Returns:
+            None        
+        """
+        # TODO: Implement the above functionality
+        pass
+
+##############################################################################################################
+
+    def handle_host_snapshot_message(self, io_device, message):
+        """ This function handles the HostSnapshotMessage an adjacent server sends to a brand new adjacent
+        server, describing every other server and client on the network in a single message.
+
+        Upon receiving a host snapshot message, check to make sure it came from an adjacent server (its 
+        source_id is in self.adjacent_server_ids). If so, call self.apply_host_snapshot(io_device, message).
+        This adds every host in the snapshot to self.hosts_db and records its route in one pass, and returns 
+        a list with the ServerConnectionData and ClientConnectionData objects for the hosts that were added.
+
+        Then pass the snapshot on to every other adjacent server, except the one it arrived from. Send them 
+        message.forwarded_bytes(self.id) rather than message.bytes, so that they know the hosts in it can be 
+        reached through this server. Adjacent clients are not sent the snapshot. Instead, pass 
+        self.send_presence() a dictionary mapping the ID of every client that was added to its 
+        ClientRegistrationMessage (see registration_frame()), which sends each adjacent client the ones it wants
+        in a single message.
+
+        Args:
+            io_device (SelectorKey): This object contains references to the socket (io_device.fileobj) and to 
+                the data associated with the socket on registering with the selector (io_device.data).
+            message (HostSnapshotMessage): The host snapshot message that needs to be processed
+        Returns:
+            None        
+        """
+        # TODO: Implement the above functionality
+        pass
+##############################################################################################################
+
+    def handle_presence_subscribe_message(self, io_device, message):
+        """ This function handles the PresenceSubscribeMessage a client sends when it only wants to be told 
+        about some of the clients on the network, and that servers send each other on behalf of their 
+        subscribers.
+
+        Upon receiving a presence subscribe message, check its action. If it is 0x00, call 
+        self.subscribe_presence(io_device.fileobj, message.host_ids). If it is 0x01, call 
+        self.unsubscribe_presence(io_device.fileobj, message.host_ids) instead. The subscription belongs to the
+        connection the message arrived on, so the message may arrive before the client has registered.
+
+        Args:
+            io_device (SelectorKey): This object contains references to the socket (io_device.fileobj) and to 
+                the data associated with the socket on registering with the selector (io_device.data).
+            message (PresenceSubscribeMessage): The presence subscribe message that needs to be processed
+        Returns:
+            None        
+        """
+        # TODO: Implement the above functionality
+        pass
+
+##############################################################################################################
+
+    def handle_roster_query_message(self, io_device, message):
+        """ This function handles the RosterQueryMessage a client sends to page through the clients this 
+        server knows about.
+
+        Upon receiving a roster query message, send the HostSnapshotMessage returned by 
+        self.roster_page(message.after_id, message.limit) back over the connection the query arrived on.
+
+        Args:
+            io_device (SelectorKey): This object contains references to the socket (io_device.fileobj) and to 
+                the data associated with the socket on registering with the selector (io_device.data).
+            message (RosterQueryMessage): The roster query message that needs to be processed
+        Returns:
+            None        
+        """
+        # TODO: Implement the above functionality
+        pass
+##############################################################################################################
+
+    def handle_channel_membership_message(self, io_device, message):
+        """ This function handles the ChannelMembershipMessage a client sends to join or leave a channel, and
+        that servers send each other to say which channels have members behind them.
+
+        Upon receiving a channel membership message, check that it came from a registered host (its source_id
+        is in self.hosts_db). If so and its action is 0x00, call 
+        self.join_channel(io_device.fileobj, message.channel_id). If its action is 0x01, call 
+        self.leave_channel(io_device.fileobj, message.channel_id) instead. Both functions pass the change on 
+        to the adjacent servers that need to hear about it, so you do not need to forward the message.
+
+        Args:
+            io_device (SelectorKey): This object contains references to the socket (io_device.fileobj) and to 
+                the data associated with the socket on registering with the selector (io_device.data).
+            message (ChannelMembershipMessage): The channel membership message that needs to be processed
+        Returns:
+            None        
+        """
+        # TODO: Implement the above functionality
+        pass
+
+##############################################################################################################
+
+    def handle_channel_chat_message(self, io_device, message):
+        """ This function handles chat messages sent to a channel.
+
+        Upon receiving a channel chat message, check that its sender exists (its source_id is in 
+        self.hosts_db, or self.next_hop() returns a socket for it). If so, call 
+        self.send_to_channel(io_device.fileobj, message). This sends message.bytes once over every link with
+        members of the channel, except the link it arrived on, so one copy of the message travels down each 
+        branch of the tree that leads to a member however many members are behind it.
+
+        Args:
+            io_device (SelectorKey): This object contains references to the socket (io_device.fileobj) and to 
+                the data associated with the socket on registering with the selector (io_device.data).
+            message (ChannelChatMessage): The channel chat message that needs to be processed
+        Returns:
+            None        
+        """
+        # TODO: Implement the above functionality
+        pass
     
 ##############################################################################################################    
     
@@ -612,6 +1196,969 @@ class CRCServer(object):
     # ----------------------------------------------------------------------
 
 
+    ######################################################################
+    # This block of functions manages the data object associated with each io_device
+
+    # Replaces the data object registered with the selector for this io_device (e.g. swapping the 
+    # BaseConnectionData used for a brand new connection with the ServerConnectionData or ClientConnectionData 
+    # created when its registration message arrives). Any bytes already received for the next message on this
+    # socket, and any messages still waiting to be sent over it, are carried over to the new data object so 
+    # they are not lost. Returns the updated io_device.
+    def update_connection_data(self, io_device, connection_data):
+        current = self.get_io_device(io_device.fileobj)
+        if current.data is not None and current.data is not connection_data:
+            connection_data.frame_decoder = current.data.frame_decoder
+            connection_data.write_queue = current.data.write_queue
+        if io_device.fileobj in self.paused_keys:
+            self.paused_keys[io_device.fileobj] = connection_data
+            return current._replace(data=connection_data)
+        return self.sel.modify(io_device.fileobj, current.events, connection_data)
+
+    # Returns the io_device for sock. This includes a socket whose reads are paused while it has nothing to 
+    # send, which the selector is not watching (see update_io_device_events()). Raises KeyError or ValueError
+    # if sock is not open, as the selector's get_key() does.
+    def get_io_device(self, sock):
+        if sock in self.paused_keys:
+            return selectors.SelectorKey(sock, sock.fileno(), 0, self.paused_keys[sock])
+        return self.sel.get_key(sock)
+
+
+    # Queues a message to be sent over sock. If nothing else is already waiting to be sent over this socket, the
+    # message is sent right away. Whatever the socket cannot accept immediately stays in the connection's 
+    # write_queue, and the selector is asked to report WRITE events for this socket until it has all been sent.
+    # When called from a thread other than the main loop, the message is handed to the main loop instead.
+    # Once the write_queue reaches self.write_high_watermark, the connection whose message is being handled 
+    # stops being read from until the queue drains (see self.slow_client_policy for chat messages to clients).
+    # Registration and quit messages are held back for one batch tick when self.batch_tick is set.
+    def queue_message(self, sock, message):
+        if not self.in_loop_thread():
+            self.call_in_loop(self.queue_message, sock, message)
+            return
+
+        if self.batch_tick is not None and message and message[0] in MessageBatch.MESSAGE_TYPES:
+            self.add_to_batch(sock, message)
+            return
+        if sock in self.pending_batches:
+            # Messages are never reordered on a connection, so whatever was held back for it goes first
+            self.send_batch(sock)
+        self.write_message(sock, message)
+
+    # Appends a message to sock's write_queue, as described above queue_message()
+    def write_message(self, sock, message):
+        try:
+            io_device = self.get_io_device(sock)
+        except (KeyError, ValueError):
+            # The connection has been closed, e.g. by a server that has just quit
+            self.print_info("Dropping a message for a closed connection")
+            return
+        write_queue = io_device.data.write_queue
+        # Chat messages for clients that fall behind are governed by self.slow_client_policy instead
+        apply_backpressure = self.slow_client_policy == 'block' or not message or message[0] not in (0x81, 0x86) or \
+            not isinstance(io_device.data, ClientConnectionData)
+        if self.is_congested(io_device) and not apply_backpressure:
+            self.print_info("Dropping a chat message for slow Host ID #%s" % io_device.data.id)
+            if self.slow_client_policy == 'disconnect':
+                self.call_in_loop(self.disconnect_slow_client, sock)
+            return
+
+        was_empty = not write_queue
+        write_queue.append(message)
+        if was_empty:
+            try:
+                write_queue.flush(sock)
+            except ConnectionError:
+                # The peer is gone. The next READ event on this socket will report the disconnect
+                return
+
+        if self.is_congested(io_device) and apply_backpressure and self.current_io_device is not None:
+            paused = self.paused_sources.setdefault(sock, set())
+            source = self.current_io_device.fileobj
+            if source not in paused:
+                paused.add(source)
+                self.pause_reading(source)
+        if was_empty and write_queue:
+            self.update_io_device_events(sock)
+
+    # Sends as much of this io_device's write_queue as the socket will accept. Once the queue is empty, the 
+    # selector stops reporting WRITE events for the socket so that select() does not keep waking up for a 
+    # socket that has nothing to send. Call this when select() reports a WRITE event.
+    def flush_io_device(self, io_device):
+        if io_device.fileobj in self.pending_connections:
+            self.finish_connection(io_device)
+            return
+        write_queue = self.get_io_device(io_device.fileobj).data.write_queue
+        try:
+            write_queue.flush(io_device.fileobj)
+        except ConnectionError:
+            # The peer is gone, so the connection is finished just as if a read had reported the disconnect
+            self.close_io_device(io_device)
+            return
+        if len(write_queue) <= self.write_low_watermark:
+            self.resume_paused_sources(io_device.fileobj)
+        if not write_queue:
+            self.update_io_device_events(io_device.fileobj)
+
+    # Unregisters and closes the socket of an io_device whose connection is finished. Any connections that had 
+    # stopped being read from because this one was congested are resumed. If self.purge_on_disconnect is set,
+    # every host that was reachable through the connection is forgotten as well (see purge_link()), and any
+    # presence subscriptions and channel memberships the connection had are dropped.
+    def close_io_device(self, io_device):
+        sock = io_device.fileobj
+        if self.purge_on_disconnect:
+            self.purge_link(sock)
+        self.resume_paused_sources(sock)
+        for paused in self.paused_sources.values():
+            paused.discard(sock)
+        self.paused_reads.pop(sock, None)
+        self.pending_batches.pop(sock, None)
+        self.pending_connections.pop(sock, None)
+        self.awaiting_ids = deque(waiting for waiting in self.awaiting_ids if waiting[0] is not sock)
+        self.drop_presence(sock)
+        self.drop_channels(sock)
+        if sock in self.paused_keys:
+            del self.paused_keys[sock]
+        else:
+            self.sel.unregister(sock)
+        sock.close()
+
+
+    ######################################################################
+    # This block of functions maintains self.routes, which lets send_message_to_host() find the socket for any
+    # destination with one dictionary lookup however large the network is
+
+    # Records that messages for host_id should be sent over sock
+    def add_route(self, host_id, sock):
+        previous = self.routes.get(host_id)
+        if previous is not None and previous is not sock:
+            self.reachable_hosts.get(previous, set()).discard(host_id)
+        self.routes[host_id] = sock
+        self.reachable_hosts.setdefault(sock, set()).add(host_id)
+
+    # Forgets the route to host_id, and any client ID range owned by it. A host that leaves before it has been
+    # relinked is no longer an orphan either
+    def remove_route(self, host_id):
+        sock = self.routes.pop(host_id, None)
+        if sock is not None:
+            self.reachable_hosts.get(sock, set()).discard(host_id)
+        self.remove_id_ranges(host_id)
+        self.orphaned_hosts.discard(host_id)
+
+    # Returns the socket that messages for host_id should be sent over, or None if no route is known. A 
+    # client that is not known by ID is routed towards the server that owns its ID range.
+    def next_hop(self, host_id):
+        sock = self.routes.get(host_id)
+        if sock is None and self.id_ranges:
+            return self.routes.get(self.range_owner(host_id))
+        return sock
+
+    # Forgets every host that was reachable through sock, whose connection has been lost, and returns their
+    # IDs. The work done is proportional to the number of hosts lost rather than the size of the network. 
+    def purge_link(self, sock):
+        return self.forget_hosts(self.reachable_hosts.pop(sock, set()))
+
+    # Forgets each host in lost_ids, which can no longer be reached, and returns lost_ids. Every remaining 
+    # adjacent server is sent a single batch holding one Client Quit message for each client that was lost, 
+    # followed by one Server Quit message, naming no replacement, for each server that was lost. Every 
+    # adjacent client is sent the Client Quit messages it wants (see send_presence()).
+    def forget_hosts(self, lost_ids):
+        quit_messages = {}
+        server_quit_messages = []
+        for host_id in lost_ids:
+            self.routes.pop(host_id, None)
+            self.remove_id_ranges(host_id)
+            self.orphaned_hosts.discard(host_id)
+            self.adjacent_server_ids.discard(host_id)
+            self.adjacent_user_ids.discard(host_id)
+            host = self.hosts_db.pop(host_id, None)
+            if isinstance(host, ClientConnectionData):
+                quit_messages[host_id] = ClientQuitMessage.bytes(host_id, "Connection lost")
+            elif isinstance(host, ServerConnectionData):
+                server_quit_messages.append(ServerQuitMessage.bytes(host_id, 0, ""))
+
+        if lost_ids:
+            self.print_info("Lost the connection to %d host(s)" % len(lost_ids))
+        if quit_messages or server_quit_messages:
+            batch = b''.join(quit_messages.values()) + b''.join(server_quit_messages)
+            for next_hop in {self.next_hop(host_id) for host_id in self.adjacent_server_ids}:
+                if next_hop is not None:
+                    self.queue_message(next_hop, batch)
+        if quit_messages:
+            self.send_presence(quit_messages)
+        return lost_ids
+
+
+    ######################################################################
+    # This block of functions routes clients by the server that owns their ID range. self.id_ranges holds one 
+    # entry per range and is kept sorted, so the owner of any client ID is found with a binary search.
+
+    # Records that the clients with IDs from low to high (inclusive) are reached through server_id. Returns
+    # False, without recording anything, if the range is already known or overlaps another range.
+    def add_id_range(self, server_id, low, high):
+        if low > high:
+            self.print_info("Ignoring empty client ID range %d-%d of Host ID #%s" % (low, high, server_id))
+            return False
+        index = bisect_right(self.id_range_starts, low)
+        if (index > 0 and self.id_ranges[index - 1][1] >= low) or \
+                (index < len(self.id_ranges) and self.id_ranges[index][0] <= high):
+            if (low, high, server_id) not in self.id_ranges:
+                self.print_info("Ignoring client ID range %d-%d of Host ID #%s, it overlaps another range" % (low, high, server_id))
+            return False
+        self.id_ranges.insert(index, (low, high, server_id))
+        self.id_range_starts.insert(index, low)
+        return True
+
+    def remove_id_ranges(self, server_id):
+        if any(owner == server_id for _, _, owner in self.id_ranges):
+            self.id_ranges = [id_range for id_range in self.id_ranges if id_range[2] != server_id]
+            self.id_range_starts = [low for low, _, _ in self.id_ranges]
+
+    # Returns the ID of the server whose range holds client_id, or None
+    def range_owner(self, client_id):
+        index = bisect_right(self.id_range_starts, client_id) - 1
+        if index >= 0 and client_id <= self.id_ranges[index][1]:
+            return self.id_ranges[index][2]
+        return None
+
+    # Whether the registration and quit messages of client_id are broadcast to every server. Clients in a 
+    # server's ID range are reached through that server instead.
+    def floods_client(self, client_id):
+        return self.range_owner(client_id) is None
+
+    # Whether every server knows about the host with this connection data
+    def floods_host(self, host):
+        return isinstance(host, ServerConnectionData) or self.floods_client(host.id)
+
+    # Returns a ClientIdRangeMessage for every known range, except those owned by ignore_server_id
+    def id_range_announcements(self, ignore_server_id=None):
+        return b''.join([ClientIdRangeMessage.bytes(owner, low, high) for low, high, owner in self.id_ranges if owner != ignore_server_id])
+
+
+    ######################################################################
+    # This block of functions assigns IDs to hosts that connect without one. Every server leases blocks of IDs
+    # from its parent and hands them out locally, so a new host gets its ID straight away and never has to 
+    # retry after a duplicate ID error. The first server in the tree hands out blocks from self.id_pool.
+
+    # Gives the host that sent a registration with an ID of 0 the next free ID. The host is told its ID with 
+    # a StatusUpdateMessage (code 0x04) whose destination is the new ID, and the message is rewritten to 
+    # carry it. Returns False if no ID is free yet. The message is then dispatched again once one is.
+    def assign_id(self, io_device, message):
+        host_id = self.allocate_id()
+        if host_id is None:
+            self.print_info("Waiting for IDs from the parent server")
+            self.awaiting_ids.append((io_device.fileobj, message))
+            return False
+
+        self.print_info("Assigning ID #%s to a new host" % host_id)
+        message.source_id = host_id
+        message.bytes = message.bytes[:1] + host_id.to_bytes(4, 'big') + message.bytes[5:]
+        self.queue_message(io_device.fileobj, StatusUpdateMessage.bytes(self.id, host_id, 0x04, "Assigned ID %d" % host_id))
+        return True
+
+    # Called on a server that connected with an ID of 0 when the server it connected to assigns it one
+    def adopt_assigned_id(self, message):
+        self.print_info("Assigned ID #%s" % message.destination_id)
+        self.id = message.destination_id
+        if self.awaiting_ids or self.lease_requests:
+            self.request_id_lease(self.id_block_size)
+
+    # Returns an ID that no known host is using, or None if there are none left. A server that owns a client
+    # ID range assigns IDs from it. Anything else asks its parent for more IDs once it is running low.
+    def allocate_id(self):
+        if self.client_id_range:
+            while self.next_range_id <= self.client_id_range[1]:
+                host_id = self.next_range_id
+                self.next_range_id += 1
+                if host_id not in self.hosts_db:
+                    return host_id
+            return None
+
+        host_id = None
+        while host_id is None:
+            ids = self.take_ids(1)
+            if ids is None:
+                break
+            if ids[0] not in self.hosts_db and ids[0] != self.id:
+                host_id = ids[0]
+        if self.free_id_count() < self.id_block_size // 2:
+            self.request_id_lease(self.id_block_size)
+        return host_id
+
+    # Removes up to count IDs from the front of this server's leases and returns them as (low, high), or
+    # None. The first server in the tree leases its IDs straight from self.id_pool.
+    def take_ids(self, count):
+        if self.id_pool and self.is_id_root():
+            self.id_leases.append(list(self.id_pool))
+            self.id_pool = None
+        while self.id_leases:
+            lease = self.id_leases[0]
+            if lease[0] > lease[1]:
+                self.id_leases.popleft()
+                continue
+            low = lease[0]
+            high = min(lease[1], low + count - 1)
+            lease[0] = high + 1
+            return low, high
+        return None
+
+    def free_id_count(self):
+        return sum(high - low + 1 for low, high in self.id_leases)
+
+    # Whether this server is the first server in the tree, which owns self.id_pool
+    def is_id_root(self):
+        return self.parent_server_id is None and not (self.connect_to_host and self.connect_to_port)
+
+    # Returns the socket of the server this server leases IDs from, or None if it is not connected yet
+    def lease_parent(self):
+        parent_id = self.find_parent_server()
+        if parent_id is not None:
+            return self.next_hop(parent_id)
+        # The parent has not registered with this server yet
+        for io_device in list(self.sel.get_map().values()):
+            try:
+                if io_device.fileobj.getpeername() == (self.connect_to_host_addr, self.connect_to_port):
+                    return io_device.fileobj
+            except (AttributeError, OSError):
+                continue
+        return None
+
+    # Asks the parent server for count more IDs, unless a request is already outstanding. A server that 
+    # connected without an ID waits until it has been assigned one.
+    def request_id_lease(self, count):
+        if self.id_lease_requested or self.is_id_root() or not self.id:
+            return
+        parent = self.lease_parent()
+        if parent is None:
+            return
+        self.id_lease_requested = True
+        self.queue_message(parent, IdLeaseRequestMessage.bytes(self.id, count))
+
+    # Sends up to count IDs to the adjacent server server_id over sock, once this server has some to spare
+    def grant_id_lease(self, sock, server_id, count):
+        ids = self.take_ids(count)
+        if ids is None:
+            self.lease_requests.append((sock, server_id, count))
+            self.request_id_lease(count + self.id_block_size)
+            return
+        self.print_info("Leasing IDs %d-%d to Host ID #%s" % (ids[0], ids[1], server_id))
+        self.queue_message(sock, IdLeaseGrantMessage.bytes(self.id, server_id, ids[0], ids[1]))
+
+    # Stores a block of IDs from the parent server, then answers the lease requests and assigns IDs to the 
+    # registrations that were waiting for them
+    def add_id_lease(self, low, high):
+        self.print_info("Leased IDs %d-%d" % (low, high))
+        self.id_leases.append([low, high])
+        self.id_lease_requested = False
+
+        while self.lease_requests and self.free_id_count():
+            self.grant_id_lease(*self.lease_requests.popleft())
+        while self.awaiting_ids and self.free_id_count():
+            sock, message = self.awaiting_ids.popleft()
+            try:
+                io_device = self.get_io_device(sock)
+            except (KeyError, ValueError):
+                continue
+            self.dispatch_message(io_device, message)
+        if self.lease_requests or self.awaiting_ids:
+            self.request_id_lease(self.id_block_size)
+
+
+    ######################################################################
+    # This block of functions coalesces floods of registration and quit messages, e.g. when an edge server 
+    # restarts and all of its clients leave and rejoin. With self.batch_tick set, each connection is sent the 
+    # registrations and quits queued for it during a tick as one write instead of one write per message.
+
+    def add_to_batch(self, sock, message):
+        batch = self.pending_batches.get(sock)
+        if batch is None:
+            batch = self.pending_batches[sock] = MessageBatch(self.cancel_join_quit)
+        batch.append(message)
+        if self.batch_deadline is None:
+            self.batch_deadline = time.monotonic() + self.batch_tick
+            if self.async_engine:
+                self.async_engine.call_later(self.batch_tick, self.send_batches)
+
+    def send_batch(self, sock):
+        batch = self.pending_batches.pop(sock)
+        if batch.cancelled:
+            self.print_info("Cancelled %d registration(s) of clients that quit in the same batch" % batch.cancelled)
+        frames = batch.getvalue()
+        if frames:
+            self.write_message(sock, frames)
+
+    def send_batches(self):
+        self.batch_deadline = None
+        for sock in list(self.pending_batches):
+            self.send_batch(sock)
+
+    # Returns how long the main loop may wait in select() before run_timers() has work to do, or None if it
+    # may wait until a socket is ready
+    def next_timeout(self):
+        deadlines = [self.orphan_deadlines[0][0]] if self.orphan_deadlines else []
+        if self.batch_deadline is not None:
+            deadlines.append(self.batch_deadline)
+        if self.quit_deadline is not None:
+            deadlines.append(self.quit_deadline)
+        if not deadlines:
+            return None
+        return max(0, min(deadlines) - time.monotonic())
+
+    # Called by the main loop after every pass. Sends the pending batches once their tick is over, forgets
+    # orphans that were not relinked in time, and stops a server that is leaving the network once its write 
+    # queues have drained
+    def run_timers(self):
+        if self.batch_deadline is not None and time.monotonic() >= self.batch_deadline:
+            self.send_batches()
+        if self.orphan_deadlines and time.monotonic() >= self.orphan_deadlines[0][0]:
+            self.expire_orphans()
+        if self.quit_deadline is not None:
+            self.finish_quit()
+
+
+    ######################################################################
+    # This block of functions describes the whole network to a brand new adjacent server in one message
+
+    # Returns a HostSnapshotMessage holding every host in self.hosts_db except ignore_host_id. Each host's 
+    # record is cached on its connection data object, so this mostly joins bytes that are already encoded.
+    def host_snapshot(self, ignore_host_id=None):
+        return HostSnapshotMessage.from_records(self.id, [host.snapshot_record() for host in self.snapshot_hosts(ignore_host_id)])
+
+    # Yields the connection data object of each host that belongs in a snapshot. Clients in a server's ID 
+    # range are left out, since they are reached through that server.
+    def snapshot_hosts(self, ignore_host_id=None):
+        for host_id, host in self.hosts_db.items():
+            if host_id != ignore_host_id and self.floods_host(host):
+                yield host
+
+    # Adds every host in a HostSnapshotMessage to self.hosts_db, reachable through the adjacent server that 
+    # sent it, and returns the connection data objects of the hosts that were added. Hosts that are already
+    # known are skipped.
+    def apply_host_snapshot(self, io_device, message):
+        sock = io_device.fileobj
+        added = []
+        for host_type, host_id, name, info in message.hosts():
+            if host_id in self.hosts_db or host_id == self.id:
+                self.print_info("Skipping Host ID #%s from a snapshot, it has already registered" % host_id)
+                continue
+            if host_type == 0x00:
+                host = ServerConnectionData(host_id, name, info)
+            else:
+                host = ClientConnectionData(host_id, name, info)
+            host.first_link_id = message.source_id
+            self.hosts_db[host_id] = host
+            self.add_route(host_id, sock)
+            added.append(host)
+        self.print_info("Added %d host(s) from a snapshot sent by Host ID #%s" % (len(added), message.source_id))
+        return added
+
+
+    ######################################################################
+    # This block of functions sends the registration and quit messages of clients (their presence) only to the
+    # links that want them. A link that subscribes is only told about the clients it named. A server subscribes
+    # on its links' behalf to clients in another server's ID range, so their presence is only passed along the
+    # branches of the tree that lead to a subscriber.
+
+    # Whether the link sock wants the registration and quit messages of host_id
+    def wants_presence(self, sock, host_id):
+        interest = self.presence_interest.get(sock)
+        return interest is None or host_id in interest
+
+    # Returns the frames sock wants out of frames, which maps client IDs to registration or quit messages, as
+    # a single message
+    def wanted_presence(self, sock, frames):
+        interest = self.presence_interest.get(sock)
+        if interest is None:
+            return b''.join(frames.values())
+        if len(interest) < len(frames):
+            return b''.join([frames[host_id] for host_id in interest if host_id in frames])
+        return b''.join([frame for host_id, frame in frames.items() if host_id in interest])
+
+    # Sends every adjacent client the frames it wants out of frames, which maps client IDs to registration or 
+    # quit messages. The frames of clients in another server's ID range are also sent to the adjacent servers
+    # subscribed to them. Nothing is sent back towards the link the clients are reached through.
+    def send_presence(self, frames):
+        origins = {self.next_hop(host_id) for host_id in frames}
+        for client_id in self.adjacent_user_ids:
+            sock = self.routes.get(client_id)
+            if sock is not None and sock not in origins:
+                message = self.wanted_presence(sock, frames)
+                if message:
+                    self.queue_message(sock, message)
+
+        server_frames = {}
+        for host_id, frame in frames.items():
+            if self.floods_client(host_id):
+                continue
+            for sock in self.presence_subscribers.get(host_id, ()):
+                if sock not in origins and isinstance(self.get_io_device(sock).data, ServerConnectionData):
+                    server_frames.setdefault(sock, []).append(frame)
+        for sock, link_frames in server_frames.items():
+            self.queue_message(sock, b''.join(link_frames))
+
+    # Subscribes the link sock to the presence of the clients in host_ids. A registered link that was already
+    # subscribed is sent the registrations of the new clients this server knows about. Clients in another 
+    # server's ID range are subscribed to through the link towards that server, once per client.
+    def subscribe_presence(self, sock, host_ids):
+        data = self.get_io_device(sock).data
+        replay = isinstance(data, ServerConnectionData) or \
+            (sock in self.presence_interest and isinstance(data, ClientConnectionData))
+        interest = self.presence_interest.setdefault(sock, set())
+        added = [host_id for host_id in dict.fromkeys(host_ids) if host_id not in interest]
+        interest.update(added)
+
+        upstream = {}
+        registrations = []
+        for host_id in added:
+            self.presence_subscribers.setdefault(host_id, set()).add(sock)
+            host = self.hosts_db.get(host_id)
+            if replay and isinstance(host, ClientConnectionData) and self.next_hop(host_id) is not sock:
+                registrations.append(host.registration_frame(self.id))
+            owner = self.range_owner(host_id)
+            if owner not in (None, self.id) and host_id not in self.upstream_presence:
+                link = self.routes.get(owner)
+                if link is not None and link is not sock:
+                    self.upstream_presence.add(host_id)
+                    upstream.setdefault(link, []).append(host_id)
+
+        if registrations:
+            self.queue_message(sock, b''.join(registrations))
+        for link, link_ids in upstream.items():
+            self.queue_message(link, PresenceSubscribeMessage.bytes(self.id, 0x00, link_ids))
+
+    # Unsubscribes the link sock from the presence of the clients in host_ids. Once no link is subscribed to 
+    # a client in another server's ID range, this server unsubscribes from it as well and forgets it.
+    def unsubscribe_presence(self, sock, host_ids):
+        interest = self.presence_interest.get(sock)
+        if interest is None:
+            return
+
+        upstream = {}
+        for host_id in host_ids:
+            if host_id not in interest:
+                continue
+            interest.discard(host_id)
+            subscribers = self.presence_subscribers.get(host_id, set())
+            subscribers.discard(sock)
+            if subscribers:
+                continue
+            self.presence_subscribers.pop(host_id, None)
+            if host_id in self.upstream_presence:
+                self.upstream_presence.discard(host_id)
+                link = self.next_hop(host_id)
+                if link is not None and link is not sock:
+                    upstream.setdefault(link, []).append(host_id)
+                if isinstance(self.hosts_db.get(host_id), ClientConnectionData):
+                    del self.hosts_db[host_id]
+                    self.remove_route(host_id)
+
+        for link, link_ids in upstream.items():
+            self.queue_message(link, PresenceSubscribeMessage.bytes(self.id, 0x01, link_ids))
+
+    # Drops every presence subscription made by the link sock, whose connection is closing
+    def drop_presence(self, sock):
+        if sock in self.presence_interest:
+            self.unsubscribe_presence(sock, list(self.presence_interest[sock]))
+            del self.presence_interest[sock]
+
+    # Returns a HostSnapshotMessage holding the first limit clients in self.hosts_db, in order of ID, whose 
+    # IDs are larger than after_id
+    def roster_page(self, after_id, limit):
+        clients = (host for host_id, host in self.hosts_db.items() 
+                   if host_id > after_id and isinstance(host, ClientConnectionData))
+        page = nsmallest(limit, clients, key=lambda host: host.id)
+        return HostSnapshotMessage.from_records(self.id, [host.snapshot_record() for host in page])
+
+
+    ######################################################################
+    # This block of functions multicasts channel messages over the spanning tree. A server only tells an 
+    # adjacent server about a channel while it has members of the channel that are not behind that server, so
+    # a channel message is only copied where the tree branches towards members. The number of copies a server
+    # sends is bounded by its number of links rather than by the number of members.
+
+    # Records that the link sock has members of channel_id
+    def join_channel(self, sock, channel_id):
+        links = self.channel_links.setdefault(channel_id, set())
+        if sock not in links:
+            links.add(sock)
+            self.link_channels.setdefault(sock, set()).add(channel_id)
+            self.advertise_channel(channel_id)
+
+    # Records that the link sock no longer has members of channel_id
+    def leave_channel(self, sock, channel_id):
+        links = self.channel_links.get(channel_id)
+        if not links or sock not in links:
+            return
+        links.discard(sock)
+        self.link_channels[sock].discard(channel_id)
+        if not links:
+            del self.channel_links[channel_id]
+        self.advertise_channel(channel_id)
+
+    # Drops every channel membership of the link sock, whose connection is closing
+    def drop_channels(self, sock):
+        for channel_id in list(self.link_channels.get(sock, ())):
+            self.leave_channel(sock, channel_id)
+        self.link_channels.pop(sock, None)
+        for channel_id, advertised in list(self.channel_advertised.items()):
+            advertised.discard(sock)
+            if not advertised:
+                del self.channel_advertised[channel_id]
+
+    # Sends each adjacent server a join or leave for channel_id if whether this server has members of the 
+    # channel that are not behind that server has changed
+    def advertise_channel(self, channel_id):
+        links = self.channel_links.get(channel_id, ())
+        advertised = self.channel_advertised.setdefault(channel_id, set())
+        for server_id in self.adjacent_server_ids:
+            sock = self.routes.get(server_id)
+            if sock is None:
+                continue
+            wanted = len(links) > (1 if sock in links else 0)
+            if wanted and sock not in advertised:
+                advertised.add(sock)
+                self.queue_message(sock, ChannelMembershipMessage.bytes(self.id, channel_id, 0x00))
+            elif not wanted and sock in advertised:
+                advertised.discard(sock)
+                self.queue_message(sock, ChannelMembershipMessage.bytes(self.id, channel_id, 0x01))
+        if not advertised:
+            del self.channel_advertised[channel_id]
+
+    # Returns a join for every channel with members on this server's side of a new link to an adjacent 
+    # server. Members behind ignore_sock are left out, e.g. those behind a server that is quitting.
+    def channel_announcements(self, sock, ignore_sock=None):
+        joins = []
+        for channel_id, links in self.channel_links.items():
+            if links - {sock, ignore_sock}:
+                self.channel_advertised.setdefault(channel_id, set()).add(sock)
+                joins.append(ChannelMembershipMessage.bytes(self.id, channel_id, 0x00))
+        return b''.join(joins)
+
+    # Sends a channel message over every link with members of its channel, except the link it arrived on
+    def send_to_channel(self, sock, message):
+        for link in self.channel_links.get(message.channel_id, ()):
+            if link is not sock:
+                self.queue_message(link, message.bytes)
+
+
+    ######################################################################
+    # This block of functions lets a server leave the network gracefully. Its neighbours reconnect to the 
+    # replacement it names and move their routes over, instead of the whole subtree re-registering
+
+    # Leaves the network. The server this one connected to on startup becomes the replacement. The rest of the
+    # network is told that this server's clients have quit, every adjacent server is sent a Server Quit 
+    # message naming the replacement, and the server stops once those messages have been sent, or after one
+    # second if some peers are not reading (see finish_quit()). A server that did not connect to another one
+    # on startup names no replacement. Safe to call from any thread.
+    def quit_network(self):
+        if not self.in_loop_thread():
+            self.call_in_loop(self.quit_network)
+            return
+
+        replacement_id = self.find_parent_server()
+        address = self.find_parent_server_address() if replacement_id else ""
+        self.print_info("Leaving the network. Replacement: Host ID #%s" % replacement_id)
+
+        messages = [ClientQuitMessage.bytes(client_id, "Server is shutting down") for client_id in self.adjacent_user_ids]
+        messages.append(ServerQuitMessage.bytes(self.id, replacement_id or 0, address))
+        batch = b''.join(messages)
+        for server_id in self.adjacent_server_ids:
+            self.queue_message(self.next_hop(server_id), batch)
+
+        self.send_batches()
+        self.quit_deadline = time.monotonic() + 1.0
+        self.finish_quit()
+
+    # Returns the ID of the adjacent server this server connected to on startup (or was moved to by 
+    # move_subtree()), or None
+    def find_parent_server(self):
+        if self.parent_server_id is not None:
+            return self.parent_server_id
+        if not (self.connect_to_host and self.connect_to_port):
+            return None
+        for server_id in self.adjacent_server_ids:
+            try:
+                if self.next_hop(server_id).getpeername() == (self.connect_to_host_addr, self.connect_to_port):
+                    return server_id
+            except (AttributeError, OSError):
+                continue
+        return None
+
+    # Returns the "host:port" that the children of this server should reconnect to in order to reach the server
+    # returned by find_parent_server()
+    def find_parent_server_address(self):
+        if self.parent_server_address is not None:
+            return self.parent_server_address
+        return "%s:%d" % (self.connect_to_host_addr, self.connect_to_port)
+
+    # Stops the server once every write queue has been sent or self.quit_deadline has passed. Until then the
+    # main loop keeps flushing the queues as their sockets become writable, so a peer that is not reading 
+    # cannot hold up the others, and run_timers() calls this again after every pass. The asyncio engine's 
+    # transports send what they have buffered when they are closed, so it stops straight away.
+    def finish_quit(self):
+        drained = not any(getattr(io_device.data, 'write_queue', None) for io_device in self.sel.get_map().values())
+        if drained or self.async_engine or time.monotonic() >= self.quit_deadline:
+            self.stop()
+
+    # Called on the replacement named by a quitting server. Every host reachable through the quitting server
+    # (other than the server itself) is marked as orphaned. The servers on the far side of it reconnect here 
+    # and re-send registrations for these hosts over their new connection, and dispatch_message() passes them
+    # to relink_host() instead of treating them as duplicates. Orphans are not forgotten if the quitting 
+    # server's connection closes before they are relinked, since the relinks usually arrive after that. Any
+    # that are still orphans after self.orphan_timeout seconds, e.g. because the server behind them could not
+    # reconnect, are forgotten by expire_orphans().
+    def adopt_subtree(self, quitting_id):
+        sock = self.next_hop(quitting_id)
+        orphans = self.reachable_hosts.get(sock, set()) - {quitting_id}
+        self.orphaned_hosts |= orphans
+        if sock in self.reachable_hosts:
+            self.reachable_hosts[sock] -= orphans
+        self.print_info("Adopting %d host(s) from Host ID #%s" % (len(orphans), quitting_id))
+        if orphans:
+            self.orphan_deadlines.append((time.monotonic() + self.orphan_timeout, orphans))
+            if self.async_engine:
+                self.async_engine.call_later(self.orphan_timeout, self.expire_orphans)
+
+    # Forgets the hosts of every adoption whose deadline has passed that have still not been relinked
+    def expire_orphans(self):
+        expired = set()
+        while self.orphan_deadlines and time.monotonic() >= self.orphan_deadlines[0][0]:
+            expired |= self.orphan_deadlines.popleft()[1] & self.orphaned_hosts
+        if expired:
+            self.print_info("Forgetting %d adopted host(s) that were never relinked" % len(expired))
+            self.forget_hosts(expired)
+        if self.async_engine and self.orphan_deadlines:
+            # The event loop's clock may run this a moment before the oldest deadline
+            self.async_engine.call_later(max(0, self.orphan_deadlines[0][0] - time.monotonic()), self.expire_orphans)
+
+    # Moves a host adopted with adopt_subtree() onto the connection its registration arrived on. A server 
+    # relinking itself (last_hop_id 0) becomes an adjacent server. Relinks are not broadcast, since the rest of
+    # the network already routes these hosts through this server.
+    def relink_host(self, io_device, message):
+        host = self.hosts_db[message.source_id]
+        self.orphaned_hosts.discard(message.source_id)
+        self.add_route(message.source_id, io_device.fileobj)
+        if message.last_hop_id == 0:
+            host.first_link_id = message.source_id
+            self.adjacent_server_ids.append(message.source_id)
+            self.update_connection_data(io_device, host)
+            self.queue_message(io_device.fileobj, self.channel_announcements(io_device.fileobj))
+        else:
+            host.first_link_id = message.last_hop_id
+        self.print_info("Relinked Host ID #%s" % message.source_id)
+
+    # Called on a server adjacent to a quitting server that named another server as its replacement. This 
+    # connects to the replacement, moves every route that went through the quitting server onto the new 
+    # connection, and sends the replacement the quit message followed by a registration for this server and 
+    # for every host on this side of the network, so that it can relink them. If the replacement cannot be 
+    # reached, every host behind the quitting server is forgotten, as if it had named no replacement.
+    def reparent(self, message):
+        quitting_sock = self.next_hop(message.source_id)
+        replacement = self.hosts_db[message.replacement_id]
+        try:
+            host, port = message.content.rsplit(":", 1)
+            port = int(port)
+        except ValueError:
+            self.print_info("Ignoring the malformed address of replacement Host ID #%s: %s" % (message.replacement_id, message.content))
+            self.purge_link(quitting_sock)
+            return
+        self.print_info("Reconnecting to replacement Host ID #%s at %s" % (message.replacement_id, message.content))
+        self.open_connection(host, port, replacement,
+                             lambda sock: self.move_subtree(message, quitting_sock, sock),
+                             lambda: self.purge_link(quitting_sock))
+
+    # Opens a connection to host:port with connection_data as its data object. Once it is open, on_connected() 
+    # is called with the new socket, and if it cannot be opened, on_failed() is called instead. Neither engine
+    # waits for the connection. The selector engine registers the socket for WRITE events, which are passed to 
+    # flush_io_device() and so to finish_connection(), and the asyncio engine connects in the background. 
+    # Either callback always runs later on the main loop, never from within open_connection().
+    def open_connection(self, host, port, connection_data, on_connected, on_failed):
+        if self.async_engine:
+            self.async_engine.open_connection(host, port, connection_data, on_connected, on_failed)
+            return
+        sock = socket(AF_INET, SOCK_STREAM)
+        sock.setblocking(False)
+        try:
+            sock.connect((host, port))
+        except BlockingIOError:
+            # The connection is being made
+            pass
+        except OSError as e:
+            sock.close()
+            self.print_info("Could not connect to %s:%d: %s" % (host, port, e))
+            self.call_in_loop(on_failed)
+            return
+        self.pending_connections[sock] = (on_connected, on_failed)
+        self.sel.register(sock, selectors.EVENT_WRITE, connection_data)
+
+    # Called when a socket opened by open_connection() becomes writable, which means the connection has either
+    # been made or failed
+    def finish_connection(self, io_device):
+        sock = io_device.fileobj
+        on_connected, on_failed = self.pending_connections.pop(sock)
+        error = sock.getsockopt(SOL_SOCKET, SO_ERROR)
+        if error:
+            self.print_info("Could not connect: %s" % os.strerror(error))
+            self.sel.unregister(sock)
+            sock.close()
+            on_failed()
+            return
+        self.update_io_device_events(sock)
+        on_connected(sock)
+
+    # The second half of reparent(), run once the connection to the replacement is open
+    def move_subtree(self, message, quitting_sock, sock):
+        replacement = self.hosts_db[message.replacement_id]
+        replacement.first_link_id = replacement.id
+        self.adjacent_server_ids.append(replacement.id)
+        # Only the quitting server's children reconnect, so the replacement is this server's new parent
+        self.parent_server_id = replacement.id
+        self.parent_server_address = message.content
+
+        moved = self.reachable_hosts.get(quitting_sock, set()) - {message.source_id}
+        for host_id in moved:
+            self.add_route(host_id, sock)
+            self.hosts_db[host_id].first_link_id = replacement.id
+
+        # The quit message goes first so the replacement has adopted the subtree before the relinks arrive
+        relinks = [message.bytes, ServerRegistrationMessage.bytes(self.id, 0, self.server_name, self.server_info)]
+        for host_id, host_data in self.hosts_db.items():
+            if host_id not in moved and host_id != message.source_id and self.floods_host(host_data):
+                relinks.append(host_data.registration_frame(self.id))
+        relinks.append(self.channel_announcements(sock, ignore_sock=quitting_sock))
+        self.queue_message(sock, b''.join(relinks))
+
+
+    ######################################################################
+    # This block of functions implements backpressure. Reading from a socket is paused while a connection it 
+    # sends messages to has too much queued, so one slow peer cannot make this server queue without limit
+
+    # Returns whether io_device has at least self.write_high_watermark bytes waiting to be sent. On the asyncio
+    # engine, messages are buffered by the connection's transport rather than its write_queue, and the transport
+    # reports crossing the watermarks through CRCServerProtocol.pause_writing() and resume_writing()
+    def is_congested(self, io_device):
+        if self.async_engine:
+            return io_device.fileobj.writing_paused
+        return len(io_device.data.write_queue) >= self.write_high_watermark
+
+    # Sets the events the selector reports for sock: READ unless reading is paused and WRITE while anything is
+    # queued. A selector cannot watch a socket for no events at all, so a paused socket with nothing to send
+    # is unregistered and its data object is kept in self.paused_keys, where get_io_device() still finds it, 
+    # until it is registered again. On the asyncio engine, the registry pauses and resumes the transport's 
+    # reading instead (see AsyncioConnectionRegistry.modify()).
+    def update_io_device_events(self, sock):
+        io_device = self.get_io_device(sock)
+        events = 0 if sock in self.paused_reads else selectors.EVENT_READ
+        if io_device.data.write_queue:
+            events |= selectors.EVENT_WRITE
+
+        if events == io_device.events:
+            return io_device
+        if not events and not self.async_engine:
+            self.sel.unregister(sock)
+            self.paused_keys[sock] = io_device.data
+            return io_device._replace(events=0)
+        if sock in self.paused_keys:
+            return self.sel.register(sock, events, self.paused_keys.pop(sock))
+        return self.sel.modify(sock, events, io_device.data)
+
+    def pause_reading(self, sock):
+        self.paused_reads[sock] = self.paused_reads.get(sock, 0) + 1
+        if self.paused_reads[sock] == 1:
+            self.print_info("Pausing reads from a connection that feeds a congested one")
+            self.update_io_device_events(sock)
+
+    def resume_reading(self, sock):
+        if sock not in self.paused_reads:
+            return
+        self.paused_reads[sock] -= 1
+        if self.paused_reads[sock] == 0:
+            del self.paused_reads[sock]
+            try:
+                self.update_io_device_events(sock)
+            except (KeyError, ValueError):
+                # The socket has been closed since it was paused
+                pass
+
+    # Resumes every socket that was paused because sock was congested
+    def resume_paused_sources(self, sock):
+        for source in self.paused_sources.pop(sock, ()):
+            self.resume_reading(source)
+
+    # Disconnects a client that is not keeping up with its chat messages. The client is removed from the 
+    # network as if it had sent a Client Quit message.
+    def disconnect_slow_client(self, sock):
+        try:
+            io_device = self.get_io_device(sock)
+        except (KeyError, ValueError):
+            return
+        client_id = io_device.data.id
+        self.print_info("Disconnecting slow Host ID #%s" % client_id)
+        if client_id in self.hosts_db:
+            self.message_handlers[0x82](io_device, ClientQuitMessage(ClientQuitMessage.bytes(client_id, "Disconnected for falling behind")))
+        self.close_io_device(io_device)
+
+
+    ######################################################################
+    # This block of functions lets other threads stop or hand work to the main loop
+
+    # Asks the server to shut down. Safe to call from any thread
+    def stop(self):
+        self.request_terminate = True
+        if self.async_engine:
+            self.async_engine.stop()
+        else:
+            self.wakeup_channel.notify()
+
+    # Runs callback(*args) on the main loop's thread as soon as possible. Safe to call from any thread
+    def call_in_loop(self, callback, *args):
+        if self.async_engine:
+            self.async_engine.call_in_loop(callback, *args)
+            return
+        self.pending_callbacks.append((callback, args))
+        self.wakeup_channel.notify()
+
+    def in_loop_thread(self):
+        return self.loop_thread is None or self.loop_thread is threading.current_thread()
+
+    # Called by the main loop when the wakeup channel is readable
+    def handle_wakeup(self):
+        self.wakeup_channel.drain()
+        while self.pending_callbacks:
+            callback, args = self.pending_callbacks.popleft()
+            callback(*args)
+
+
+    ######################################################################
+    # This block of functions reads the server's options and creates its message logs
+
+    # Returns the value of an optional setting, or default if options does not define it or leaves it unset
+    def option_or_default(self, options, name, default):
+        value = getattr(options, name, None)
+        return default if value is None else value
+
+    # Parses a client ID range given as "LOW-HIGH" into a (low, high) tuple
+    def parse_id_range(self, value):
+        if value is None or isinstance(value, tuple):
+            return value
+        try:
+            low, high = (int(bound) for bound in value.split("-"))
+        except ValueError:
+            raise Exception("Client ID ranges must look like LOW-HIGH, not " + value)
+        if low > high:
+            raise Exception("Empty client ID range: " + value)
+        return (low, high)
+
+    # Creates a log that keeps at most options.max_log_entries entries in memory. Older entries are spilled to
+    # a file in options.log_spill_dir, if one is given, and are otherwise dropped
+    def new_message_log(self, options, name):
+        spill_dir = self.option_or_default(options, 'log_spill_dir', None)
+        spill_path = os.path.join(spill_dir, "%s.%s" % (options.servername, name)) if spill_dir else None
+        return BoundedMessageLog(self.option_or_default(options, 'max_log_entries', None), spill_path)
+
+    # Closes the spill files of the server's message logs once it has stopped. The logs can still be read
+    def close_message_logs(self):
+        self.status_updates_log.close()
+
+
     ######################################################################
     # This block of functions enables logging of info, debug, and error messages
     # Do not edit these functions. init_logging() is already called by the template code
@@ -0,0 +1,208 @@
+import copy
+import multiprocessing
+import selectors
+import signal
+from optparse import OptionParser
+from ChatServer import *
+
+# The IDs used for the internal links between the workers of a sharded server. Worker i is known to the other
+# workers as SHARD_LINK_ID_BASE - i. These IDs are never announced to the rest of the network, but no other
+# server or client may register with one of them.
+SHARD_LINK_ID_BASE = 0xFFFFFFFF
+
+##############################################################################################################
+
+class ShardLinkData(ServerConnectionData):
+    """ ShardLinkData is the connection data for the UNIX socket linking one worker of a sharded server to
+    another. To the worker's message handlers the link looks like a connection to an adjacent server whose
+    ID is the sibling worker's link ID, so hosts_db, routing and broadcasts work across the workers exactly
+    as they do across separate servers.
+    """
+    def __init__(self, id, server_name, shard_index):
+        super(ShardLinkData, self).__init__(id, server_name, "Shard %d of %s" % (shard_index, server_name))
+        self.first_link_id = id
+        self.shard_index = shard_index      # The index of the worker on the other end of this link
+
+
+class ShardWorker():
+    """ ShardWorker is mixed into a CRCServer implementation to turn it into one worker process of a sharded
+    server. Every worker has the same ID, name and port, and listens on that port with SO_REUSEPORT so the
+    kernel spreads new connections across the workers. Each worker owns the clients and servers that happen
+    to connect to it.
+
+    The workers are joined by UNIX sockets in a star around worker 0, which keeps the group a tree like the
+    rest of the CRC network. Registration messages arriving over a sibling link are treated as if they had
+    come from an adjacent server whose ID is the sibling's link ID. Messages for hosts owned by another worker
+    are therefore forwarded over the link to that worker, and broadcasts reach every worker exactly once.
+    Only worker 0 connects to the remote server given by --connect_to_host and --connect_to_port.
+    """
+    def __init__(self, options, run_on_localhost=False, shard_index=0, shard_links=None, shard_count=None, **kwargs):
+        super().__init__(options, run_on_localhost, **kwargs)
+        if self.engine != 'selectors':
+            raise Exception("Sharded servers only support the selectors engine")
+        if self.client_id_range:
+            # Each worker only knows its own clients, so the clients in the range must be flooded to siblings
+            raise Exception("Sharded servers do not support client ID ranges")
+
+        self.shard_index = shard_index                  # The index of this worker within the group
+        self.shard_links = shard_links or {}            # Maps each sibling link ID to its UNIX socket
+        self.shard_count = shard_count or len(self.shard_links) + 1    # The number of workers in the group
+        self.print_info("Starting worker %d of server %s" % (shard_index, self.server_name))
+
+    def run(self):
+        # Sibling links are registered before anything else so that every worker knows about the others
+        # before the first registration message arrives
+        self.register_shard_links()
+        super().run()
+
+    def register_shard_links(self):
+        for link_id, sock in self.shard_links.items():
+            sock.setblocking(False)
+            link_data = ShardLinkData(link_id, self.server_name, SHARD_LINK_ID_BASE - link_id)
+            self.sel.register(sock, selectors.EVENT_READ, link_data)
+            self.hosts_db[link_id] = link_data
+            self.adjacent_server_ids.append(link_id)
+            self.add_route(link_id, sock)
+
+    def handle_messages(self, io_device, recv_data):
+        if not isinstance(io_device.data, ShardLinkData):
+            return super().handle_messages(io_device, recv_data)
+
+        # Every worker shares the same ID, so the last hop of a registration sent by a sibling is rewritten to
+        # the ID of the link it arrived on, as is the source of a host snapshot, an ID lease request or a 
+        # channel membership message. The message handlers then record the sibling as the first link towards 
+        # the new hosts. An ID lease grant from a sibling is always meant for this worker.
+        self.current_io_device = io_device
+        try:
+            for message in io_device.data.frame_decoder.feed(recv_data):
+                if message.message_type in (0x00, 0x80):
+                    message.last_hop_id = io_device.data.id
+                elif message.message_type in (0x03, 0x05, 0x85):
+                    message.source_id = io_device.data.id
+                elif message.message_type == 0x06:
+                    message.source_id = io_device.data.id
+                    message.destination_id = self.id
+                self.print_info("Received msg from worker %d \"%s\"" % (io_device.data.shard_index, message.bytes))
+                self.dispatch_message(io_device, message)
+        finally:
+            self.current_io_device = None
+
+    # No other server or client may register with the link ID of any worker in the group, including the 
+    # workers this one has no link to
+    def dispatch_message(self, io_device, message):
+        if message.message_type in (0x00, 0x80) and SHARD_LINK_ID_BASE - self.shard_count < message.source_id:
+            self.queue_message(io_device.fileobj, StatusUpdateMessage.bytes(
+                self.id, 0, 0x02, "A machine has already registered with ID %d" % message.source_id))
+            return
+        super().dispatch_message(io_device, message)
+
+    # Only worker 0 is connected to the rest of the tree. The other workers lease IDs from it
+    def is_id_root(self):
+        return self.shard_index == 0 and super().is_id_root()
+
+    def lease_parent(self):
+        if self.shard_index > 0:
+            return self.shard_links[SHARD_LINK_ID_BASE]
+        return super().lease_parent()
+
+    # Sibling links are internal to this server, so they are left out of host snapshots and of the 
+    # registrations move_subtree() sends, like clients in another server's ID range
+    def floods_host(self, host):
+        return host.id not in self.shard_links and super().floods_host(host)
+
+##############################################################################################################
+
+class ShardedCRCServer():
+    """ ShardedCRCServer runs one logical CRC server as a group of worker processes so that a server with
+    many adjacent clients can use more than one CPU core. It takes the same options as CRCServer plus the
+    number of workers to start. Use start() and stop() to manage the group, or run() to start it and wait
+    until every worker has exited.
+
+    Any CRCServer implementation whose setup_server_socket() honours self.reuse_port can be sharded, by
+    passing it as CRCServerImpl. The workers are forked, so this is only supported on platforms where the
+    fork start method is available.
+    """
+    def __init__(self, options, workers, run_on_localhost=False, CRCServerImpl=CRCServer):
+        if workers < 1:
+            raise Exception("A sharded server needs at least one worker")
+
+        self.options = options
+        self.workers = workers
+        self.run_on_localhost = run_on_localhost
+        self.server_class = type("Sharded" + CRCServerImpl.__name__, (ShardWorker, CRCServerImpl), {})
+        self.processes = []
+
+    def start(self):
+        context = multiprocessing.get_context("fork")
+
+        # Worker 0 is linked to every other worker and each of them is linked only to worker 0
+        links = [{} for i in range(self.workers)]
+        for i in range(1, self.workers):
+            links[0][SHARD_LINK_ID_BASE - i], links[i][SHARD_LINK_ID_BASE] = socketpair()
+
+        for i in range(self.workers):
+            process = context.Process(target=self.run_worker, args=(i, links), name="%s-%d" % (self.options.servername, i))
+            process.start()
+            self.processes.append(process)
+
+        # The forked workers own the links now
+        for worker_links in links:
+            for sock in worker_links.values():
+                sock.close()
+
+    def run_worker(self, shard_index, links):
+        # Each forked worker inherits every link, but only keeps its own
+        for i, worker_links in enumerate(links):
+            if i != shard_index:
+                for sock in worker_links.values():
+                    sock.close()
+        shard_links = links[shard_index]
+
+        options = copy.copy(self.options)
+        options.reuse_port = True
+        if shard_index > 0:
+            options.connect_to_host = None
+            options.connect_to_port = None
+        if options.log_file:
+            options.log_file = "%s.%d" % (options.log_file, shard_index)
+
+        server = self.server_class(options, self.run_on_localhost, shard_index=shard_index, shard_links=shard_links, shard_count=self.workers)
+        signal.signal(signal.SIGTERM, lambda signum, frame: server.stop())
+        server.run()
+
+    def stop(self):
+        for process in self.processes:
+            if process.is_alive():
+                process.terminate()
+        self.join()
+
+    def join(self):
+        for process in self.processes:
+            process.join()
+
+    def run(self):
+        self.start()
+        try:
+            self.join()
+        except KeyboardInterrupt:
+            self.stop()
+
+
+if __name__ == "__main__":
+    op = OptionParser(description="Runs one CRC server as a group of worker processes sharing its port")
+    for option, option_type, help_text in [
+            ("--id", "int", "The random id value for this server"),
+            ("--servername", "string", "The name for this server"),
+            ("--port", "int", "The port this server listens on"),
+            ("--info", "string", "Human readable information about this server"),
+            ("--connect_to_host", "string", "Connect to a server running on this host"),
+            ("--connect_to_port", "int", "Connect to a server running on port X"),
+            ("--log-file", "string", "store log in file X")]:
+        op.add_option(option, metavar="X", type=option_type, help=help_text)
+    op.add_option(
+        "--workers",
+        metavar="X", type="int", default=os.cpu_count(),
+        help="The number of worker processes to run")
+    options, args = op.parse_args()
+
+    ShardedCRCServer(options, options.workers).run()
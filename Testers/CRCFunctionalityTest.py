@@ -4,8 +4,8 @@ from Testers.CRCTest import CRCTest
 
 class CRCFunctionalityTest(CRCTest):
     
-    def __init__(self, CRCServerModule, CRCClientModule, catch_exceptions):
-        super().__init__(CRCServerModule, CRCClientModule, catch_exceptions)
+    def __init__(self, CRCServerModule, CRCClientModule, catch_exceptions, server_engine=None, client_event_loop=False):
+        super().__init__(CRCServerModule, CRCClientModule, catch_exceptions, server_engine, client_event_loop)
 
 
     def check_test_results(self, test, servers, clients):        
@@ -1,14 +1,17 @@
 import threading, os, re, time, sys, json, copy
 from optparse import OptionParser
 from abc import ABC, abstractmethod
+from ChatClient import ClientEventLoop
 
 class CRCTest(ABC):
     
-    def __init__(self, CRCServerModule, CRCClientModule, catch_exceptions):
+    def __init__(self, CRCServerModule, CRCClientModule, catch_exceptions, server_engine=None, client_event_loop=False):
 
         self.CRCServerModule = CRCServerModule
         self.CRCClientModule = CRCClientModule
         self.catch_exceptions = catch_exceptions
+        self.client_event_loop = client_event_loop  # Whether one ClientEventLoop drives every client in a test
+        self.event_loop = None
 
         self.threads = {}
         self.servers = {}
@@ -21,6 +24,7 @@ class CRCTest(ABC):
             "LAUNCHSERVER":self.launch_server,
             "LAUNCHCLIENT":self.launch_client,
             "CLIENTCOMMAND":self.run_client_command,
+            "SERVERCOMMAND":self.run_server_command,
             "SEND":self.send_message,
             "WAIT":self.wait,
             "KILL":self.kill,
@@ -55,6 +59,58 @@ class CRCTest(ABC):
             "--connect_to_port",
             metavar="X", type="int",
             help="Connect to a server running on port X")  
+        self.server_op.add_option(
+            "--engine",
+            metavar="X", type="choice", choices=["selectors", "asyncio"], default=server_engine,
+            help="The I/O engine that drives this server (selectors or asyncio)")
+        self.server_op.add_option(
+            "--write_high_watermark",
+            metavar="X", type="int",
+            help="Pause reading from the connections feeding a write queue once it holds X bytes")
+        self.server_op.add_option(
+            "--write_low_watermark",
+            metavar="X", type="int",
+            help="Resume reading once a congested write queue drains to X bytes")
+        self.server_op.add_option(
+            "--slow_client_policy",
+            metavar="X", type="choice", choices=["drop", "block", "disconnect"],
+            help="What to do with chat messages for a client that is not keeping up (drop, block or disconnect)")
+        self.server_op.add_option(
+            "--purge_on_disconnect",
+            action="store_true",
+            help="Forget every host behind a connection as soon as it closes")
+        self.server_op.add_option(
+            "--orphan_timeout",
+            metavar="X", type="float",
+            help="Forget hosts adopted from a quitting server that are not relinked within X seconds")
+        self.server_op.add_option(
+            "--batch_tick",
+            metavar="X", type="float",
+            help="Send registration and quit messages in batches, once every X seconds")
+        self.server_op.add_option(
+            "--cancel_join_quit",
+            action="store_true",
+            help="Drop the registration and quit of a client that joins and quits within one batch")
+        self.server_op.add_option(
+            "--client_id_range",
+            metavar="X", type="string",
+            help="The range of client IDs this server owns, as LOW-HIGH")
+        self.server_op.add_option(
+            "--id_block_size",
+            metavar="X", type="int",
+            help="The number of IDs to lease from the parent server at a time")
+        self.server_op.add_option(
+            "--id_pool",
+            metavar="X", type="string",
+            help="The IDs the first server in the tree hands out, as LOW-HIGH")
+        self.server_op.add_option(
+            "--max_log_entries",
+            metavar="X", type="int",
+            help="Keep at most X status and chat messages in memory")
+        self.server_op.add_option(
+            "--log_spill_dir",
+            metavar="X",
+            help="Spill messages that do not fit in memory to files in directory X")
         self.server_op.add_option(
             "--log-file",
             metavar="X",
@@ -107,6 +163,18 @@ class CRCTest(ABC):
             "--simulate",
             action="store_true",
             help="Don't request input from a user, but instead loop waiting for commands to send")
+        self.client_op.add_option(
+            "--subscribe",
+            metavar="X",
+            help="Only be told about the clients with these comma-separated IDs")
+        self.client_op.add_option(
+            "--max_log_entries",
+            metavar="X", type="int",
+            help="Keep at most X status and chat messages in memory")
+        self.client_op.add_option(
+            "--log_spill_dir",
+            metavar="X",
+            help="Spill messages that do not fit in memory to files in directory X")
         self.client_op.add_option(
             "--verbose",
             action="store_true",
@@ -139,6 +207,20 @@ class CRCTest(ABC):
             nargs='*', 
             help="The arguments to pass to the command")
 
+        ######################################################################
+        # Server command options
+        self.server_command = OptionParser(
+            version="0.1a",
+            description="CPSC 3600 CRC Server application")
+        self.server_command.add_option(
+            "--servername", 
+            metavar="X",
+            help="The name the server who is executing this command")
+        self.server_command.add_option(
+            "--command", 
+            metavar="X",
+            help="The command to execute")
+
         super().__init__()
 
 
@@ -147,6 +229,7 @@ class CRCTest(ABC):
             self.threads.clear()
             self.servers.clear()
             self.clients.clear()
+            self.event_loop = None
 
             # Loop through all of the commands in this test
             for command in test['commands']:
@@ -172,7 +255,7 @@ class CRCTest(ABC):
         except Exception as e:
             if self.catch_exceptions:
                 for x in self.threads.values():
-                    x['app'].request_terminate = True
+                    x['app'].stop()
                 for x in self.threads.values():
                     x['thread'].join()
                 return False, "", e
@@ -233,7 +316,17 @@ class CRCTest(ABC):
         # https://stackoverflow.com/questions/16710076/python-split-a-string-respect-and-preserve-quotes
         args = re.findall(r'(?:[^\s,"]|"(?:\\.|[^"])*")+', args)
         options, args = self.client_op.parse_args(args)
-        client = self.CRCClientModule(options, run_on_localhost=True)
+        if self.client_event_loop:
+            if self.event_loop is None:
+                self.event_loop = ClientEventLoop()
+                self.event_loop.start()
+                self.threads['client event loop'] = {
+                    'thread':self.event_loop.thread,
+                    'app':self.event_loop
+                }
+            client = self.CRCClientModule(options, run_on_localhost=True, event_loop=self.event_loop)
+        else:
+            client = self.CRCClientModule(options, run_on_localhost=True)
         
         x = threading.Thread(target=client.run)
         self.threads[client.client_name] = {
@@ -259,6 +352,32 @@ class CRCTest(ABC):
                 client.quit()
         elif options.command == "MESSAGE":
             client.message_other_client(int(args[0]), args[1])
+        elif options.command == "SUBSCRIBE":
+            client.subscribe([int(id) for id in args])
+        elif options.command == "UNSUBSCRIBE":
+            client.unsubscribe([int(id) for id in args])
+        elif options.command == "ROSTER":
+            client.query_roster(int(args[0]), int(args[1]))
+        elif options.command == "JOIN":
+            client.join_channel(int(args[0]))
+        elif options.command == "LEAVE":
+            client.leave_channel(int(args[0]))
+        elif options.command == "CHANNEL":
+            client.message_channel(int(args[0]), args[1])
+
+
+    ######################################################################
+    # QUIT: the server leaves the network (see quit_network()) and its thread is waited for
+    def run_server_command(self, args):
+        print("*CMD.........\tRunning server command: " + args)
+        # https://stackoverflow.com/questions/16710076/python-split-a-string-respect-and-preserve-quotes
+        args = re.findall(r'(?:[^\s,"]|"(?:\\.|[^"])*")+', args)
+        options, args = self.server_command.parse_args(args)
+
+        server = self.servers[options.servername]
+        if options.command == "QUIT":
+            server.quit_network()
+            self.threads[options.servername]['thread'].join()
 
 
     ######################################################################
@@ -275,10 +394,10 @@ class CRCTest(ABC):
     def kill(self, args):
         if args == "ALL":
             for crc in self.threads.values():
-                crc['app'].request_terminate = True 
+                crc['app'].stop()
                 crc['thread'].join()
         elif args in self.threads:
-            self.threads[args]['app'].request_terminate = True
+            self.threads[args]['app'].stop()
             self.threads[args]['thread'].join()
         else:
             # Bad name for a thread to kill...
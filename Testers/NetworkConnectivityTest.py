@@ -5,7 +5,7 @@ import base64
 
 class NetworkConnectivityTest(CRCTest):
     
-    def __init__(self, CRCServerModule, CRCClientModule, catch_exceptions):
+    def __init__(self, CRCServerModule, CRCClientModule, catch_exceptions, server_engine=None, client_event_loop=False):
         # Create a new version of the CRC Server Module which overrides the process data function
         # and does some additional logging for use in the tests
         class NewCRCServerModule(CRCServerModule):
@@ -17,7 +17,7 @@ class NetworkConnectivityTest(CRCTest):
 
 
             def handle_messages(self, select_key, recv_data):
-                print("[" + self.server_name + "] \tReceived " + str(recv_data))
+                print("[" + self.server_name + "] \tReceived " + str(bytes(recv_data)))
                 self.recvd_messages_asdqw.append(recv_data.hex())
                 res = bytes.fromhex(recv_data.hex())
                 print(res)
@@ -61,7 +61,7 @@ class NetworkConnectivityTest(CRCTest):
 
 
         # Initialize with this new class
-        super().__init__(NewCRCServerModule, CRCClientModule, catch_exceptions)
+        super().__init__(NewCRCServerModule, CRCClientModule, catch_exceptions, server_engine, client_event_loop)
 
 
     def check_test_results(self, test, servers, clients):        
@@ -0,0 +1,65 @@
+import unittest
+from gradescope_utils.autograder_utils.decorators import weight
+import asyncio, time
+from types import SimpleNamespace
+from CRCTestManager import CRCTestManager
+from ChatClient import CRCClient
+from AsyncChatClient import AsyncCRCClient
+from Testers.CRCFunctionalityTest import CRCFunctionalityTest
+
+class TestAsyncClient(unittest.TestCase):
+    PORT = 36452
+
+    def setUp(self):
+        self.tester = CRCFunctionalityTest(CRCTestManager().CRCServerImpl, CRCClient, False)
+        self.tester.launch_server("--id 1 --servername theshire --port %d --info \"Home of the Hobbits\"" % self.PORT)
+        time.sleep(0.25)
+
+    def tearDown(self):
+        self.tester.kill("ALL")
+
+    def make_client(self, id, username):
+        options = SimpleNamespace(id=id, serverhost="127.0.0.1", serverport=self.PORT, username=username, info="Test info",
+                                  log_file=None)
+        return AsyncCRCClient(options, run_on_localhost=True)
+
+    # Waits until client has been told that every host in host_ids has registered
+    async def wait_for_hosts(self, client, host_ids):
+        while not set(host_ids) <= set(client.connected_user_ids):
+            await asyncio.sleep(0.01)
+
+    # Waits until client has been told that host_id has quit
+    async def wait_for_quit(self, client, host_id):
+        while host_id in client.connected_user_ids:
+            await asyncio.sleep(0.01)
+
+    # Returns the first chat message read from client.messages()
+    async def next_chat(self, client):
+        async for message in client.messages():
+            if message.message_type == 0x81:
+                return message
+
+
+    @weight(1)
+    def test_clients_exchange_chats(self):
+        async def exchange_chats():
+            frodo, samwise = self.make_client(101, "frodobaggins"), self.make_client(102, "samwise")
+            await frodo.connect()
+            await samwise.connect()
+            await asyncio.wait_for(asyncio.gather(self.wait_for_hosts(frodo, [102]), self.wait_for_hosts(samwise, [101])), 2)
+
+            await frodo.message_other_client(102, "Hello Samwise")
+            await samwise.message_other_client(101, "Hello Frodo")
+            to_frodo, to_samwise = await asyncio.wait_for(asyncio.gather(self.next_chat(frodo), self.next_chat(samwise)), 2)
+            self.assertEqual((to_frodo.source_id, to_frodo.content), (102, "Hello Frodo"))
+            self.assertEqual((to_samwise.source_id, to_samwise.content), (101, "Hello Samwise"))
+            self.assertIn("Welcome to the Clemson Relay Chat network frodobaggins", frodo.status_updates_log)
+
+            # samwise is told once frodo quits
+            await frodo.quit("Goodbye")
+            await asyncio.wait_for(self.wait_for_quit(samwise, 101), 2)
+            for client in (frodo, samwise):
+                client.stop()
+                await asyncio.wait_for(client.wait_closed(), 2)
+
+        asyncio.run(exchange_chats())
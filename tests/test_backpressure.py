@@ -0,0 +1,174 @@
+import unittest
+from gradescope_utils.autograder_utils.decorators import weight
+import threading, time, socket, selectors
+from types import SimpleNamespace
+from CRCTestManager import CRCTestManager
+from ChatClient import CRCClient
+from ChatMessageParser import *
+from Testers.CRCFunctionalityTest import CRCFunctionalityTest
+from ChatServer import BaseConnectionData
+
+class TestBackpressure(unittest.TestCase):
+    # A server with small write watermarks, one client that never reads what it is sent and one client that
+    # sends it far more chat messages than the watermarks allow to be queued. The kernel buffers several MB 
+    # for a socket before the server's own queue starts to fill
+    HIGH_WATERMARK = 65536
+    LOW_WATERMARK = 16384
+    MESSAGE_COUNT = 8000
+    MESSAGE = "x" * 1000
+
+    def setUp(self):
+        self.tester = CRCFunctionalityTest(CRCTestManager().CRCServerImpl, CRCClient, False)
+        self.sockets = []
+
+    def tearDown(self):
+        self.tester.kill("ALL")
+        for sock in self.sockets:
+            sock.close()
+
+    def launch(self, port, policy, engine="selectors"):
+        server = self.tester.launch_server("--id 1 --servername theshire --port %d --info \"Home of the Hobbits\" --engine %s --write_high_watermark %d --write_low_watermark %d --slow_client_policy %s" % (port, engine, self.HIGH_WATERMARK, self.LOW_WATERMARK, policy))
+        time.sleep(0.25)
+        slow = self.connect_client(port, 102, "samgamgee", receive_buffer=4096)
+        fast = self.connect_client(port, 101, "frodobaggins")
+        time.sleep(0.25)
+        return server, slow, fast
+
+    def connect_client(self, port, id, name, receive_buffer=None):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sockets.append(sock)
+        if receive_buffer:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, receive_buffer)
+        sock.connect(('127.0.0.1', port))
+        sock.sendall(ClientRegistrationMessage.bytes(id, 0, name, "Test info"))
+        return sock
+
+    # Sends the chat messages from another thread, since they stop being read when the server applies
+    # backpressure
+    def flood(self, fast):
+        def send_all():
+            fast.settimeout(20)
+            try:
+                for i in range(self.MESSAGE_COUNT):
+                    fast.sendall(ClientChatMessage.bytes(101, 102, self.MESSAGE))
+            except OSError:
+                pass
+        x = threading.Thread(target=send_all, daemon=True)
+        x.start()
+        return x
+
+    # Waits until condition() is true, for up to timeout seconds
+    def wait_until(self, condition, timeout=20):
+        deadline = time.time() + timeout
+        while not condition() and time.time() < deadline:
+            time.sleep(0.1)
+        return condition()
+
+    # Reads every chat message sent to a socket until it has been idle for a second
+    def read_chats(self, sock):
+        sock.settimeout(1)
+        frame_decoder = FrameDecoder()
+        chats = 0
+        try:
+            while True:
+                data = sock.recv(65536)
+                if not data:
+                    break
+                chats += sum(1 for message in frame_decoder.feed(data) if message.message_type == 0x81)
+        except (socket.timeout, ConnectionError):
+            pass
+        return chats
+
+    # On the asyncio engine, messages are buffered by the connection's transport instead of its write queue
+    def queued_bytes(self, server, host_id):
+        io_device = server.get_io_device(server.next_hop(host_id))
+        queued = len(io_device.data.write_queue)
+        if server.async_engine:
+            queued += io_device.fileobj.transport.get_write_buffer_size()
+        return queued
+
+
+    def check_block_policy(self, port, engine):
+        server, slow, fast = self.launch(port, "block", engine)
+        sender = self.flood(fast)
+
+        # The sender stops being read from instead of the slow client's queue growing without limit. The 
+        # messages from the read that crossed the high watermark are still queued
+        self.assertTrue(self.wait_until(lambda: server.paused_reads))
+        time.sleep(0.5)
+        self.assertLessEqual(self.queued_bytes(server, 102), self.HIGH_WATERMARK + FrameDecoder.MAX_RECV_SIZE)
+        self.assertEqual(len(server.paused_reads), 1)
+        self.assertIn(server.next_hop(101), server.paused_reads)
+
+        # Once the slow client catches up, the sender is resumed and nothing has been lost
+        self.assertEqual(self.read_chats(slow), self.MESSAGE_COUNT)
+        sender.join(5)
+        self.assertEqual(len(server.paused_reads), 0)
+        self.assertEqual(len(server.paused_keys), 0)
+
+
+    def check_drop_policy(self, port, engine):
+        server, slow, fast = self.launch(port, "drop", engine)
+        sender = self.flood(fast)
+        sender.join(20)
+
+        # Chat messages for the slow client are dropped, and it stays connected
+        time.sleep(0.5)
+        self.assertLessEqual(self.queued_bytes(server, 102), self.HIGH_WATERMARK + len(self.MESSAGE) + 64)
+        self.assertEqual(len(server.paused_reads), 0)
+        self.assertIn(102, server.hosts_db)
+        self.assertLess(self.read_chats(slow), self.MESSAGE_COUNT)
+
+
+    def check_disconnect_policy(self, port, engine):
+        server, slow, fast = self.launch(port, "disconnect", engine)
+        sender = self.flood(fast)
+        sender.join(20)
+        time.sleep(0.5)
+
+        # The slow client is removed from the network and the sender is unaffected
+        self.assertNotIn(102, server.hosts_db)
+        self.assertIn(101, server.hosts_db)
+        self.assertEqual(len(server.paused_reads), 0)
+
+
+    @weight(1)
+    def test_block_policy(self):
+        self.check_block_policy(36801, "selectors")
+
+    @weight(1)
+    def test_drop_policy(self):
+        self.check_drop_policy(36802, "selectors")
+
+    @weight(1)
+    def test_disconnect_policy(self):
+        self.check_disconnect_policy(36803, "selectors")
+
+    @weight(1)
+    def test_block_policy_asyncio(self):
+        self.check_block_policy(36804, "asyncio")
+
+    @weight(1)
+    def test_drop_policy_asyncio(self):
+        self.check_drop_policy(36805, "asyncio")
+
+    @weight(1)
+    def test_disconnect_policy_asyncio(self):
+        self.check_disconnect_policy(36806, "asyncio")
+
+    @weight(1)
+    def test_flush_to_closed_peer(self):
+        options = SimpleNamespace(id=1, servername="theshire", info="Home of the Hobbits", port=0, connect_to_host=None,
+                                  connect_to_port=None, log_file=None)
+        server = CRCTestManager().CRCServerImpl(options, run_on_localhost=True)
+        sock, peer = socket.socketpair()
+        self.sockets.append(sock)
+        sock.setblocking(False)
+        server.sel.register(sock, selectors.EVENT_READ, BaseConnectionData())
+
+        # More than the socket can take is queued, and then the peer goes away before the rest is sent
+        server.queue_message(sock, ClientChatMessage.bytes(101, 102, "x" * 4000000))
+        self.assertTrue(server.get_io_device(sock).data.write_queue)
+        peer.close()
+        server.flush_io_device(server.get_io_device(sock))
+        self.assertEqual(sock.fileno(), -1)
@@ -0,0 +1,29 @@
+import unittest
+from gradescope_utils.autograder_utils.decorators import weight
+import threading, time, socket
+from types import SimpleNamespace
+from ChatClient import ClientEventLoop
+from ChatIO import WriteQueue
+from ChatMessageParser import *
+
+class TestClientEventLoop(unittest.TestCase):
+    @weight(1)
+    def test_remove_client_with_pending_read(self):
+        loop = ClientEventLoop()
+        loop.thread = threading.current_thread()
+        sock, server_end = socket.socketpair()
+        client = SimpleNamespace(sock=sock, frame_decoder=FrameDecoder(), write_queue=WriteQueue(), request_terminate=False,
+                                 handle_messages=lambda data: None, print_info=lambda msg: None)
+        loop.add_client(client)
+
+        # The client is removed and the loop stopped by callbacks that are handled in the same pass of the loop 
+        # as a READ event for the client's socket
+        loop.call_in_loop(loop.remove_client, client)
+        loop.call_in_loop(loop.stop)
+        server_end.sendall(StatusUpdateMessage.bytes(1, 101, 0x00, "Welcome"))
+        time.sleep(0.05)
+        try:
+            loop.run()
+            self.assertEqual(sock.fileno(), -1)
+        finally:
+            server_end.close()
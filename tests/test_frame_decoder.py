@@ -0,0 +1,139 @@
+import unittest
+from gradescope_utils.autograder_utils.decorators import weight
+import socket
+from ChatMessageParser import *
+
+class TestFrameDecoder(unittest.TestCase):
+    def setUp(self):
+        self.frames = [
+            ServerRegistrationMessage.bytes(2, 1, "rivendale", "Elronds House"),
+            ClientChatMessage.bytes(101, 102, "Hello Samwise"),
+            ClientQuitMessage.bytes(101, "Goodbye"),
+        ]
+
+    def check_messages(self, messages):
+        self.assertEqual([message.bytes for message in messages], self.frames)
+        self.assertEqual(messages[0].server_name, "rivendale")
+        self.assertEqual(messages[1].content, "Hello Samwise")
+        self.assertEqual(messages[2].source_id, 101)
+
+    # Copies data into the view returned by get_buffer() as though it had been read from a socket
+    def read(self, decoder, data):
+        view = decoder.get_buffer()
+        view[:len(data)] = data
+        return list(decoder.feed(decoder.buffer_updated(len(data))))
+
+
+    @weight(1)
+    def test_coalesced_frames(self):
+        decoder = FrameDecoder()
+        self.check_messages(list(decoder.feed(b''.join(self.frames))))
+        self.assertEqual(decoder.pending_bytes, 0)
+
+
+    @weight(1)
+    def test_split_frames(self):
+        # Every message is split across reads, including inside its fixed header
+        decoder = FrameDecoder()
+        data = b''.join(self.frames)
+        messages = []
+        for i in range(len(data)):
+            messages += decoder.feed(data[i:i + 1])
+            self.assertEqual(decoder.pending_bytes, i + 1 - sum(len(message.bytes) for message in messages))
+        self.check_messages(messages)
+
+
+    @weight(1)
+    def test_partial_frame_kept(self):
+        decoder = FrameDecoder()
+        data = b''.join(self.frames)
+        split = len(self.frames[0]) + 5
+        self.assertEqual(len(list(decoder.feed(data[:split]))), 1)
+        self.assertEqual(decoder.pending_bytes, 5)
+        self.assertEqual([message.bytes for message in decoder.feed(data[split:])], self.frames[1:])
+        self.assertEqual(decoder.pending_bytes, 0)
+
+
+    @weight(1)
+    def test_recv_into(self):
+        decoder = FrameDecoder()
+        sock, peer = socket.socketpair()
+        data = b''.join(self.frames)
+        try:
+            # The bytes are read straight into the decoder's buffer, and a partial message waits for the rest
+            peer.sendall(data[:-3])
+            received = decoder.recv_into(sock)
+            self.assertIs(received.obj, decoder.buffer)
+            messages = list(decoder.feed(received))
+            self.assertEqual(len(messages), 2)
+            self.assertEqual(decoder.pending_bytes, len(self.frames[2]) - 3)
+
+            peer.sendall(data[-3:])
+            self.check_messages(messages + list(decoder.feed(decoder.recv_into(sock))))
+
+            # An empty read means the peer closed the connection
+            peer.close()
+            self.assertEqual(len(decoder.recv_into(sock)), 0)
+        finally:
+            sock.close()
+            peer.close()
+
+
+    @weight(1)
+    def test_parse_messages(self):
+        self.check_messages(MessageParser.parse_messages(b''.join(self.frames)))
+        with self.assertRaises(Exception):
+            MessageParser.parse_messages(b''.join(self.frames)[:-1])
+
+
+    @weight(1)
+    def test_recv_size_grows(self):
+        # A read that fills the view doubles the size of the next one, up to MAX_RECV_SIZE
+        decoder = FrameDecoder()
+        expected_size = FrameDecoder.INITIAL_RECV_SIZE
+        while expected_size < FrameDecoder.MAX_RECV_SIZE:
+            view = decoder.get_buffer()
+            self.assertGreaterEqual(len(view), expected_size)
+            decoder.buffer_updated(len(view))
+            expected_size *= 2
+            self.assertEqual(decoder.recv_size, expected_size)
+        decoder.get_buffer()
+        decoder.buffer_updated(len(decoder.received))
+        self.assertEqual(decoder.recv_size, FrameDecoder.MAX_RECV_SIZE)
+
+
+    @weight(1)
+    def test_recv_size_shrinks(self):
+        decoder = FrameDecoder()
+        frame = self.frames[1]
+        for i in range(FrameDecoder.SMALL_READS_BEFORE_SHRINKING - 1):
+            self.assertEqual(len(self.read(decoder, frame)), 1)
+        self.assertEqual(decoder.recv_size, FrameDecoder.INITIAL_RECV_SIZE)
+
+        # A read that is not small starts the count again
+        self.read(decoder, frame * (FrameDecoder.INITIAL_RECV_SIZE // (2 * len(frame))))
+        for i in range(FrameDecoder.SMALL_READS_BEFORE_SHRINKING - 1):
+            self.read(decoder, frame)
+        self.assertEqual(decoder.recv_size, FrameDecoder.INITIAL_RECV_SIZE)
+        self.read(decoder, frame)
+        self.assertEqual(decoder.recv_size, FrameDecoder.INITIAL_RECV_SIZE // 2)
+
+        # Enough small reads bring the read size, and then the buffer, down to MIN_RECV_SIZE
+        for i in range(10 * FrameDecoder.SMALL_READS_BEFORE_SHRINKING):
+            self.read(decoder, frame)
+        self.assertEqual(decoder.recv_size, FrameDecoder.MIN_RECV_SIZE)
+        self.assertLess(len(decoder.buffer), FrameDecoder.INITIAL_RECV_SIZE)
+
+
+    @weight(1)
+    def test_partial_frame_kept_across_reallocation(self):
+        decoder = FrameDecoder()
+        frame = ClientChatMessage.bytes(101, 102, "x" * (2 * FrameDecoder.INITIAL_RECV_SIZE))
+
+        # The first read fills the view with part of the frame, so the next read gets a larger buffer
+        self.assertEqual(self.read(decoder, frame[:FrameDecoder.INITIAL_RECV_SIZE]), [])
+        old_buffer = decoder.buffer
+        messages = self.read(decoder, frame[FrameDecoder.INITIAL_RECV_SIZE:])
+        self.assertIsNot(decoder.buffer, old_buffer)
+        self.assertEqual([message.bytes for message in messages], [frame])
+        self.assertEqual(decoder.pending_bytes, 0)
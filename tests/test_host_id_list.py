@@ -0,0 +1,55 @@
+import unittest
+from gradescope_utils.autograder_utils.decorators import weight
+from ChatServer import HostIdList
+
+class TestHostIdList(unittest.TestCase):
+    def setUp(self):
+        self.ids = HostIdList([3, 1, 2])
+
+
+    @weight(1)
+    def test_list_operations(self):
+        self.assertEqual(len(self.ids), 3)
+        self.assertEqual(list(self.ids), [3, 1, 2])
+        self.assertEqual(self.ids, [3, 1, 2])
+        self.assertNotEqual(self.ids, [1, 2, 3])
+        self.assertEqual(self.ids[0], 3)
+        self.assertEqual(self.ids[-1], 2)
+        self.assertEqual(repr(self.ids), "[3, 1, 2]")
+        self.assertIn(1, self.ids)
+        self.assertNotIn(4, self.ids)
+        self.assertEqual(HostIdList(), [])
+
+
+    @weight(1)
+    def test_append(self):
+        # IDs keep the order they were appended in, and each ID is only stored once
+        self.ids.append(4)
+        self.ids.append(1)
+        self.assertEqual(self.ids, [3, 1, 2, 4])
+        self.assertEqual(HostIdList([5, 5, 6]), [5, 6])
+
+
+    @weight(1)
+    def test_remove(self):
+        self.ids.remove(1)
+        self.assertEqual(self.ids, [3, 2])
+        self.assertNotIn(1, self.ids)
+
+        # Like a list, removing a missing ID raises ValueError
+        with self.assertRaises(ValueError):
+            self.ids.remove(1)
+
+        # discard() ignores missing IDs
+        self.ids.discard(1)
+        self.ids.discard(3)
+        self.assertEqual(self.ids, [2])
+
+
+    @weight(1)
+    def test_many_ids(self):
+        ids = HostIdList(range(100000))
+        for id in range(0, 100000, 2):
+            ids.remove(id)
+        self.assertEqual(len(ids), 50000)
+        self.assertEqual(ids, list(range(1, 100000, 2)))
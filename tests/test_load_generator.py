@@ -0,0 +1,45 @@
+import unittest
+from gradescope_utils.autograder_utils.decorators import weight
+import json, os, tempfile
+from types import SimpleNamespace
+from CRCTestManager import CRCTestManager
+from CRCLoadGenerator import CRCLoadGenerator
+
+class TestLoadGenerator(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    # Writes a config for two connected servers listening on first_port and the port after it
+    def write_config(self, first_port):
+        config = {"type": "CRC_functionality", "commands": [
+            "LAUNCHSERVER --id 1 --servername theshire --port %d --info \"Home of the Hobbits\"" % first_port,
+            "WAIT 0.25",
+            "LAUNCHSERVER --id 2 --servername rivendale --port %d --info \"Elronds House\" --connect_to_host theshire --connect_to_port %d" % (first_port + 1, first_port),
+        ]}
+        path = os.path.join(self.directory.name, "load.cfg")
+        with open(path, 'w') as fp:
+            json.dump(config, fp)
+        return path
+
+    def run_load(self, first_port, distribution):
+        options = SimpleNamespace(config=self.write_config(first_port), launch_servers=True, clients=20, first_id=100000,
+                                  rate=200, duration=0.5, distribution=distribution, zipf_exponent=1.0, message_size=64,
+                                  full_presence=False, tick=0.01, timeout=5, drain=2, seed=1, verbose=False)
+        generator = CRCLoadGenerator(options, CRCServerImpl=CRCTestManager().CRCServerImpl)
+        generator.run()
+        return generator
+
+
+    @weight(1)
+    def test_load(self):
+        for first_port, distribution in ((36453, "uniform"), (36455, "zipf"), (36457, "local")):
+            with self.subTest(distribution):
+                generator = self.run_load(first_port, distribution)
+                self.assertEqual(generator.registered, 20)
+                self.assertGreater(generator.sent, 0)
+                self.assertEqual(generator.status_errors, 0)
+                self.assertEqual(generator.delivered, generator.sent)
+                self.assertEqual(len(generator.latencies), generator.sent)
@@ -0,0 +1,65 @@
+import unittest
+from gradescope_utils.autograder_utils.decorators import weight
+from ChatMessageParser import *
+from ChatServer import MessageBatch
+
+class TestMessageBatch(unittest.TestCase):
+    def setUp(self):
+        self.server = ServerRegistrationMessage.bytes(2, 1, "rivendale", "Elronds House")
+        self.frodo = ClientRegistrationMessage.bytes(101, 1, "frodobaggins", "Test info")
+        self.sam = ClientRegistrationMessage.bytes(102, 1, "samwise", "Test info")
+        self.frodo_quit = ClientQuitMessage.bytes(101, "Goodbye")
+
+
+    @weight(1)
+    def test_getvalue(self):
+        batch = MessageBatch()
+        for frame in (self.server, self.frodo, self.sam):
+            batch.append(frame)
+        self.assertEqual(batch.getvalue(), self.server + self.frodo + self.sam)
+        self.assertEqual(MessageBatch().getvalue(), b'')
+
+
+    @weight(1)
+    def test_join_quit_kept(self):
+        # Without cancel_join_quit both messages are sent
+        batch = MessageBatch()
+        for frame in (self.frodo, self.sam, self.frodo_quit):
+            batch.append(frame)
+        self.assertEqual(batch.getvalue(), self.frodo + self.sam + self.frodo_quit)
+        self.assertEqual(batch.cancelled, 0)
+
+
+    @weight(1)
+    def test_join_quit_cancelled(self):
+        batch = MessageBatch(cancel_join_quit=True)
+        for frame in (self.server, self.frodo, self.sam, self.frodo_quit):
+            batch.append(frame)
+        self.assertEqual(batch.getvalue(), self.server + self.sam)
+        self.assertEqual(batch.cancelled, 1)
+
+        # A quit for a client that did not register in this batch is still sent
+        batch.append(ClientQuitMessage.bytes(103, "Goodbye"))
+        batch.append(self.frodo_quit)
+        self.assertEqual(batch.getvalue(), self.server + self.sam + ClientQuitMessage.bytes(103, "Goodbye") + self.frodo_quit)
+        self.assertEqual(batch.cancelled, 1)
+
+
+    @weight(1)
+    def test_rejoin_after_cancel(self):
+        # A client that joins again after its registration was cancelled is registered normally
+        batch = MessageBatch(cancel_join_quit=True)
+        for frame in (self.frodo, self.frodo_quit, self.frodo):
+            batch.append(frame)
+        self.assertEqual(batch.getvalue(), self.frodo)
+        self.assertEqual(batch.cancelled, 1)
+
+
+    @weight(1)
+    def test_multiple_frames(self):
+        # A message holding several frames is queued as it is, so its registration cannot be cancelled
+        batch = MessageBatch(cancel_join_quit=True)
+        batch.append(self.frodo + self.sam)
+        batch.append(self.frodo_quit)
+        self.assertEqual(batch.getvalue(), self.frodo + self.sam + self.frodo_quit)
+        self.assertEqual(batch.cancelled, 0)
@@ -0,0 +1,106 @@
+import unittest
+from gradescope_utils.autograder_utils.decorators import weight
+from ChatMessageParser import *
+
+class TestMessageCodecs(unittest.TestCase):
+    SNAPSHOT_HOSTS = [(0x00, 2, "rivendale", "Elronds House"), (0x80, 101, "frodobaggins", "Test info")]
+
+    # Each entry is: (message class, arguments to its bytes() method, the fields the decoded message must have)
+    MESSAGES = [
+        (ServerRegistrationMessage, (2, 1, "rivendale", "Elronds House"),
+            {'message_type': 0x00, 'source_id': 2, 'last_hop_id': 1, 'server_name': "rivendale", 'server_info': "Elronds House"}),
+        (ClientRegistrationMessage, (101, 1, "frodobaggins", "Test info"),
+            {'message_type': 0x80, 'source_id': 101, 'last_hop_id': 1, 'client_name': "frodobaggins", 'client_info': "Test info"}),
+        (StatusUpdateMessage, (1, 101, 0x02, "A machine has already registered with ID 101"),
+            {'message_type': 0x01, 'source_id': 1, 'destination_id': 101, 'status_code': 0x02, 'content': "A machine has already registered with ID 101"}),
+        (ClientChatMessage, (101, 102, "Hello Samwise"),
+            {'message_type': 0x81, 'source_id': 101, 'destination_id': 102, 'content': "Hello Samwise"}),
+        (ServerQuitMessage, (2, 1, "127.0.0.1:36401"),
+            {'message_type': 0x02, 'source_id': 2, 'replacement_id': 1, 'content': "127.0.0.1:36401"}),
+        (ClientQuitMessage, (101, "Goodbye"),
+            {'message_type': 0x82, 'source_id': 101, 'content': "Goodbye"}),
+        (HostSnapshotMessage, (1, SNAPSHOT_HOSTS),
+            {'message_type': 0x03, 'source_id': 1, 'host_count': 2}),
+        (ClientIdRangeMessage, (2, 2000, 2999),
+            {'message_type': 0x04, 'source_id': 2, 'low_id': 2000, 'high_id': 2999}),
+        (IdLeaseRequestMessage, (3, 256),
+            {'message_type': 0x05, 'source_id': 3, 'id_count': 256}),
+        (IdLeaseGrantMessage, (2, 3, 0x40000000, 0x400000FF),
+            {'message_type': 0x06, 'source_id': 2, 'destination_id': 3, 'low_id': 0x40000000, 'high_id': 0x400000FF}),
+        (PresenceSubscribeMessage, (101, 0x00, [102, 103]),
+            {'message_type': 0x83, 'source_id': 101, 'action': 0x00, 'host_ids': [102, 103]}),
+        (RosterQueryMessage, (101, 100, 50),
+            {'message_type': 0x84, 'source_id': 101, 'after_id': 100, 'limit': 50}),
+        (ChannelMembershipMessage, (101, 7, 0x01),
+            {'message_type': 0x85, 'source_id': 101, 'channel_id': 7, 'action': 0x01}),
+        (ChannelChatMessage, (101, 7, "Hello Fellowship"),
+            {'message_type': 0x86, 'source_id': 101, 'channel_id': 7, 'content': "Hello Fellowship"}),
+    ]
+
+
+    @weight(1)
+    def test_round_trips(self):
+        for message_class, args, fields in self.MESSAGES:
+            with self.subTest(message_class.__name__):
+                frame = message_class.bytes(*args)
+                message = MessageParser.parse_messages(frame)[0]
+                self.assertIsInstance(message, message_class)
+                self.assertEqual(message.bytes, frame)
+                self.assertEqual(message.variable_message_length, len(frame))
+                for name, value in fields.items():
+                    self.assertEqual(getattr(message, name), value)
+
+
+    @weight(1)
+    def test_frame_length(self):
+        for message_class, args, fields in self.MESSAGES:
+            with self.subTest(message_class.__name__):
+                frame = message_class.bytes(*args)
+                self.assertEqual(MessageParser.frame_length(frame), len(frame))
+                self.assertEqual(MessageParser.frame_length(b'\xff' + frame, 1), len(frame))
+                self.assertIsNone(MessageParser.frame_length(frame[:5]))
+
+
+    @weight(1)
+    def test_decode_at_offset(self):
+        # Messages are decoded in place from a buffer holding several of them
+        frames = [message_class.bytes(*args) for message_class, args, fields in self.MESSAGES]
+        buffer = memoryview(b''.join(frames))
+        offset = 0
+        for (message_class, args, fields), frame in zip(self.MESSAGES, frames):
+            message = message_class(buffer, offset)
+            self.assertEqual(message.bytes, frame)
+            offset += len(frame)
+
+
+    @weight(1)
+    def test_utf8_lengths(self):
+        # Lengths are counted in encoded bytes, not characters
+        registration = ServerRegistrationMessage(ServerRegistrationMessage.bytes(2, 0, "Lothlórien", "Caras Galadhon ✦"))
+        self.assertEqual(registration.server_name, "Lothlórien")
+        self.assertEqual(registration.server_info, "Caras Galadhon ✦")
+        chat = ClientChatMessage(ClientChatMessage.bytes(101, 102, "Élen síla lúmenn' ✦"))
+        self.assertEqual(chat.content, "Élen síla lúmenn' ✦")
+
+
+    @weight(1)
+    def test_host_snapshot(self):
+        frame = HostSnapshotMessage.bytes(1, self.SNAPSHOT_HOSTS)
+        snapshot = HostSnapshotMessage(frame)
+        self.assertEqual(list(snapshot.hosts()), self.SNAPSHOT_HOSTS)
+
+        # A forwarded snapshot only has its source replaced
+        forwarded = HostSnapshotMessage(snapshot.forwarded_bytes(3))
+        self.assertEqual(forwarded.source_id, 3)
+        self.assertEqual(list(forwarded.hosts()), self.SNAPSHOT_HOSTS)
+
+        # Records cut out of encoded registrations match records encoded from scratch
+        records = [HostSnapshotMessage.registration_record(ServerRegistrationMessage.bytes(2, 5, "rivendale", "Elronds House")),
+                   HostSnapshotMessage.registration_record(ClientRegistrationMessage.bytes(101, 5, "frodobaggins", "Test info"))]
+        self.assertEqual(HostSnapshotMessage.from_records(1, records), frame)
+
+
+    @weight(1)
+    def test_with_last_hop(self):
+        registration = ClientRegistrationMessage.bytes(101, 1, "frodobaggins", "Test info")
+        self.assertEqual(RegistrationMessage.with_last_hop(registration, 7), ClientRegistrationMessage.bytes(101, 7, "frodobaggins", "Test info"))
@@ -0,0 +1,94 @@
+import unittest
+from gradescope_utils.autograder_utils.decorators import weight
+import os, tempfile
+from ChatIO import BoundedMessageLog
+
+class TestMessageLog(unittest.TestCase):
+    # Enough entries that the spill file holds several SPILL_INDEX_STRIDE-sized runs of them
+    ENTRY_COUNT = 3 * BoundedMessageLog.SPILL_INDEX_STRIDE + 10
+    MAX_ENTRIES = 100
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.spill_path = os.path.join(self.directory.name, "theshire.status_updates_log")
+        self.entries = ["Message %d" % i for i in range(self.ENTRY_COUNT)]
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def spilled_log(self):
+        log = BoundedMessageLog(self.MAX_ENTRIES, self.spill_path)
+        log.extend(self.entries)
+        return log
+
+
+    @weight(1)
+    def test_spill(self):
+        log = self.spilled_log()
+        self.assertEqual(len(log.entries), self.MAX_ENTRIES)
+        self.assertEqual(log.spilled, self.ENTRY_COUNT - self.MAX_ENTRIES)
+        self.assertEqual(log.dropped, 0)
+        self.assertEqual(len(log), self.ENTRY_COUNT)
+        self.assertTrue(os.path.exists(self.spill_path))
+        log.close()
+
+
+    @weight(1)
+    def test_readback(self):
+        log = self.spilled_log()
+        self.assertEqual(list(log), self.entries)
+        self.assertEqual(log, self.entries)
+        self.assertIn("Message 0", log)
+        self.assertNotIn("Message %d" % self.ENTRY_COUNT, log)
+        log.close()
+
+
+    @weight(1)
+    def test_indexing_across_stride(self):
+        log = self.spilled_log()
+        stride = BoundedMessageLog.SPILL_INDEX_STRIDE
+        for i in (0, 1, stride - 1, stride, stride + 1, 2 * stride, log.spilled - 1, log.spilled, -1, -self.ENTRY_COUNT):
+            self.assertEqual(log[i], self.entries[i])
+        self.assertEqual(log[stride - 2:stride + 2], self.entries[stride - 2:stride + 2])
+        self.assertEqual(log[log.spilled - 5:log.spilled + 5], self.entries[log.spilled - 5:log.spilled + 5])
+        with self.assertRaises(IndexError):
+            log[self.ENTRY_COUNT]
+        log.close()
+
+
+    @weight(1)
+    def test_close(self):
+        log = self.spilled_log()
+        log.close()
+        self.assertIsNone(log.spill_file)
+
+        # A closed log can still be read, and reopens its spill file if more entries are appended
+        self.assertEqual(list(log), self.entries)
+        self.assertEqual(log[BoundedMessageLog.SPILL_INDEX_STRIDE], self.entries[BoundedMessageLog.SPILL_INDEX_STRIDE])
+        log.extend(["Message after close %d" % i for i in range(self.MAX_ENTRIES)])
+        self.assertEqual(list(log)[:self.ENTRY_COUNT], self.entries)
+        self.assertEqual(log[self.ENTRY_COUNT - 1], self.entries[-1])
+        log.close()
+
+
+    @weight(1)
+    def test_clear(self):
+        log = self.spilled_log()
+        log.clear()
+        self.assertEqual(len(log), 0)
+        self.assertEqual(list(log), [])
+        self.assertFalse(os.path.exists(self.spill_path))
+
+        # A cleared log starts a new spill file
+        log.extend(self.entries[:self.MAX_ENTRIES + 1])
+        self.assertEqual(list(log), self.entries[:self.MAX_ENTRIES + 1])
+        log.close()
+
+
+    @weight(1)
+    def test_ring_buffer_without_spill_file(self):
+        log = BoundedMessageLog(self.MAX_ENTRIES)
+        log.extend(self.entries)
+        self.assertEqual(log.dropped, self.ENTRY_COUNT - self.MAX_ENTRIES)
+        self.assertEqual(list(log), self.entries[-self.MAX_ENTRIES:])
+        log.close()
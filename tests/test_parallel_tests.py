@@ -0,0 +1,54 @@
+import unittest
+from gradescope_utils.autograder_utils.decorators import weight
+import copy
+from CRCTestManager import CRCTestManager
+
+class TestParallelTests(unittest.TestCase):
+    CONFIG = {
+        "type": "CRC_functionality",
+        "commands": [
+            "LAUNCHSERVER --id 1 --servername theshire --port 36401 --info \"Home of the Hobbits\" --log-file theshire.log",
+            "WAIT 0.25",
+            "LAUNCHSERVER --id 2 --servername rivendale --port 36402 --info \"Elronds House\" --log-file rivendale.log --connect_to_host theshire --connect_to_port 36401",
+            "LAUNCHCLIENT --id 101 --serverhost rivendale --serverport 36402 --username frodobaggins --info \"Test info\" --log-file frodobaggins.log",
+            "KILL ALL"
+        ],
+        "final_state": {"theshire": {"hosts_db": [2, 101]}}
+    }
+
+
+    @weight(1)
+    def test_remap_test_config(self):
+        config = copy.deepcopy(self.CONFIG)
+        remapped = CRCTestManager().remap_test_config(config, "3_1_OneServer_OneClient", 20100, 100)
+
+        # Ports are numbered from the start of the block in the order they first appear, and every use of a port
+        # is given the same new port
+        self.assertEqual(remapped['commands'], [
+            "LAUNCHSERVER --id 1 --servername theshire --port 20100 --info \"Home of the Hobbits\" --log-file 3_1_OneServer_OneClient.theshire.log",
+            "WAIT 0.25",
+            "LAUNCHSERVER --id 2 --servername rivendale --port 20101 --info \"Elronds House\" --log-file 3_1_OneServer_OneClient.rivendale.log --connect_to_host theshire --connect_to_port 20100",
+            "LAUNCHCLIENT --id 101 --serverhost rivendale --serverport 20101 --username frodobaggins --info \"Test info\" --log-file 3_1_OneServer_OneClient.frodobaggins.log",
+            "KILL ALL"
+        ])
+        self.assertEqual(remapped['final_state'], self.CONFIG['final_state'])
+        self.assertEqual(remapped['type'], self.CONFIG['type'])
+
+        # The original config is left alone
+        self.assertEqual(config, self.CONFIG)
+
+
+    @weight(1)
+    def test_remap_too_many_ports(self):
+        with self.assertRaises(Exception):
+            CRCTestManager().remap_test_config(self.CONFIG, "3_1_OneServer_OneClient", 20100, 1)
+
+
+    @weight(1)
+    def test_run_tests_in_parallel(self):
+        tests = {'3_1_OneServer_OneClient':1, '3_2_OneServer_TwoClients':2}
+        score, results = CRCTestManager().run_tests_in_parallel(tests, workers=2, port_base=36500, ports_per_test=10)
+        self.assertEqual([result['test'] for result in results], sorted(tests.keys()))
+        for result in results:
+            self.assertTrue(result['passed'], result['errors'])
+        self.assertEqual(score, 3)
@@ -0,0 +1,75 @@
+import unittest
+from gradescope_utils.autograder_utils.decorators import weight
+from CRCTestManager import CRCTestManager
+
+class TestProtocolExtensions(unittest.TestCase):
+    def setUp(self):
+        pass
+    
+    def tearDown(self):
+        pass
+
+
+    @weight(2)
+    def test_host_snapshot_late_join(self):
+        test_manager = CRCTestManager()
+    
+        CRC_connection_tests = {
+            # Tests servers joining a network that already has hosts, which they learn about from host snapshots
+            '8_1_HostSnapshot_LateJoin':2,
+        }
+
+        result = test_manager.run_tests(CRC_connection_tests)
+        self.assertTrue(result[1][0]['passed'], result[1][0]['errors'])
+
+
+    @weight(2)
+    def test_client_id_ranges(self):
+        test_manager = CRCTestManager()
+    
+        CRC_connection_tests = {
+            # Tests routing to clients by the ID range of the server they are connected to
+            '8_2_ClientIdRanges':2,
+        }
+
+        result = test_manager.run_tests(CRC_connection_tests)
+        self.assertTrue(result[1][0]['passed'], result[1][0]['errors'])
+
+
+    @weight(2)
+    def test_id_leases(self):
+        test_manager = CRCTestManager()
+    
+        CRC_connection_tests = {
+            # Tests hosts that connect with an ID of 0 being assigned IDs from leased blocks
+            '8_3_IdLeases':2,
+        }
+
+        result = test_manager.run_tests(CRC_connection_tests)
+        self.assertTrue(result[1][0]['passed'], result[1][0]['errors'])
+
+
+    @weight(2)
+    def test_presence_roster(self):
+        test_manager = CRCTestManager()
+    
+        CRC_connection_tests = {
+            # Tests clients that subscribe to the presence of a few clients, or page through the roster
+            '8_4_Presence_Roster':2,
+        }
+
+        result = test_manager.run_tests(CRC_connection_tests)
+        self.assertTrue(result[1][0]['passed'], result[1][0]['errors'])
+
+
+    @weight(2)
+    def test_channels(self):
+        test_manager = CRCTestManager()
+    
+        CRC_connection_tests = {
+            # Tests channel messages reaching the members of a channel, and only them
+            '8_5_Channels':2,
+        }
+
+        result = test_manager.run_tests(CRC_connection_tests)
+        self.assertTrue(result[1][0]['passed'], result[1][0]['errors'])
@@ -0,0 +1,51 @@
+import unittest
+from gradescope_utils.autograder_utils.decorators import weight
+from ChatMessageParser import *
+from ChatServer import ServerConnectionData, ClientConnectionData
+
+class TestRegistrationCache(unittest.TestCase):
+    def setUp(self):
+        self.server = ServerConnectionData(2, "rivendale", "Elronds House")
+        self.client = ClientConnectionData(101, "frodobaggins", "Test info")
+
+
+    @weight(1)
+    def test_registration_frame(self):
+        self.assertEqual(self.server.registration_frame(1), ServerRegistrationMessage.bytes(2, 1, "rivendale", "Elronds House"))
+        self.assertEqual(self.client.registration_frame(1), ClientRegistrationMessage.bytes(101, 1, "frodobaggins", "Test info"))
+
+
+    @weight(1)
+    def test_cached(self):
+        # Asking again with the same LastHopID returns the same bytes object
+        frame = self.client.registration_frame(1)
+        self.assertIs(self.client.registration_frame(1), frame)
+
+        # A different LastHopID only rewrites that field
+        self.assertEqual(self.client.registration_frame(3), ClientRegistrationMessage.bytes(101, 3, "frodobaggins", "Test info"))
+        self.assertEqual(self.client.registration[0], 3)
+
+
+    @weight(1)
+    def test_invalidated_by_field_change(self):
+        for host, field, value in ((self.server, "server_name", "imladris"), (self.server, "server_info", "The Last Homely House"),
+                                   (self.server, "id", 5), (self.client, "client_name", "mrunderhill"),
+                                   (self.client, "client_info", "Prancing Pony"), (self.client, "id", 105)):
+            with self.subTest(field):
+                frame = host.registration_frame(1)
+                record = host.snapshot_record()
+                setattr(host, field, value)
+                self.assertIsNone(host.registration)
+                self.assertIsNone(host.record)
+                self.assertNotEqual(host.registration_frame(1), frame)
+                self.assertNotEqual(host.snapshot_record(), record)
+                self.assertEqual(host.registration_frame(1), host.encode_registration(1))
+
+
+    @weight(1)
+    def test_snapshot_record(self):
+        self.server.registration_frame(1)
+        record = self.server.snapshot_record()
+        self.assertIs(self.server.snapshot_record(), record)
+        snapshot = HostSnapshotMessage(HostSnapshotMessage.from_records(1, [record, self.client.snapshot_record()]))
+        self.assertEqual(list(snapshot.hosts()), [(0x00, 2, "rivendale", "Elronds House"), (0x80, 101, "frodobaggins", "Test info")])
@@ -0,0 +1,158 @@
+from struct import pack
+from sys import flags
+import unittest
+from gradescope_utils.autograder_utils.decorators import weight
+from gradescope_utils.autograder_utils.files import check_submitted_files
+import concurrent.futures
+import binascii, time, traceback
+import random, socket, struct
+from CRCTestManager import CRCTestManager
+from ChatClient import CRCClient
+from ChatMessageParser import *
+from Testers.CRCFunctionalityTest import CRCFunctionalityTest
+
+class TestServerQuits(unittest.TestCase):
+    def setUp(self):
+        pass
+    
+    def tearDown(self):
+        pass
+
+
+    @weight(3)
+    def test_server_lost_purge_on_disconnect(self):
+        test_manager = CRCTestManager()
+    
+        CRC_connection_tests = {
+            # Tests servers leaving the network
+            '7_1_ServerLost_PurgeOnDisconnect':3,
+        }
+
+        result = test_manager.run_tests(CRC_connection_tests)
+        self.assertTrue(result[1][0]['passed'], result[1][0]['errors'])
+
+
+    @weight(3)
+    def test_server_quit_mid_tree(self):
+        test_manager = CRCTestManager()
+    
+        CRC_connection_tests = {
+            # Tests servers leaving the network
+            '7_2_ServerQuit_MidTree':3,
+        }
+
+        result = test_manager.run_tests(CRC_connection_tests)
+        self.assertTrue(result[1][0]['passed'], result[1][0]['errors'])
+
+
+    @weight(3)
+    def test_server_quit_root(self):
+        test_manager = CRCTestManager()
+    
+        CRC_connection_tests = {
+            # Tests servers leaving the network
+            '7_3_ServerQuit_Root':3,
+        }
+
+        result = test_manager.run_tests(CRC_connection_tests)
+        self.assertTrue(result[1][0]['passed'], result[1][0]['errors'])
+
+
+    @weight(3)
+    def test_server_quit_two_in_a_row(self):
+        test_manager = CRCTestManager()
+    
+        CRC_connection_tests = {
+            # Tests servers leaving the network
+            '7_4_ServerQuit_TwoInARow':3,
+        }
+
+        result = test_manager.run_tests(CRC_connection_tests)
+        self.assertTrue(result[1][0]['passed'], result[1][0]['errors'])
+
+
+    # Sets up a server with a raw socket posing as an adjacent server (ID 2) that has a client (ID 103) behind
+    # it, and has that server quit naming this one as its replacement, so that client 103 is adopted
+    def adopt_orphan(self, port, extra_args=""):
+        self.tester = CRCFunctionalityTest(CRCTestManager().CRCServerImpl, CRCClient, False)
+        server = self.tester.launch_server("--id 1 --servername theshire --port %d --info \"Home of the Hobbits\" %s" % (port, extra_args))
+        time.sleep(0.25)
+        self.sockets = [socket.create_connection(('127.0.0.1', port))]
+        self.sockets[0].sendall(ServerRegistrationMessage.bytes(2, 0, "rivendale", "Elronds House") +
+                                ClientRegistrationMessage.bytes(103, 2, "bilbobaggins", "Test info"))
+        time.sleep(0.25)
+        self.sockets[0].sendall(ServerQuitMessage.bytes(2, 1, "127.0.0.1:%d" % port))
+        time.sleep(0.25)
+        return server
+
+    def close_raw_socket_test(self):
+        self.tester.kill("ALL")
+        for sock in self.sockets:
+            sock.close()
+
+
+    @weight(1)
+    def test_orphan_quits_before_relink(self):
+        server = self.adopt_orphan(36441)
+        try:
+            self.assertIn(103, server.orphaned_hosts)
+
+            # The adopted client quits before it is relinked, and then a new client registers with its ID
+            self.sockets[0].sendall(ClientQuitMessage.bytes(103, "Leaving"))
+            time.sleep(0.25)
+            self.assertNotIn(103, server.orphaned_hosts)
+            self.sockets.append(socket.create_connection(('127.0.0.1', 36441)))
+            self.sockets[1].sendall(ClientRegistrationMessage.bytes(103, 0, "bilbobaggins", "Test info"))
+            time.sleep(0.25)
+            self.assertIn(103, server.hosts_db)
+            self.assertIn(103, server.adjacent_user_ids)
+            self.assertTrue(self.tester.threads["theshire"]['thread'].is_alive())
+        finally:
+            self.close_raw_socket_test()
+
+
+    @weight(1)
+    def test_orphans_expire(self):
+        server = self.adopt_orphan(36442, "--orphan_timeout 0.5")
+        try:
+            self.assertIn(103, server.hosts_db)
+
+            # Nothing relinks the adopted client, so it is forgotten once the orphan timeout is over
+            time.sleep(1)
+            self.assertNotIn(103, server.hosts_db)
+            self.assertNotIn(103, server.orphaned_hosts)
+            self.assertIsNone(server.next_hop(103))
+        finally:
+            self.close_raw_socket_test()
+
+
+    @weight(1)
+    def test_quit_with_stalled_peers(self):
+        self.tester = CRCFunctionalityTest(CRCTestManager().CRCServerImpl, CRCClient, False)
+        server = self.tester.launch_server("--id 1 --servername theshire --port 36443 --info \"Home of the Hobbits\"")
+        time.sleep(0.25)
+
+        # Three adjacent servers that never read, each with far more queued for it than its socket can hold
+        self.sockets = []
+        for server_id in (2, 3, 4):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+            sock.connect(('127.0.0.1', 36443))
+            sock.sendall(ServerRegistrationMessage.bytes(server_id, 0, "server%d" % server_id, "Never reads"))
+            self.sockets.append(sock)
+        time.sleep(0.25)
+        def fill_write_queues():
+            for server_id in (2, 3, 4):
+                server.queue_message(server.next_hop(server_id), bytes(16 * 1048576))
+        server.call_in_loop(fill_write_queues)
+        time.sleep(0.25)
+
+        # The server gives up on all of them together once its one second drain deadline has passed
+        try:
+            start = time.monotonic()
+            server.quit_network()
+            self.tester.threads["theshire"]['thread'].join(5)
+            self.assertFalse(self.tester.threads["theshire"]['thread'].is_alive())
+            self.assertLess(time.monotonic() - start, 2.5)
+        finally:
+            self.close_raw_socket_test()
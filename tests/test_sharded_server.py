@@ -0,0 +1,124 @@
+import unittest
+from gradescope_utils.autograder_utils.decorators import weight
+import selectors, socket, time
+from types import SimpleNamespace
+from CRCTestManager import CRCTestManager
+from ChatMessageParser import *
+from ChatServer import BaseConnectionData
+from ShardedChatServer import ShardWorker, ShardedCRCServer, SHARD_LINK_ID_BASE
+
+class TestShardedServer(unittest.TestCase):
+    def setUp(self):
+        self.sockets = []
+
+    def tearDown(self):
+        for sock in self.sockets:
+            sock.close()
+
+    # Creates one worker of a sharded server without starting its main loop. Its sibling links are UNIX
+    # sockets whose other ends are never read
+    def make_worker(self, shard_index, link_ids, shard_count):
+        shard_links = {}
+        for link_id in link_ids:
+            shard_links[link_id], other_end = socket.socketpair()
+            self.sockets += [shard_links[link_id], other_end]
+        server_class = CRCTestManager().CRCServerImpl
+        worker_class = type("Sharded" + server_class.__name__, (ShardWorker, server_class), {})
+        options = SimpleNamespace(id=5, servername="moria", info="The Mines of Moria", port=0, connect_to_host=None,
+                                  connect_to_port=None, log_file=None)
+        worker = worker_class(options, run_on_localhost=True, shard_index=shard_index, shard_links=shard_links,
+                              shard_count=shard_count)
+        worker.register_shard_links()
+        return worker
+
+    # Returns a connection registered with worker's selector, and the other end of it
+    def connect(self, worker):
+        sock, other_end = socket.socketpair()
+        self.sockets += [sock, other_end]
+        sock.setblocking(False)
+        other_end.settimeout(1)
+        return worker.sel.register(sock, selectors.EVENT_READ, BaseConnectionData()), other_end
+
+    def receive(self, other_end):
+        return list(FrameDecoder().feed(other_end.recv(65536)))
+
+    # Connects a client to a server listening on port, retrying while the server starts up
+    def connect_client(self, port):
+        deadline = time.monotonic() + 2
+        while True:
+            try:
+                sock = socket.create_connection(("127.0.0.1", port), timeout=2)
+                self.sockets.append(sock)
+                return sock
+            except ConnectionRefusedError:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.05)
+
+    # Reads messages from sock until one of them satisfies done, and returns every message read
+    def receive_until(self, sock, decoder, messages, done):
+        while not done(messages):
+            data = sock.recv(65536)
+            self.assertTrue(data, "The server closed the connection")
+            messages += list(decoder.feed(data))
+        return messages
+
+
+    @weight(1)
+    def test_reserved_link_ids(self):
+        # Worker 1 of 3 is only linked to worker 0, but must not accept the link ID of worker 2 or its own
+        worker = self.make_worker(1, [SHARD_LINK_ID_BASE], 3)
+        for host_id in (SHARD_LINK_ID_BASE - 2, SHARD_LINK_ID_BASE - 1):
+            io_device, other_end = self.connect(worker)
+            worker.handle_messages(io_device, ClientRegistrationMessage.bytes(host_id, 0, "sauron", "Test info"))
+            status = self.receive(other_end)[0]
+            self.assertEqual((status.message_type, status.status_code), (0x01, 0x02))
+            self.assertNotIn(host_id, worker.hosts_db)
+
+
+    @weight(1)
+    def test_move_subtree_skips_links(self):
+        worker = self.make_worker(0, [SHARD_LINK_ID_BASE - 1], 2)
+        quitting, _ = self.connect(worker)
+        worker.handle_messages(quitting, ServerRegistrationMessage.bytes(2, 0, "rivendale", "Elronds House"))
+        worker.handle_messages(worker.sel.get_key(quitting.fileobj), ServerRegistrationMessage.bytes(1, 2, "theshire", "Home of the Hobbits"))
+
+        # The worker's parent quits and names server 1 as the replacement. The relinks sent to it must not
+        # announce the sibling link
+        replacement, other_end = self.connect(worker)
+        worker.move_subtree(ServerQuitMessage(ServerQuitMessage.bytes(2, 1, "127.0.0.1:1")), quitting.fileobj, replacement.fileobj)
+        source_ids = [message.source_id for message in self.receive(other_end)]
+        self.assertIn(worker.id, source_ids)
+        self.assertNotIn(SHARD_LINK_ID_BASE - 1, source_ids)
+
+
+
+    @weight(1)
+    def test_clients_chat_across_workers(self):
+        # The kernel spreads the clients over both workers, so most chats cross the link between them
+        options = SimpleNamespace(id=5, servername="moria", info="The Mines of Moria", port=36451, connect_to_host=None,
+                                  connect_to_port=None, log_file=None)
+        server = ShardedCRCServer(options, 2, run_on_localhost=True, CRCServerImpl=CRCTestManager().CRCServerImpl)
+        server.start()
+        try:
+            client_ids = list(range(101, 109))
+            clients = {}
+            for client_id in client_ids:
+                clients[client_id] = (self.connect_client(options.port), FrameDecoder(), [])
+                clients[client_id][0].sendall(ClientRegistrationMessage.bytes(client_id, 0, "client%d" % client_id, "Test info"))
+
+            # Every client hears about every other client before any chats are sent
+            for client_id, (sock, decoder, messages) in clients.items():
+                self.receive_until(sock, decoder, messages, lambda messages:
+                    {message.source_id for message in messages if message.message_type == 0x80} >= set(client_ids) - {client_id})
+
+            for i, client_id in enumerate(client_ids):
+                destination_id = client_ids[(i + 1) % len(client_ids)]
+                clients[client_id][0].sendall(ClientChatMessage.bytes(client_id, destination_id, "Hello client%d" % destination_id))
+            for i, client_id in enumerate(client_ids):
+                sock, decoder, messages = clients[client_id]
+                chats = self.receive_until(sock, decoder, [], lambda messages: any(message.message_type == 0x81 for message in messages))
+                chat = [message for message in chats if message.message_type == 0x81][0]
+                self.assertEqual((chat.source_id, chat.destination_id, chat.content), (client_ids[i - 1], client_id, "Hello client%d" % client_id))
+        finally:
+            server.stop()
@@ -0,0 +1,111 @@
+import unittest
+from gradescope_utils.autograder_utils.decorators import weight
+import socket
+from ChatIO import WriteQueue
+
+class TestWriteQueue(unittest.TestCase):
+    def setUp(self):
+        self.frames = [b'a' * 10, b'b' * 20, b'c' * 30]
+        self.queue = WriteQueue()
+        for frame in self.frames:
+            self.queue.append(frame)
+
+    # A non-blocking socket pair with small kernel buffers, so a large queue is only partly sent by one flush
+    def small_socketpair(self):
+        sock, peer = socket.socketpair()
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4096)
+        peer.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+        sock.setblocking(False)
+        return sock, peer
+
+
+    @weight(1)
+    def test_append(self):
+        self.assertEqual(len(self.queue), 60)
+        self.assertTrue(self.queue)
+        self.assertEqual(self.queue.getvalue(), b''.join(self.frames))
+
+        # Empty frames are not queued
+        self.queue.append(b'')
+        self.assertEqual(len(self.queue.frames), 3)
+        self.assertFalse(WriteQueue())
+        self.assertEqual(WriteQueue().getvalue(), b'')
+
+
+    @weight(1)
+    def test_consume(self):
+        # Part of the first frame is remembered as an offset into it
+        self.queue.consume(5)
+        self.assertEqual(self.queue.offset, 5)
+        self.assertEqual(len(self.queue.frames), 3)
+        self.assertEqual(len(self.queue), 55)
+        self.assertEqual(self.queue.getvalue(), b''.join(self.frames)[5:])
+
+        # Frames that have been sent completely are dropped
+        self.queue.consume(15)
+        self.assertEqual(self.queue.offset, 10)
+        self.assertEqual(list(self.queue.frames), self.frames[1:])
+        self.assertEqual(self.queue.getvalue(), b''.join(self.frames)[20:])
+
+        self.queue.consume(10)
+        self.assertEqual(self.queue.offset, 0)
+        self.assertEqual(list(self.queue.frames), self.frames[2:])
+
+        self.queue.consume(30)
+        self.assertFalse(self.queue)
+        self.assertEqual(self.queue.getvalue(), b'')
+
+
+    @weight(1)
+    def test_clear(self):
+        self.queue.consume(5)
+        self.queue.clear()
+        self.assertEqual(len(self.queue), 0)
+        self.assertEqual(self.queue.offset, 0)
+        self.assertEqual(self.queue.getvalue(), b'')
+
+
+    @weight(1)
+    def test_flush(self):
+        sock, peer = socket.socketpair()
+        try:
+            self.assertEqual(self.queue.flush(sock), 60)
+            self.assertFalse(self.queue)
+            self.assertEqual(peer.recv(1024), b''.join(self.frames))
+            self.assertEqual(self.queue.flush(sock), 0)
+        finally:
+            sock.close()
+            peer.close()
+
+
+    @weight(1)
+    def test_partial_flush(self):
+        sock, peer = self.small_socketpair()
+        data = b''.join(bytes([i % 256]) * 1000 for i in range(1000))
+        queue = WriteQueue()
+        for i in range(0, len(data), 1000):
+            queue.append(data[i:i + 1000])
+        try:
+            # The socket only accepts part of the queue, and a full socket sends nothing
+            sent = queue.flush(sock)
+            self.assertGreater(sent, 0)
+            self.assertLess(sent, len(data))
+            while queue.flush(sock):
+                pass
+
+            # The unsent bytes start part way through a frame
+            sent = len(data) - len(queue)
+            self.assertEqual(queue.offset, sent % 1000)
+            self.assertEqual(len(queue.frames), len(data) // 1000 - sent // 1000)
+            self.assertEqual(queue.getvalue(), data[sent:])
+
+            # Everything arrives in order once the peer reads
+            received = bytearray()
+            while len(received) < len(data):
+                received += peer.recv(65536)
+                queue.flush(sock)
+            self.assertFalse(queue)
+            self.assertEqual(bytes(received), data)
+        finally:
+            sock.close()
+            peer.close()